@@ -0,0 +1,155 @@
+import io
+import os
+import tarfile
+import zipfile
+from typing import BinaryIO
+
+# حجم الجزء المقروء من كل ملف أثناء بناء الأرشيف
+PACKAGE_CHUNK_SIZE = int(os.environ.get("PACKAGE_CHUNK_SIZE", str(256 * 1024)))
+
+# صيغ الأرشيف المدعومة ونوع المحتوى لكل منها
+ARCHIVE_MEDIA_TYPES = {
+    "zip": "application/zip",
+    "tar": "application/x-tar",
+}
+
+
+class _ChunkWriter(io.RawIOBase):
+    """كائن كتابة غير قابل للتنقل (seek) يجمع ما يكتبه zipfile ليتم إرساله فورًا.
+
+    لأنه غير قابل للتنقل، يكتب zipfile الأحجام في data descriptor بعد كل ملف
+    بدلاً من الرجوع لتعديل الترويسة، فلا حاجة لملف مؤقت على القرص.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def unique_arcnames(files: list[tuple[str, str]]) -> list[tuple[str, str]]:
+    # تجنب تكرار الأسماء داخل الأرشيف (مثل عنصرين بنفس العنوان)
+    seen = set()
+    result = []
+    for arcname, path in files:
+        base, ext = os.path.splitext(arcname)
+        candidate, n = arcname, 1
+        while candidate in seen:
+            n += 1
+            candidate = f"{base} ({n}){ext}"
+        seen.add(candidate)
+        result.append((candidate, path))
+    return result
+
+
+def iter_zip(files: list[tuple[str, str]], chunk_size: int = PACKAGE_CHUNK_SIZE):
+    """بناء أرشيف ZIP بدون ضغط (stored) على شكل أجزاء متتالية بذاكرة ثابتة.
+
+    files: قائمة (الاسم داخل الأرشيف، المسار على القرص).
+    """
+    writer = _ChunkWriter()
+    with zipfile.ZipFile(writer, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for arcname, path in unique_arcnames(files):
+            zinfo = zipfile.ZipInfo.from_file(path, arcname)
+            zinfo.compress_type = zipfile.ZIP_STORED
+            with open(path, "rb") as src, zf.open(zinfo, "w") as dst:
+                while True:
+                    chunk = src.read(chunk_size)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    data = writer.drain()
+                    if data:
+                        yield data
+            data = writer.drain()
+            if data:
+                yield data
+    data = writer.drain()
+    if data:
+        yield data
+
+
+def _tar_header(arcname: str, stat_result: os.stat_result) -> bytes:
+    tarinfo = tarfile.TarInfo(arcname)
+    tarinfo.size = stat_result.st_size
+    tarinfo.mtime = int(stat_result.st_mtime)
+    tarinfo.mode = 0o644
+    # صيغة PAX تدعم الأسماء غير اللاتينية والملفات الأكبر من 8 غيغابايت
+    return tarinfo.tobuf(format=tarfile.PAX_FORMAT, encoding="utf-8")
+
+
+def _tar_padding(size: int) -> int:
+    return -size % tarfile.BLOCKSIZE
+
+
+def open_tar_entries(files: list[tuple[str, str]]) -> list[tuple[str, BinaryIO, os.stat_result]]:
+    """فتح ملفات أرشيف TAR مسبقًا: (الاسم داخل الأرشيف، الملف المفتوح، حالته من نفس الواصف).
+
+    الحجم المعلن في Content-Length وفي ترويسات TAR يُؤخذ من الملفات المفتوحة نفسها التي
+    يُقرأ منها المحتوى، فلا يتغير بين الحساب والبث إذا استُبدل الملف أو حُذف في الأثناء.
+    الملفات التي حُذفت أو لا يمكن فتحها تُتجاهل.
+    """
+    entries = []
+    try:
+        for arcname, path in unique_arcnames(files):
+            try:
+                src = open(path, "rb")
+            except OSError:
+                continue
+            entries.append((arcname, src, os.fstat(src.fileno())))
+    except BaseException:
+        close_tar_entries(entries)
+        raise
+    return entries
+
+
+def close_tar_entries(entries: list[tuple[str, BinaryIO, os.stat_result]]):
+    for _, src, _ in entries:
+        src.close()
+
+
+def tar_size(entries: list[tuple[str, BinaryIO, os.stat_result]]) -> int:
+    """الحجم الدقيق لأرشيف TAR قبل بنائه، لإرسال Content-Length."""
+    total = 0
+    for arcname, _, stat_result in entries:
+        size = stat_result.st_size
+        total += len(_tar_header(arcname, stat_result)) + size + _tar_padding(size)
+    return total + 2 * tarfile.BLOCKSIZE
+
+
+def iter_tar(entries: list[tuple[str, BinaryIO, os.stat_result]], chunk_size: int = PACKAGE_CHUNK_SIZE):
+    """بناء أرشيف TAR غير مضغوط من ملفات open_tar_entries على شكل أجزاء متتالية بذاكرة ثابتة.
+
+    tarfile.addfile يقرأ الملف كاملاً قبل أن نتمكن من إرسال أي جزء، لذلك نكتب
+    الترويسة بأنفسنا ثم ننقل محتوى الملف جزءًا بجزء. يُقرأ من كل ملف الحجم المعلن
+    بالضبط حتى يطابق الناتج tar_size، وتُغلق الملفات عند الانتهاء.
+    """
+    try:
+        for arcname, src, stat_result in entries:
+            yield _tar_header(arcname, stat_result)
+            remaining = stat_result.st_size
+            while remaining:
+                chunk = src.read(min(chunk_size, remaining))
+                if not chunk:
+                    # الملف قُص أثناء البث: لا يمكن الوفاء بالحجم المعلن، فيُقطع الأرشيف بدلاً من إفساده
+                    raise OSError(f"{arcname} was truncated while archiving")
+                remaining -= len(chunk)
+                yield chunk
+            padding = _tar_padding(stat_result.st_size)
+            if padding:
+                yield tarfile.NUL * padding
+        # كتلتان فارغتان تحددان نهاية الأرشيف
+        yield tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+    finally:
+        close_tar_entries(entries)
+
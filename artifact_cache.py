@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+# الحد الأقصى لحجم ملفات الذاكرة المؤقتة على القرص (بالبايت)
+ARTIFACT_CACHE_MAX_BYTES = int(os.environ.get("ARTIFACT_CACHE_MAX_BYTES", str(10 * 1024 * 1024 * 1024)))
+# سياسة الإزالة عند تجاوز الحجم: "lru" (الأقدم استخدامًا) أو "lfu" (الأقل استخدامًا)
+ARTIFACT_CACHE_POLICY = os.environ.get("ARTIFACT_CACHE_POLICY", "lru").lower()
+
+INDEX_FILE_NAME = "index.json"
+
+
+def artifact_key(extractor: str, video_id: str, format_id: str) -> str:
+    raw = json.dumps([extractor, video_id, format_id], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def request_alias(normalized_url: str, format_string: str) -> str:
+    # اسم مستعار يربط الطلب (الرابط + محدد الصيغة) بالملف دون الحاجة إلى استخراج المعلومات
+    raw = json.dumps(["request", normalized_url, format_string], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ArtifactCache:
+    """ذاكرة مؤقتة دائمة للملفات المنزلة، مفهرسة بـ (المستخرج، معرف الفيديو، الصيغة).
+
+    الملفات تُنقل إلى مجلد الذاكرة المؤقتة بعملية rename ذرية، والفهرس يُحفظ في
+    index.json ليبقى بعد إعادة تشغيل الخادم.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = ARTIFACT_CACHE_MAX_BYTES,
+                 policy: str = ARTIFACT_CACHE_POLICY):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: dict[str, dict] = {}
+        self._aliases: dict[str, str] = {}
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(entry["size"] for entry in self._entries.values())
+
+    def path_for(self, entry: dict) -> str:
+        return os.path.join(self.directory, entry["file"])
+
+    @staticmethod
+    def key_for(entry: dict) -> str:
+        # اسم الملف في الذاكرة المؤقتة هو المفتاح متبوعًا بالامتداد
+        return os.path.splitext(entry["file"])[0]
+
+    def _load_index(self):
+        index_path = os.path.join(self.directory, INDEX_FILE_NAME)
+        try:
+            with open(index_path, encoding="utf-8") as f:
+                entries = json.load(f).get("entries", {})
+        except FileNotFoundError:
+            entries = {}
+        except (OSError, ValueError) as e:
+            print(f"Artifact cache index is unreadable, starting empty: {e}")
+            entries = {}
+
+        # تجاهل العناصر التي فُقدت ملفاتها، وحذف الملفات غير الموجودة في الفهرس
+        self._entries = {
+            key: entry for key, entry in entries.items()
+            if os.path.isfile(os.path.join(self.directory, entry["file"]))
+        }
+        self._aliases = {
+            alias: key for key, entry in self._entries.items() for alias in entry.get("aliases", [])
+        }
+        known_files = {entry["file"] for entry in self._entries.values()}
+        for name in os.listdir(self.directory):
+            if name != INDEX_FILE_NAME and name not in known_files:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+        print(f"Artifact cache loaded: {len(self._entries)} entries, {self.total_bytes} bytes")
+
+    def _save_index(self):
+        index_path = os.path.join(self.directory, INDEX_FILE_NAME)
+        tmp_path = f"{index_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"entries": self._entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, index_path)
+
+    def lookup(self, key: str = None, alias: str = None):
+        """يعيد عنصر الذاكرة المؤقتة (dict) حسب المفتاح أو الاسم المستعار، أو None."""
+        with self._lock:
+            alias_only = key is None
+            if alias_only:
+                key = self._aliases.get(alias)
+            entry = self._entries.get(key)
+            if entry is not None and not os.path.isfile(self.path_for(entry)):
+                self._forget(key)
+                entry = None
+            if entry is None:
+                # فشل البحث بالاسم المستعار وحده يتبعه بحث بالمفتاح، فلا نحسبه مرتين
+                if not alias_only:
+                    self.misses += 1
+                return None
+            entry["last_access"] = time.time()
+            entry["hits"] += 1
+            self.hits += 1
+            if alias and alias not in self._aliases:
+                self._aliases[alias] = key
+                entry.setdefault("aliases", []).append(alias)
+            return dict(entry)
+
+    def _forget(self, key: str):
+        entry = self._entries.pop(key)
+        for alias in entry.get("aliases", []):
+            self._aliases.pop(alias, None)
+
+    def publish(self, key: str, source_path: str, display_name: str, meta: dict = None,
+                alias: str = None) -> dict:
+        """نقل ملف منزل إلى الذاكرة المؤقتة (rename ذري) وإعادة عنصره."""
+        ext = os.path.splitext(display_name)[1]
+        file_name = f"{key}{ext}"
+        dest_path = os.path.join(self.directory, file_name)
+        size = os.path.getsize(source_path)
+        os.replace(source_path, dest_path)
+        now = time.time()
+        entry = {
+            "file": file_name,
+            "name": display_name,
+            "size": size,
+            "created": now,
+            "last_access": now,
+            "hits": 0,
+            "meta": meta or {},
+            "aliases": [alias] if alias else [],
+        }
+        with self._lock:
+            if key in self._entries:
+                self._forget(key)
+            self._entries[key] = entry
+            if alias:
+                self._aliases[alias] = key
+            self._evict(keep=key)
+            self._save_index()
+        return dict(entry)
+
+    def _evict(self, keep: str = None):
+        if self.policy == "lfu":
+            sort_key = lambda item: (item[1]["hits"], item[1]["last_access"])
+        else:
+            sort_key = lambda item: item[1]["last_access"]
+        total = self.total_bytes
+        for key, entry in sorted(self._entries.items(), key=sort_key):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            try:
+                os.remove(self.path_for(entry))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Error evicting cached artifact {entry['file']}: {e}")
+                continue
+            self._forget(key)
+            total -= entry["size"]
+            self.evictions += 1
+            print(f"Evicted cached artifact {entry['name']} ({entry['size']} bytes)")
+
+    def close(self):
+        with self._lock:
+            self._save_index()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "policy": self.policy,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            }
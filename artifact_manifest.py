@@ -0,0 +1,121 @@
+import os
+import time
+import threading
+
+
+class ArtifactManifest:
+    """ملفات نتيجة مهمة واحدة كما أبلغ عنها yt-dlp عبر hooks، بدلاً من البحث في مجلد التنزيل.
+
+    المجلد قد يكون مشتركًا بين المهام (المجلد المخصص للمستخدم)، فلا يُعرف منه أي الملفات
+    تخص هذه المهمة. هنا يُسجل المسار النهائي من post_hooks (بعد الدمج ونقل الملفات)، والملفات
+    الإضافية (الترجمات والصورة المصغرة) من معالج MoveFiles، والتيارات المنزلة من حالة finished
+    في progress_hooks، ومدة كل معالج لاحق من postprocessor_hooks.
+    """
+
+    def __init__(self):
+        self.main_path = None
+        self.extra_paths: list[str] = []
+        # كل تيار منزل: المسار وعدد البايتات ومعرف الصيغة
+        self.streams: list[dict] = []
+        # مدة كل معالج لاحق بالثواني (Merger و MoveFiles وغيرها)
+        self.postprocessors: dict[str, float] = {}
+        self.download_finished_at = None
+        self._postprocessor_started: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def ydl_overrides(self) -> dict:
+        """خيارات YoutubeDL التي تربط hooks هذا السجل (تُمرر عند الاستعارة من المجمع)."""
+        return {'postprocessor_hooks': [self.postprocessor_hook], 'post_hooks': [self.post_hook]}
+
+    def progress_hook(self, d: dict):
+        if d['status'] != 'finished':
+            return
+        info = d.get('info_dict') or {}
+        with self._lock:
+            self.streams.append({
+                "path": d.get('filename'),
+                "bytes": d.get('downloaded_bytes') or d.get('total_bytes') or 0,
+                "format_id": d.get('format_id') or info.get('format_id'),
+            })
+            self.download_finished_at = time.perf_counter()
+
+    def postprocessor_hook(self, d: dict):
+        name = d.get('postprocessor')
+        if d['status'] == 'started':
+            with self._lock:
+                self._postprocessor_started[name] = time.perf_counter()
+            return
+        if d['status'] != 'finished':
+            return
+        with self._lock:
+            started = self._postprocessor_started.pop(name, None)
+            if started is not None:
+                self.postprocessors[name] = round(self.postprocessors.get(name, 0) + time.perf_counter() - started, 3)
+        if name == 'MoveFiles':
+            self._record_moved_files(d.get('info_dict') or {})
+
+    def _record_moved_files(self, info: dict):
+        main_path = info.get('filepath')
+        final_dir = info.get('__finaldir') or os.path.dirname(main_path or '')
+        # __files_to_move قد يتضمن ملف الوسائط نفسه بصيغة مسار مختلفة (نسبي/مطلق)
+        seen = {os.path.abspath(main_path)} if main_path else set()
+        extras = []
+        for old_path, new_path in (info.get('__files_to_move') or {}).items():
+            path = new_path or os.path.join(final_dir, os.path.basename(old_path))
+            if os.path.abspath(path) not in seen:
+                seen.add(os.path.abspath(path))
+                extras.append(path)
+        with self._lock:
+            self.main_path = main_path or self.main_path
+            self.extra_paths = extras
+
+    def post_hook(self, filepath: str):
+        # يُستدعى بعد كل المعالجات اللاحقة بالمسار النهائي لملف الوسائط
+        self.set_main(filepath)
+
+    def set_main(self, path: str):
+        with self._lock:
+            self.main_path = path
+
+    @property
+    def downloaded_bytes(self) -> int:
+        with self._lock:
+            return sum(stream["bytes"] for stream in self.streams)
+
+    def finalize(self) -> list[tuple[str, str, int]]:
+        """الملفات الموجودة فعلاً: (الاسم، المسار، الحجم)، وملف الوسائط أولاً. عملية ملفات تُنفذ في خيط."""
+        with self._lock:
+            if not self.main_path:
+                return []
+            # post_hook قد يغير مسار ملف الوسائط بعد MoveFiles، فيُستبعد من الملفات الإضافية هنا أيضًا
+            main_path = os.path.abspath(self.main_path)
+            paths = [self.main_path, *(path for path in self.extra_paths if os.path.abspath(path) != main_path)]
+        files = []
+        for path in paths:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            files.append((os.path.basename(path), path, size))
+        return files
+
+    def to_record(self) -> dict:
+        """حالة قابلة للنقل بين العمليات (من عملية التنزيل الفرعية إلى الخادم)."""
+        with self._lock:
+            return {"main_path": self.main_path, "extra_paths": list(self.extra_paths),
+                    "postprocessors": dict(self.postprocessors)}
+
+    def merge(self, record: dict):
+        with self._lock:
+            self.main_path = record.get("main_path") or self.main_path
+            self.extra_paths = record.get("extra_paths") or self.extra_paths
+            self.postprocessors.update(record.get("postprocessors") or {})
+
+    def summary(self, files: list[tuple[str, str, int]]) -> dict:
+        with self._lock:
+            return {
+                "files": [{"name": name, "size": size} for name, _, size in files],
+                "formats": [stream["format_id"] for stream in self.streams if stream["format_id"]],
+                "downloaded_bytes": sum(stream["bytes"] for stream in self.streams),
+                "postprocessors": dict(self.postprocessors),
+            }
@@ -0,0 +1,229 @@
+"""موقع وسائط اصطناعي محلي لقياس الأداء دون الاتصال بمواقع حقيقية.
+
+الخادم يعمل بوضع الاستخراج العام فقط (force_generic_extractor)، لذا يؤدي هذا الموقع
+دور "المستخرج": صفحة HTML5 لكل فيديو فيها مصادر تقدمية (MP4 بعدة ارتفاعات)
+وقائمة HLS وملف DASH، يفهمها المستخرج العام في yt-dlp كما يفهم المواقع الحقيقية.
+المحتوى بايتات حتمية تُولد عند الطلب (لا شيء يُقرأ من القرص) مع دعم Range.
+
+    python -m benchmarks.media_server --port 8090
+"""
+import os
+import re
+import time
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# كتلة 64KiB ثابتة تتكرر لتكوين محتوى أي ملف
+_BLOCK = b"".join(hashlib.sha256(i.to_bytes(4, "big")).digest() for i in range(2048))
+
+# الارتفاعات المتاحة لكل فيديو، ومدة مقطع HLS/DASH بالثواني
+HEIGHTS = (360, 720)
+SEGMENT_SECONDS = 2
+
+
+class MediaSite:
+    def __init__(self, media_size: int = 8 * 1024 * 1024, segments: int = 8, rate: int = 0):
+        # حجم أعلى جودة بالبايت؛ الجودات الأقل أصغر بنسبة ارتفاعها
+        self.media_size = media_size
+        self.segments = segments
+        # سرعة الإرسال القصوى لكل اتصال (بايت/ثانية)، 0 بلا حد
+        self.rate = rate
+        self.requests = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+    def size_for(self, height: int) -> int:
+        return self.media_size * height // max(HEIGHTS)
+
+    @property
+    def audio_size(self) -> int:
+        return max(self.media_size // 8, 1)
+
+    def page(self, kind: str, video_id: str) -> str:
+        """صفحة الفيديو. kind يحدد المصادر: progressive أو hls أو dash أو all."""
+        sources = []
+        if kind in ("progressive", "all"):
+            sources.extend(
+                f'<source src="/media/{video_id}/{height}.mp4" type="video/mp4" label="{height}p" res="{height}">'
+                for height in reversed(HEIGHTS)
+            )
+        if kind in ("hls", "all"):
+            sources.append(f'<source src="/hls/{video_id}/master.m3u8" type="application/x-mpegURL">')
+        if kind in ("dash", "all"):
+            sources.append(f'<source src="/dash/{video_id}/manifest.mpd" type="application/dash+xml">')
+        return (f"<!DOCTYPE html><html><head><title>Bench {video_id}</title></head><body>"
+                f"<video controls>\n" + "\n".join(sources) + "\n</video></body></html>")
+
+    def hls_master(self, video_id: str) -> str:
+        lines = ["#EXTM3U"]
+        for height in HEIGHTS:
+            bandwidth = self.size_for(height) * 8 // (self.segments * SEGMENT_SECONDS)
+            lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={height * 16 // 9}x{height},'
+                         f'CODECS="avc1.4d401f,mp4a.40.2"')
+            lines.append(f"{height}/index.m3u8")
+        return "\n".join(lines) + "\n"
+
+    def hls_media(self) -> str:
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{SEGMENT_SECONDS}",
+                 "#EXT-X-MEDIA-SEQUENCE:0", "#EXT-X-PLAYLIST-TYPE:VOD"]
+        for n in range(self.segments):
+            lines.extend([f"#EXTINF:{SEGMENT_SECONDS}.0,", f"seg{n}.ts"])
+        lines.append("#EXT-X-ENDLIST")
+        return "\n".join(lines) + "\n"
+
+    def dash_manifest(self) -> str:
+        duration = self.segments * SEGMENT_SECONDS
+        video = "\n".join(
+            f'<Representation id="v{height}" bandwidth="{self.size_for(height) * 8 // duration}" '
+            f'codecs="avc1.4d401f" width="{height * 16 // 9}" height="{height}"/>'
+            for height in HEIGHTS
+        )
+        template = (f'<SegmentTemplate timescale="1" duration="{SEGMENT_SECONDS}" startNumber="0" '
+                    f'initialization="$RepresentationID$/init.mp4" media="$RepresentationID$/seg$Number$.m4s"/>')
+        return (f'<?xml version="1.0" encoding="UTF-8"?>\n'
+                f'<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" minBufferTime="PT2S" '
+                f'mediaPresentationDuration="PT{duration}S" profiles="urn:mpeg:dash:profile:isoff-live:2011">'
+                f'<Period>'
+                f'<AdaptationSet mimeType="video/mp4" contentType="video">{template}\n{video}</AdaptationSet>'
+                f'<AdaptationSet mimeType="audio/mp4" contentType="audio" lang="en">{template}'
+                f'<Representation id="a128" bandwidth="{self.audio_size * 8 // duration}" codecs="mp4a.40.2" '
+                f'audioSamplingRate="44100"/></AdaptationSet>'
+                f'</Period></MPD>')
+
+    def segment_size(self, total: int) -> int:
+        return max(total // self.segments, 1)
+
+    def record(self, sent: int):
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += sent
+
+
+def _representation_size(site: MediaSite, representation: str) -> int:
+    if representation.startswith("a"):
+        return site.audio_size
+    return site.size_for(int(representation.lstrip("v")))
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    site: MediaSite = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._route(send_body=False)
+
+    def do_GET(self):
+        self._route(send_body=True)
+
+    def _route(self, send_body: bool):
+        path = self.path.split("?", 1)[0]
+        site = self.site
+        routes = (
+            (r"/bench/(?P<kind>progressive|hls|dash|all)/(?P<id>[\w-]+)",
+             lambda m: self._text(site.page(m["kind"], m["id"]), "text/html; charset=utf-8")),
+            (r"/media/[\w-]+/(?P<h>\d+)\.mp4", lambda m: self._bytes(site.size_for(int(m["h"])), "video/mp4")),
+            (r"/hls/(?P<id>[\w-]+)/master\.m3u8",
+             lambda m: self._text(site.hls_master(m["id"]), "application/vnd.apple.mpegurl")),
+            (r"/hls/[\w-]+/\d+/index\.m3u8", lambda m: self._text(site.hls_media(), "application/vnd.apple.mpegurl")),
+            (r"/hls/[\w-]+/(?P<h>\d+)/seg\d+\.ts",
+             lambda m: self._bytes(site.segment_size(site.size_for(int(m["h"]))), "video/mp2t")),
+            (r"/dash/[\w-]+/manifest\.mpd", lambda m: self._text(site.dash_manifest(), "application/dash+xml")),
+            (r"/dash/[\w-]+/(?P<rep>[va]\d+)/init\.mp4", lambda m: self._bytes(1024, "video/mp4")),
+            (r"/dash/[\w-]+/(?P<rep>[va]\d+)/seg\d+\.m4s",
+             lambda m: self._bytes(site.segment_size(_representation_size(site, m["rep"])), "video/iso.segment")),
+        )
+        self._send_body = send_body
+        for pattern, handler in routes:
+            match = re.fullmatch(pattern, path)
+            if match:
+                handler(match)
+                return
+        self.send_error(404)
+
+    def _text(self, text: str, content_type: str):
+        body = text.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self._send_body:
+            self.wfile.write(body)
+        self.site.record(len(body) if self._send_body else 0)
+
+    def _bytes(self, size: int, content_type: str):
+        start, end = 0, size - 1
+        range_header = self.headers.get("Range")
+        match = re.fullmatch(r"bytes=(\d*)-(\d*)", range_header or "")
+        if match and (match[1] or match[2]):
+            if match[1]:
+                start = int(match[1])
+                end = min(int(match[2]), size - 1) if match[2] else size - 1
+            else:
+                start = max(size - int(match[2]), 0)
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        if not self._send_body:
+            return
+        sent = 0
+        offset = start
+        started = time.monotonic()
+        try:
+            while offset <= end:
+                block_offset = offset % len(_BLOCK)
+                chunk = _BLOCK[block_offset:block_offset + min(end - offset + 1, len(_BLOCK) - block_offset)]
+                self.wfile.write(chunk)
+                offset += len(chunk)
+                sent += len(chunk)
+                if self.site.rate:
+                    ahead = sent / self.site.rate - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.site.record(sent)
+
+
+def start(site: MediaSite, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """تشغيل الخادم في خيط خلفي. port=0 يختار منفذًا متاحًا (server.server_port)."""
+    handler = type("BoundMediaHandler", (MediaHandler,), {"site": site})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic progressive/HLS/DASH media site")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("BENCH_MEDIA_PORT", "8090")))
+    parser.add_argument("--media-size", type=int, default=8 * 1024 * 1024)
+    parser.add_argument("--segments", type=int, default=8)
+    parser.add_argument("--rate", type=int, default=0, help="per-connection bytes/second (0 = unlimited)")
+    args = parser.parse_args()
+    server = start(MediaSite(args.media_size, args.segments, args.rate), args.host, args.port)
+    print(f"Serving synthetic media on http://{args.host}:{server.server_port}/bench/<progressive|hls|dash|all>/<id>")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
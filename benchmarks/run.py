@@ -0,0 +1,363 @@
+"""قياس أداء الخادم محليًا: /api/info ثم /api/download ثم متابعة التقدم عبر WebSocket
+ثم تنزيل الملف الناتج، بعدد متزامن قابل للضبط، مقابل موقع الوسائط الاصطناعي.
+
+    python -m benchmarks.run --scenario hls --concurrency 8 --iterations 32
+    python -m benchmarks.run --json results.json
+    python -m benchmarks.run --baseline results.json   # يفشل (رمز خروج 1) عند التراجع
+
+بدون --server يُشغل الخادم (uvicorn main:app) في مجلد عمل مؤقت ويُقاس استهلاكه للذاكرة (RSS)
+وتأخر حلقة الأحداث فيه من /metrics.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+import httpx
+import websockets
+
+from benchmarks.media_server import MediaSite, start as start_media_server
+from download_workers import process_rss
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# نوع الصيغة المطلوب لكل سيناريو: DASH يفصل الفيديو عن الصوت، فنطلب الفيديو فقط حتى لا يلزم ffmpeg
+SCENARIO_FORMATS = {
+    "progressive": "فيديو + صوت",
+    "hls": "فيديو + صوت",
+    "dash": "فيديو فقط",
+}
+
+# المقاييس التي تُقارن بخط الأساس: (المفتاح، هل القيمة الأعلى أفضل)
+COMPARED_METRICS = (
+    ("info_ms.p99", False),
+    ("submit_ms.p99", False),
+    ("first_progress_ms.p99", False),
+    ("job_ms.p50", False),
+    ("job_ms.p99", False),
+    ("fetch_mib_per_s.p50", True),
+    ("jobs_per_second", True),
+)
+
+
+def percentile(values: list, q: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def summarize(values: list) -> dict:
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 50), 2),
+        "p99": round(percentile(values, 99), 2),
+        "max": round(max(values), 2),
+    }
+
+
+def histogram_buckets(metrics_text: str, name: str) -> dict:
+    buckets = {}
+    for line in metrics_text.splitlines():
+        if line.startswith(f"{name}_bucket{{"):
+            labels, _, value = line.rpartition(" ")
+            bound = labels.split('le="', 1)[1].split('"', 1)[0]
+            buckets[float(bound.replace("+Inf", "inf"))] = float(value)
+    return buckets
+
+
+def histogram_quantile(before: dict, after: dict, q: float):
+    """الحد الأعلى للفئة التي تقع فيها النسبة q من القياسات بين لقطتين (مثل histogram_quantile)."""
+    bounds = sorted(after)
+    counts = [after[b] - before.get(b, 0) for b in bounds]
+    total = counts[-1] if counts else 0
+    if not total:
+        return None
+    for bound, cumulative in zip(bounds, counts):
+        if cumulative >= total * q:
+            return bound
+    return bounds[-1]
+
+
+class Results:
+    def __init__(self):
+        self.info_ms = []
+        self.submit_ms = []
+        self.first_progress_ms = []
+        self.job_ms = []
+        self.fetch_ms = []
+        self.fetch_mib_per_s = []
+        self.bytes_fetched = 0
+        self.errors = []
+
+
+async def run_iteration(client: httpx.AsyncClient, ws_base: str, url: str, format_type: str, results: Results):
+    started = time.perf_counter()
+    response = await client.post("/api/info", json={"url": url})
+    response.raise_for_status()
+    results.info_ms.append((time.perf_counter() - started) * 1000)
+    options = response.json()["format_tokens"].get(format_type) or {}
+    if not options:
+        raise RuntimeError(f"no {format_type} formats for {url}")
+    # أعلى جودة متاحة (التسميات مرتبة رقميًا تصاعديًا)
+    token = list(options.values())[-1]["token"]
+
+    submitted = time.perf_counter()
+    response = await client.post("/api/download", json={"url": url, "format_token": token})
+    response.raise_for_status()
+    results.submit_ms.append((time.perf_counter() - submitted) * 1000)
+    job_id = response.json()["job_id"]
+
+    download_url = None
+    async with websockets.connect(f"{ws_base}/ws/jobs/{job_id}") as ws:
+        first_progress = None
+        async for raw in ws:
+            message = json.loads(raw)
+            status = message.get("status")
+            if status == "downloading" and first_progress is None:
+                first_progress = time.perf_counter()
+                results.first_progress_ms.append((first_progress - submitted) * 1000)
+            if status == "error":
+                raise RuntimeError(message.get("message"))
+            if status == "finished":
+                download_url = message.get("download_url")
+                break
+    results.job_ms.append((time.perf_counter() - submitted) * 1000)
+
+    fetched = 0
+    fetch_started = time.perf_counter()
+    async with client.stream("GET", download_url) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes():
+            fetched += len(chunk)
+    fetch_seconds = time.perf_counter() - fetch_started
+    results.fetch_ms.append(fetch_seconds * 1000)
+    results.bytes_fetched += fetched
+    if fetch_seconds > 0:
+        results.fetch_mib_per_s.append(fetched / fetch_seconds / (1024 * 1024))
+
+
+async def run_benchmark(args, server_url: str, media_url: str, server_pid=None) -> dict:
+    results = Results()
+    ws_base = server_url.replace("http://", "ws://", 1).replace("https://", "wss://", 1)
+    rss_samples = []
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+
+    async with httpx.AsyncClient(base_url=server_url, timeout=args.timeout, limits=limits) as client:
+        metrics_before = (await client.get("/metrics")).text
+        queue = asyncio.Queue()
+        for n in range(args.iterations):
+            scenario = args.scenarios[n % len(args.scenarios)]
+            video_id = "shared" if args.repeat_url else f"{args.run_id}-{n}"
+            queue.put_nowait((f"{media_url}/bench/{scenario}/{video_id}", SCENARIO_FORMATS[scenario]))
+
+        async def worker():
+            while True:
+                try:
+                    url, format_type = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    await asyncio.wait_for(run_iteration(client, ws_base, url, format_type, results), args.timeout)
+                except Exception as e:
+                    results.errors.append(f"{url}: {type(e).__name__}: {e}")
+
+        async def sample_rss():
+            while True:
+                rss = process_rss(server_pid)
+                if rss:
+                    rss_samples.append(rss)
+                await asyncio.sleep(0.25)
+
+        sampler = asyncio.create_task(sample_rss()) if server_pid else None
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        wall_seconds = time.perf_counter() - started
+        if sampler:
+            sampler.cancel()
+        metrics_after = (await client.get("/metrics")).text
+
+    lag_before = histogram_buckets(metrics_before, "event_loop_lag_seconds")
+    lag_after = histogram_buckets(metrics_after, "event_loop_lag_seconds")
+    completed = len(results.job_ms)
+    report = {
+        "scenarios": args.scenarios,
+        "concurrency": args.concurrency,
+        "iterations": args.iterations,
+        "completed": completed,
+        "errors": len(results.errors),
+        "wall_seconds": round(wall_seconds, 2),
+        "jobs_per_second": round(completed / wall_seconds, 2) if wall_seconds else None,
+        "fetched_mib": round(results.bytes_fetched / (1024 * 1024), 1),
+        "info_ms": summarize(results.info_ms),
+        "submit_ms": summarize(results.submit_ms),
+        "first_progress_ms": summarize(results.first_progress_ms),
+        "job_ms": summarize(results.job_ms),
+        "fetch_ms": summarize(results.fetch_ms),
+        "fetch_mib_per_s": summarize(results.fetch_mib_per_s),
+        "event_loop_lag_ms": {
+            "p50": _ms(histogram_quantile(lag_before, lag_after, 0.5)),
+            "p99": _ms(histogram_quantile(lag_before, lag_after, 0.99)),
+        },
+        "server_rss_mib": {
+            "start": _mib(rss_samples[0]) if rss_samples else None,
+            "peak": _mib(max(rss_samples)) if rss_samples else None,
+            "end": _mib(rss_samples[-1]) if rss_samples else None,
+        },
+        "error_samples": results.errors[:5],
+    }
+    return report
+
+
+def _ms(seconds):
+    return None if seconds is None else (round(seconds * 1000, 2) if seconds != float("inf") else "inf")
+
+
+def _mib(value):
+    return round(value / (1024 * 1024), 1)
+
+
+def _lookup(report: dict, dotted: str):
+    value = report
+    for part in dotted.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def compare_with_baseline(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for key, higher_is_better in COMPARED_METRICS:
+        current, previous = _lookup(report, key), _lookup(baseline, key)
+        if not isinstance(current, (int, float)) or not isinstance(previous, (int, float)) or not previous:
+            continue
+        change = (current - previous) / previous
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            regressions.append(f"{key}: {previous} -> {current} ({change:+.0%})")
+    return regressions
+
+
+def print_report(report: dict):
+    print(f"\nScenarios: {', '.join(report['scenarios'])}  concurrency: {report['concurrency']}  "
+          f"completed: {report['completed']}/{report['iterations']}  errors: {report['errors']}")
+    print(f"Wall time: {report['wall_seconds']}s  jobs/s: {report['jobs_per_second']}  "
+          f"fetched: {report['fetched_mib']} MiB")
+    print(f"{'metric':<22}{'p50':>10}{'p99':>10}{'max':>10}")
+    for key in ("info_ms", "submit_ms", "first_progress_ms", "job_ms", "fetch_ms", "fetch_mib_per_s"):
+        stats = report[key]
+        print(f"{key:<22}{stats.get('p50', '-'):>10}{stats.get('p99', '-'):>10}{stats.get('max', '-'):>10}")
+    lag = report["event_loop_lag_ms"]
+    print(f"{'event_loop_lag_ms':<22}{lag['p50'] or '-':>10}{lag['p99'] or '-':>10}{'':>10}")
+    rss = report["server_rss_mib"]
+    if rss["peak"] is not None:
+        print(f"Server RSS: start {rss['start']} MiB, peak {rss['peak']} MiB, end {rss['end']} MiB")
+    for error in report["error_samples"]:
+        print(f"  error: {error}")
+
+
+def spawn_server(port: int, work_dir: str, extra_env: dict) -> subprocess.Popen:
+    # حدود المعدل ومساحة القرص تُعطل افتراضيًا حتى يقيس الاختبار الخادم نفسه (يمكن تجاوزها من البيئة)
+    env = {
+        "CLIENT_REQUESTS_PER_MINUTE": "0",
+        "HOST_REQUESTS_PER_MINUTE": "0",
+        "DISK_MIN_FREE": "0",
+        **os.environ,
+        **extra_env,
+    }
+    log = open(os.path.join(work_dir, "server.log"), "w")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", REPO_DIR,
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=work_dir, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+
+
+async def wait_until_ready(server_url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=server_url, timeout=2) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get("/api/ydl/pool")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server at {server_url} did not become ready")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local end-to-end benchmark for the downloader service")
+    parser.add_argument("--scenario", default="progressive,hls,dash",
+                        help="comma-separated: progressive, hls, dash")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--iterations", type=int, default=12)
+    parser.add_argument("--media-size", type=int, default=8 * 1024 * 1024, help="bytes of the highest quality")
+    parser.add_argument("--segments", type=int, default=8, help="HLS/DASH segments per stream")
+    parser.add_argument("--rate", type=int, default=0, help="media server bytes/second per connection")
+    parser.add_argument("--repeat-url", action="store_true", help="reuse one video (measures the cached path)")
+    parser.add_argument("--server", help="benchmark an already running server instead of spawning one")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--env", action="append", default=[], help="KEY=VALUE for the spawned server")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--baseline", help="compare with a previous --json report and fail on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression (0.2 = 20%%)")
+    args = parser.parse_args()
+    args.scenarios = [s.strip() for s in args.scenario.split(",") if s.strip()]
+    unknown = [s for s in args.scenarios if s not in SCENARIO_FORMATS]
+    if unknown:
+        parser.error(f"unknown scenario: {', '.join(unknown)}")
+    args.run_id = f"r{int(time.time())}"
+
+    media_server = start_media_server(MediaSite(args.media_size, args.segments, args.rate))
+    media_url = f"http://127.0.0.1:{media_server.server_port}"
+
+    server = None
+    work_dir = None
+    try:
+        if args.server:
+            server_url = args.server.rstrip("/")
+        else:
+            work_dir = tempfile.mkdtemp(prefix="bench-")
+            extra_env = dict(item.split("=", 1) for item in args.env)
+            server = spawn_server(args.port, work_dir, extra_env)
+            server_url = f"http://127.0.0.1:{args.port}"
+            print(f"Spawned server pid {server.pid} in {work_dir}")
+        asyncio.run(wait_until_ready(server_url))
+        report = asyncio.run(run_benchmark(args, server_url, media_url, server.pid if server else None))
+    finally:
+        if server:
+            server.terminate()
+            try:
+                server.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        media_server.shutdown()
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare_with_baseline(report, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nNo regressions against baseline.")
+    if report["errors"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import os
+import time
+import shutil
+import threading
+
+# الحد الأقصى لحجم مجلد التنزيلات (بالبايت)، 0 يعني بلا حد سوى المساحة الحرة على القرص
+DOWNLOAD_DISK_BUDGET = int(os.environ.get("DOWNLOAD_DISK_BUDGET", "0"))
+# أقل مساحة حرة يجب أن تبقى على القرص بعد احتساب كل الحجوزات
+DISK_MIN_FREE = int(os.environ.get("DISK_MIN_FREE", str(1024 * 1024 * 1024)))
+# الحجز الافتراضي لمهمة لا يُعرف حجمها مسبقًا
+DISK_DEFAULT_RESERVATION = int(os.environ.get("DISK_DEFAULT_RESERVATION", str(512 * 1024 * 1024)))
+# عدد المهام التي يمكن أن تنتظر في الطابور حتى تتوفر المساحة؛ بعدها تُرفض الطلبات الجديدة (429)
+DISK_WAIT_QUEUE = int(os.environ.get("DISK_WAIT_QUEUE", "10"))
+# الفترة بين إعادة حساب حجم مجلد التنزيلات والمساحة الحرة (بالثواني)
+DISK_USAGE_REFRESH = float(os.environ.get("DISK_USAGE_REFRESH", "5"))
+
+
+class InsufficientStorageError(Exception):
+    """الحجم المطلوب لا يمكن أن يتسع أبدًا (أكبر من الحد أو من القرص نفسه)."""
+
+
+class StorageBusyError(Exception):
+    """المساحة محجوزة حاليًا لمهام أخرى وطابور الانتظار ممتلئ."""
+
+
+class DiskQuota:
+    """حجز مساحة القرص لكل مهمة قبل بدء التنزيل.
+
+    لكل مهمة جارية حجز بالبايت (الحجم التقديري). الجزء الذي لم يُكتب بعد من الحجز
+    (الحجز ناقص حجم مجلد المهمة الحالي) يُحسب مع حجم مجلد التنزيلات مقابل الحد
+    المضبوط ومقابل المساحة الحرة على القرص، فلا تبدأ مهمة لا يتسع لها القرص.
+    حجم المجلد يُحسب دوريًا (refresh) وليس عند كل طلب.
+    """
+
+    def __init__(self, root: str, budget: int = DOWNLOAD_DISK_BUDGET, min_free: int = DISK_MIN_FREE,
+                 default_reservation: int = DISK_DEFAULT_RESERVATION, wait_queue: int = DISK_WAIT_QUEUE,
+                 refresh_interval: float = DISK_USAGE_REFRESH):
+        self.root = root
+        self.budget = budget
+        self.min_free = min_free
+        self.default_reservation = default_reservation
+        self.wait_queue = wait_queue
+        self.refresh_interval = refresh_interval
+        # حجز كل مهمة جارية بالبايت
+        self._reserved: dict[str, int] = {}
+        # المهام المنتظرة في الطابور بسبب نقص المساحة
+        self._waiting: set[str] = set()
+        self._used = 0
+        self._entry_sizes: dict[str, int] = {}
+        self._free = 0
+        self._disk_total = 0
+        self._refreshed_at = 0.0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def reservation_for(self, size, merged: bool = False) -> int:
+        """الحجز المطلوب لتنزيل بالحجم المعطى. دمج الفيديو والصوت يحتاج مساحة التيارين
+        والملف الناتج معًا قبل حذف الملفات الوسيطة."""
+        if not size:
+            return self.default_reservation
+        return int(size) * (2 if merged else 1)
+
+    def reservation_for_job(self, job) -> int:
+        # التنزيل إلى المجلد المخصص للمستخدم لا يستخدم مجلد التنزيلات، فلا يُحجز له شيء
+        if job.use_custom_folder:
+            return 0
+        return self.reservation_for(job.expected_size, merged='+' in (job.format_id or job.format_string))
+
+    def refresh(self):
+        entry_sizes = {}
+        used = 0
+        for name in os.listdir(self.root):
+            size = _tree_size(os.path.join(self.root, name))
+            entry_sizes[name] = size
+            used += size
+        disk = shutil.disk_usage(self.root)
+        with self._lock:
+            self._used = used
+            self._entry_sizes = entry_sizes
+            self._free = disk.free
+            self._disk_total = disk.total
+            self._refreshed_at = time.monotonic()
+
+    def _outstanding(self) -> int:
+        # الجزء الذي لم يُكتب بعد من الحجوزات (ما كُتب محسوب في حجم المجلد)
+        return sum(max(reserved - self._entry_sizes.get(job_id, 0), 0)
+                   for job_id, reserved in self._reserved.items())
+
+    def _room(self) -> int:
+        outstanding = self._outstanding()
+        room = self._free - outstanding - self.min_free
+        if self.budget:
+            room = min(room, self.budget - self._used - outstanding)
+        return room
+
+    def check(self, nbytes: int):
+        """فحص طلب جديد قبل إضافته إلى الطابور: يرفع استثناءً إذا لن يتسع أبدًا
+        أو إذا لم يتسع الآن وطابور انتظار المساحة ممتلئ."""
+        with self._lock:
+            capacity = self._disk_total - self.min_free
+            if self.budget:
+                capacity = min(capacity, self.budget)
+            if nbytes > capacity:
+                self.rejected += 1
+                raise InsufficientStorageError("لا توجد مساحة كافية على الخادم لهذا التنزيل.")
+            if nbytes > self._room() and len(self._waiting) >= self.wait_queue:
+                self.rejected += 1
+                raise StorageBusyError("مساحة التخزين مشغولة بتنزيلات أخرى، حاول لاحقًا.")
+
+    def try_reserve(self, job_id: str, nbytes: int) -> bool:
+        with self._lock:
+            # مهمة واحدة على الأقل يجب أن تعمل، وإلا بقي الطابور متوقفًا بسبب تقدير مبالغ فيه
+            if self._reserved and nbytes > self._room():
+                self._waiting.add(job_id)
+                return False
+            self._waiting.discard(job_id)
+            self._reserved[job_id] = nbytes
+            return True
+
+    def update(self, job_id: str, nbytes: int):
+        """تعديل حجز مهمة جارية بعد معرفة حجمها الفعلي."""
+        with self._lock:
+            if job_id in self._reserved:
+                self._reserved[job_id] = nbytes
+
+    def release(self, job_id: str):
+        with self._lock:
+            self._waiting.discard(job_id)
+            reserved = self._reserved.pop(job_id, None)
+            if reserved is None:
+                return
+            # حتى الحساب التالي: نفترض أن الحجز امتلأ بالكامل ولم يُحذف شيء
+            written = self._entry_sizes.get(job_id, 0)
+            remaining = max(reserved - written, 0)
+            self._used += remaining
+            self._free -= remaining
+            self._entry_sizes[job_id] = written + remaining
+
+    def stats(self) -> dict:
+        with self._lock:
+            outstanding = self._outstanding()
+            return {
+                "root": self.root,
+                "budget": self.budget or None,
+                "used": self._used,
+                "reserved": sum(self._reserved.values()),
+                "outstanding": outstanding,
+                "free": self._free,
+                "min_free": self.min_free,
+                "available": max(self._room(), 0),
+                "active_reservations": len(self._reserved),
+                "waiting": len(self._waiting),
+                "rejected": self.rejected,
+                "refreshed_seconds_ago": round(time.monotonic() - self._refreshed_at, 1),
+            }
+
+
+def _tree_size(path: str) -> int:
+    if not os.path.isdir(path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+    size = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                size += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                continue
+    return size
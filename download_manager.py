@@ -0,0 +1,322 @@
+import os
+import re
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from job_store import JobStore
+from lazy_import import lazy_import
+
+yt_dlp = lazy_import("yt_dlp")
+
+# عدد التنزيلات المتزامنة في تطبيق سطح المكتب
+DESKTOP_MAX_DOWNLOADS = int(os.environ.get("DESKTOP_MAX_DOWNLOADS", "3"))
+# ملف طابور التنزيلات في تطبيق سطح المكتب (يبقى بعد إغلاق التطبيق)
+DESKTOP_QUEUE_PATH = os.environ.get(
+    "DESKTOP_QUEUE_PATH", os.path.join(os.path.expanduser("~"), ".video_downloader", "queue.sqlite3"))
+
+# حالات عنصر التنزيل
+ITEM_QUEUED = "queued"
+ITEM_DOWNLOADING = "downloading"
+ITEM_PAUSED = "paused"
+ITEM_FINISHED = "finished"
+ITEM_ERROR = "error"
+ITEM_CANCELLED = "cancelled"
+# الحالات النهائية: لا يعمل عليها أي خيط ويمكن حذفها من القائمة
+ITEM_DONE_STATES = (ITEM_FINISHED, ITEM_ERROR, ITEM_CANCELLED)
+
+
+class DownloadItem:
+    def __init__(self, url: str, format_string: str, download_path: str, title: str = None):
+        self.item_id = str(uuid.uuid4())
+        self.url = url
+        self.format_string = format_string
+        self.download_path = download_path
+        self.title = title
+        self.status = ITEM_QUEUED
+        self.error = None
+        self.file_path = None
+        # بايتات كل ملف يُنزل (الفيديو والصوت منفصلان قبل الدمج): الملف المؤقت -> [downloaded, total]
+        self.streams: dict[str, list] = {}
+        self.speed = None
+        self.eta = None
+        # الحالة التي طلبها المستخدم للتنزيل الجاري، يطبقها progress hook عند الاستدعاء التالي
+        self.interrupt = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    # الحقول التي تُحفظ في ملف الطابور
+    RECORD_FIELDS = ("url", "format_string", "download_path", "title", "status", "error", "file_path",
+                     "streams", "created_at", "finished_at")
+
+    def to_record(self) -> dict:
+        record = {name: getattr(self, name) for name in self.RECORD_FIELDS}
+        record["job_id"] = self.item_id
+        return record
+
+    @classmethod
+    def from_record(cls, record: dict) -> "DownloadItem":
+        item = cls(record["url"], record["format_string"], record["download_path"])
+        for name in cls.RECORD_FIELDS:
+            if name in record:
+                setattr(item, name, record[name])
+        item.item_id = record["job_id"]
+        return item
+
+    @property
+    def downloaded_bytes(self) -> int:
+        return sum(downloaded for downloaded, _ in self.streams.values())
+
+    @property
+    def total_bytes(self):
+        totals = [total for _, total in self.streams.values()]
+        if not totals or None in totals:
+            return None
+        return sum(totals)
+
+    def snapshot(self) -> dict:
+        total = self.total_bytes
+        downloaded = self.downloaded_bytes
+        return {
+            "item_id": self.item_id,
+            "url": self.url,
+            "title": self.title or self.url,
+            "status": self.status,
+            "error": self.error,
+            "file_path": self.file_path,
+            "download_path": self.download_path,
+            "downloaded_bytes": downloaded,
+            "total_bytes": total,
+            "progress": min(downloaded / total, 1.0) if total else (1.0 if self.status == ITEM_FINISHED else 0.0),
+            "speed": self.speed if self.status == ITEM_DOWNLOADING else None,
+            "eta": self.eta if self.status == ITEM_DOWNLOADING else None,
+        }
+
+
+class DownloadManager:
+    """طابور تنزيلات تطبيق سطح المكتب: عدد محدود من الخيوط، وإيقاف مؤقت واستئناف وإلغاء لكل عنصر.
+
+    التقدم يُكتب في جدول حالة محمي بقفل (progress hook لا يلمس الواجهة)، والواجهة تقرأ
+    لقطة منه (snapshot) على مؤقت ثابت، فلا يُضاف استدعاء إلى حلقة Tk مع كل حدث تقدم.
+    تُحفظ العناصر في ملف الطابور عند تغير حالتها فقط، وتُستعاد عند تشغيل التطبيق مرة أخرى.
+    """
+
+    def __init__(self, ydl_pool, ydl_opts: dict, max_workers: int = DESKTOP_MAX_DOWNLOADS,
+                 store: JobStore = None):
+        self.ydl_pool = ydl_pool
+        self.ydl_opts = ydl_opts
+        self.store = store
+        self._items: dict[str, DownloadItem] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="desktop-download")
+        # يزداد مع كل تغيير، لتتجاهل الواجهة اللقطات التي لم تتغير
+        self.version = 0
+
+    def restore(self):
+        """استعادة الطابور المحفوظ. ما كان جاريًا عند الإغلاق يعود إلى الطابور ويكمل من الملف الجزئي."""
+        if self.store is None:
+            return
+        for record in self.store.load_all():
+            try:
+                item = DownloadItem.from_record(record)
+            except KeyError as e:
+                print(f"Skipping unreadable queue record: {e}")
+                continue
+            if item.status == ITEM_DOWNLOADING:
+                item.status = ITEM_QUEUED
+            with self._lock:
+                self._items[item.item_id] = item
+                self.version += 1
+            if item.status == ITEM_QUEUED:
+                self._executor.submit(self._run, item.item_id)
+
+    def add(self, url: str, format_string: str, download_path: str, title: str = None) -> DownloadItem:
+        item = DownloadItem(url, format_string, download_path, title)
+        with self._lock:
+            self._items[item.item_id] = item
+            self.version += 1
+        self._save(item)
+        self._executor.submit(self._run, item.item_id)
+        return item
+
+    def pause(self, item_id: str):
+        self._interrupt(item_id, ITEM_PAUSED)
+
+    def cancel(self, item_id: str):
+        self._interrupt(item_id, ITEM_CANCELLED)
+
+    def resume(self, item_id: str):
+        with self._lock:
+            item = self._items.get(item_id)
+            if item is None or item.status not in (ITEM_PAUSED, ITEM_ERROR):
+                return
+            item.status = ITEM_QUEUED
+            item.error = None
+            item.interrupt = None
+            self.version += 1
+        self._save(item)
+        self._executor.submit(self._run, item_id)
+
+    def remove(self, item_id: str):
+        """حذف عنصر منتهٍ من القائمة (الملف المنزل نفسه لا يُحذف)."""
+        with self._lock:
+            item = self._items.get(item_id)
+            if item is None or item.status not in ITEM_DONE_STATES:
+                return
+            del self._items[item_id]
+            self.version += 1
+        if self.store is not None:
+            self.store.delete(item_id)
+
+    def clear_done(self):
+        with self._lock:
+            done = [item_id for item_id, item in self._items.items() if item.status in ITEM_DONE_STATES]
+        for item_id in done:
+            self.remove(item_id)
+
+    def snapshot(self) -> tuple[list[dict], dict]:
+        """لقطة من حالة كل العناصر والإجماليات (السرعة الكلية وعدد العناصر في كل حالة)."""
+        with self._lock:
+            items = [item.snapshot() for item in self._items.values()]
+        counts = {}
+        for item in items:
+            counts[item["status"]] = counts.get(item["status"], 0) + 1
+        active = [item for item in items if item["status"] == ITEM_DOWNLOADING]
+        known_totals = [item for item in active if item["total_bytes"]]
+        totals = {
+            "counts": counts,
+            "speed": sum(item["speed"] or 0 for item in active),
+            "downloaded_bytes": sum(item["downloaded_bytes"] for item in active),
+            "total_bytes": sum(item["total_bytes"] for item in known_totals),
+            "progress": (sum(item["downloaded_bytes"] for item in known_totals)
+                         / sum(item["total_bytes"] for item in known_totals)) if known_totals else 0.0,
+        }
+        return items, totals
+
+    def shutdown(self):
+        """إيقاف التنزيلات الجارية لتُستأنف في التشغيل التالي، دون انتظار الخيوط."""
+        with self._lock:
+            running = [item for item in self._items.values() if item.status == ITEM_DOWNLOADING]
+            for item in running:
+                item.interrupt = ITEM_QUEUED
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _interrupt(self, item_id: str, status: str):
+        with self._lock:
+            item = self._items.get(item_id)
+            if item is None or item.status in ITEM_DONE_STATES:
+                return
+            if item.status == ITEM_DOWNLOADING:
+                # الخيط الجاري يرى الطلب عند استدعاء progress hook التالي
+                item.interrupt = status
+                return
+            if item.status == ITEM_PAUSED and status == ITEM_PAUSED:
+                return
+            # عنصر في الطابور أو موقوف: المهمة المنتظرة في الخيوط تتجاهله لأن حالته لم تعد queued
+            item.status = status
+            self.version += 1
+        if status == ITEM_CANCELLED:
+            self._remove_partial_files(item)
+        self._save(item)
+
+    def _run(self, item_id: str):
+        with self._lock:
+            item = self._items.get(item_id)
+            if item is None or item.status != ITEM_QUEUED:
+                return
+            item.status = ITEM_DOWNLOADING
+            item.interrupt = None
+            self.version += 1
+        self._save(item)
+
+        def progress_hook(d):
+            self._update_progress(item, d)
+
+        try:
+            with self.ydl_pool.checkout(self.ydl_opts,
+                                        format=item.format_string,
+                                        outtmpl=os.path.join(item.download_path, '%(title)s.%(ext)s'),
+                                        progress_hooks=[progress_hook]) as ydl:
+                info = ydl.extract_info(item.url, download=True)
+            downloads = info.get('requested_downloads') or [{}]
+            with self._lock:
+                item.title = info.get('title') or item.title
+                item.file_path = downloads[0].get('filepath') or item.file_path
+                item.status = ITEM_FINISHED
+        except yt_dlp.utils.DownloadCancelled:
+            with self._lock:
+                item.status = item.interrupt or ITEM_PAUSED
+            if item.status == ITEM_CANCELLED:
+                self._remove_partial_files(item)
+        except yt_dlp.utils.DownloadError as e:
+            with self._lock:
+                item.status = ITEM_ERROR
+                item.error = str(e)
+        except Exception as e:
+            print(f"Unexpected error downloading {item.url}: {e}")
+            with self._lock:
+                item.status = ITEM_ERROR
+                item.error = f"حدث خطأ غير متوقع: {e}"
+        with self._lock:
+            item.interrupt = None
+            item.speed = item.eta = None
+            if item.status in ITEM_DONE_STATES:
+                item.finished_at = time.time()
+            self.version += 1
+        self._save(item)
+
+    def _update_progress(self, item: DownloadItem, d: dict):
+        with self._lock:
+            # التيار يُعرف بملفه المؤقت (.part)، فهو وحده ما يجوز حذفه عند الإلغاء. حالة finished
+            # لا تحمل tmpfilename، فتُطابق مع التيار المؤقت المقابل لاسمها النهائي
+            filename = d.get('tmpfilename') or d.get('filename')
+            if filename and filename not in item.streams and f"{filename}.part" in item.streams:
+                filename = f"{filename}.part"
+            if filename:
+                stream = item.streams.setdefault(filename, [0, None])
+                stream[0] = d.get('downloaded_bytes') or stream[0]
+                stream[1] = d.get('total_bytes') or d.get('total_bytes_estimate') or stream[1]
+                if d['status'] == 'finished':
+                    stream[1] = stream[1] or stream[0]
+            if d['status'] == 'downloading':
+                item.speed = d.get('speed')
+                item.eta = d.get('eta')
+            if not item.title:
+                item.title = (d.get('info_dict') or {}).get('title')
+            self.version += 1
+            interrupt = item.interrupt
+        # yt-dlp يعيد رفع DownloadCancelled كما هو، والملف الجزئي (.part) يبقى للاستئناف
+        if interrupt and d['status'] == 'downloading':
+            raise yt_dlp.utils.DownloadCancelled(f"Download {interrupt}: {item.url}")
+
+    def _remove_partial_files(self, item: DownloadItem):
+        # الملفات المؤقتة التي ينشئها yt-dlp فقط: الملف الجزئي (.part) وملف التقدم (.ytdl) وأجزاء HLS/DASH
+        # (.part-Frag1). المجلد قد يكون مجلد المستخدم، فلا يُحذف الملف النهائي أو أي ملف آخر بنفس البادئة
+        with self._lock:
+            tmpfilenames = [name for name in item.streams if name.endswith('.part')]
+            item.streams = {}
+        for tmpfilename in tmpfilenames:
+            directory, base = os.path.split(tmpfilename)
+            final_base = base[:-len('.part')]
+            fragment = re.compile(rf"{re.escape(base)}-Frag\d+(\.part)?")
+            try:
+                names = os.listdir(directory or ".")
+            except OSError:
+                continue
+            for name in names:
+                if name in (base, f"{base}.ytdl", f"{final_base}.ytdl") or fragment.fullmatch(name):
+                    try:
+                        os.remove(os.path.join(directory, name))
+                    except OSError as e:
+                        print(f"Could not remove partial file {name}: {e}")
+
+    def _save(self, item: DownloadItem):
+        if self.store is None:
+            return
+        with self._lock:
+            record = item.to_record()
+        try:
+            self.store.save(record)
+        except Exception as e:
+            print(f"Error saving download queue item {item.item_id}: {e}")
@@ -0,0 +1,343 @@
+import os
+import sys
+import copy
+import time
+import socket
+import threading
+import subprocess
+from multiprocessing.connection import Connection
+
+from lazy_import import lazy_import
+from artifact_manifest import ArtifactManifest
+from parallel_download import is_ranged_candidate, is_fragmented, download_ranged, requires_ytdlp_processing
+from mux_pipeline import is_mux_candidate, download_muxed
+
+yt_dlp = lazy_import("yt_dlp")
+
+# مكان تشغيل التنزيلات: thread (خيوط داخل عملية الخادم) أو process (عمليات فرعية منفصلة)
+DOWNLOAD_BACKEND = os.environ.get("DOWNLOAD_BACKEND", "thread").lower()
+# عدد عمليات التنزيل الفرعية القصوى (0 = مثل عدد عمال طابور التنزيل)
+PROCESS_WORKERS = int(os.environ.get("PROCESS_WORKERS", "0"))
+# عدد المهام التي تنفذها العملية الفرعية قبل استبدالها بعملية جديدة
+WORKER_MAX_JOBS = int(os.environ.get("WORKER_MAX_JOBS", "20"))
+# الحد الأقصى لذاكرة العملية الفرعية المقيمة (RSS) بالبايت، 0 بلا حد
+WORKER_MAX_RSS = int(os.environ.get("WORKER_MAX_RSS", str(1024 * 1024 * 1024)))
+# الحد الأقصى لمدة مهمة واحدة في العملية الفرعية (بالثواني)، 0 بلا حد
+WORKER_JOB_TIMEOUT = float(os.environ.get("WORKER_JOB_TIMEOUT", "3600"))
+# الفترة بين فحوص حدود العملية الفرعية (بالثواني)
+WORKER_CHECK_INTERVAL = float(os.environ.get("WORKER_CHECK_INTERVAL", "1"))
+# أقل فترة بين رسالتي تقدم ترسلهما العملية الفرعية (الحالات الوسيطة تُدمج في آخرها)
+WORKER_PROGRESS_INTERVAL = float(os.environ.get("WORKER_PROGRESS_INTERVAL", "0.1"))
+
+# حقول حالة التقدم التي تنتقل من العملية الفرعية (بدون info_dict الكبير)
+PROGRESS_FIELDS = ('status', 'downloaded_bytes', 'total_bytes', 'total_bytes_estimate', 'speed', 'eta',
+                   'elapsed', 'filename', 'tmpfilename', 'fragment_index', 'fragment_count')
+
+
+class WorkerLimitError(Exception):
+    """تجاوزت العملية الفرعية حد الذاكرة أو المدة، أو توقفت بشكل غير متوقع."""
+
+
+def run_download(ydl, url: str, info_dict: dict = None, resolved_info: dict = None, hooks: list = (),
+                 connections: int = 1):
+    """تنزيل بالاتصالات المحجوزة: دمج متزامن للفيديو والصوت أو نطاقات متوازية إن أمكن، وإلا yt-dlp نفسه.
+    يعيد المسار النهائي إذا نُزل الملف دون yt-dlp (وإلا يصل المسار عبر post_hooks)."""
+    # الدمج بأنفسنا يتجاوز process_info أيضًا، فلا يُستخدم إذا طُلبت ترجمات أو صورة مصغرة أو معالجة لاحقة
+    mux = (info_dict is not None and resolved_info is not None and is_mux_candidate(resolved_info)
+           and not requires_ytdlp_processing(ydl.params, resolved_info))
+    if mux and connections > 1:
+        try:
+            filename = download_muxed(ydl, info_dict, resolved_info, connections, hooks)
+            if filename:
+                return filename
+        except Exception as e:
+            print(f"Mux pipeline failed, falling back to yt-dlp: {e}")
+    if info_dict is not None and resolved_info is not None and connections > 1:
+        # النطاقات المتوازية تتجاوز process_info، فلا تُستخدم إذا طُلبت ترجمات أو صورة مصغرة أو معالجة لاحقة
+        if is_ranged_candidate(resolved_info) and not requires_ytdlp_processing(ydl.params, resolved_info):
+            try:
+                filename = download_ranged(ydl, info_dict, resolved_info, connections, hooks)
+                if filename:
+                    return filename
+            except Exception as e:
+                print(f"Parallel ranged download failed, falling back to yt-dlp: {e}")
+        if is_fragmented(resolved_info):
+            ydl.params['concurrent_fragment_downloads'] = connections
+
+    # إعادة استخدام المعلومات المستخرجة مسبقًا بدلاً من استخراجها مرة ثانية
+    if info_dict is not None:
+        try:
+            ydl.process_ie_result(copy.deepcopy(info_dict), download=True)
+            return None
+        except yt_dlp.utils.DownloadError as e:
+            # قد تنتهي صلاحية روابط الوسائط المخزنة؛ نعيد الاستخراج من الرابط الأصلي
+            print(f"Download from cached info failed, re-extracting {url}: {e}")
+    ydl.download([url])
+    return None
+
+
+def process_rss(pid: int):
+    """ذاكرة العملية المقيمة بالبايت (psutil إن وُجد، وإلا /proc على Linux)."""
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except ImportError:
+        pass
+    except Exception:
+        return None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+class _Worker:
+    def __init__(self):
+        # socketpair: اتصال ثنائي الاتجاه، طرف العملية الفرعية يُمرر لها كرقم واصف ملف
+        parent_sock, child_sock = socket.socketpair()
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), str(child_sock.fileno())],
+            pass_fds=(child_sock.fileno(),),
+        )
+        child_sock.close()
+        self.conn = Connection(parent_sock.detach())
+        self.jobs = 0
+        self.peak_rss = 0
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def stop(self, timeout: float = 5):
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        try:
+            self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.kill()
+        self.conn.close()
+
+    def kill(self):
+        if self.alive():
+            self.process.kill()
+            self.process.wait()
+        self.conn.close()
+
+
+class ProcessWorkerPool:
+    """مجمع عمليات فرعية للتنزيل: كل تنزيل يعمل في عملية منفصلة بمفسر Python خاص بها.
+
+    معالجة yt-dlp الثقيلة (الأجزاء والدمج) لا تنافس حلقة أحداث الخادم على GIL، والمستخرج
+    الذي يستهلك الذاكرة أو يتعطل يُنهي عمليته وحدها. الخادم يراقب ذاكرة كل عملية ومدة مهمتها
+    ويقتلها عند تجاوز الحد، ويستبدلها بعد WORKER_MAX_JOBS مهمة.
+
+    التقدم يعود عبر socketpair كرسائل صغيرة (حقول PROGRESS_FIELDS فقط) بمعدل محدود،
+    وتُستدعى به نفس progress_hooks في خيط الخادم الذي ينتظر المهمة.
+    """
+
+    def __init__(self, max_workers: int, max_jobs: int = WORKER_MAX_JOBS, max_rss: int = WORKER_MAX_RSS,
+                 job_timeout: float = WORKER_JOB_TIMEOUT):
+        self.max_workers = max_workers
+        self.max_jobs = max_jobs
+        self.max_rss = max_rss
+        self.job_timeout = job_timeout
+        self.started = 0
+        self.recycled = 0
+        self.killed = 0
+        self.crashed = 0
+        self.completed = 0
+        self.busy = 0
+        self._idle: list[_Worker] = []
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @property
+    def idle_count(self) -> int:
+        with self._lock:
+            return len(self._idle)
+
+    def _spawn(self) -> _Worker:
+        worker = _Worker()
+        with self._lock:
+            self.started += 1
+        return worker
+
+    def prewarm(self):
+        """تشغيل عملية خاملة مسبقًا (تستورد yt-dlp) حتى لا تنتظر المهمة الأولى بدءها."""
+        with self._lock:
+            if self._idle or self._closed:
+                return
+        worker = self._spawn()
+        with self._lock:
+            self._idle.append(worker)
+
+    def run(self, task: dict, hooks: list = ()):
+        """تنفيذ مهمة تنزيل في عملية فرعية والانتظار حتى انتهائها (يُستدعى من خيط، وليس من حلقة الأحداث).
+        task: url و info_dict و resolved_info و connections و opts (خيارات YoutubeDL الثابتة) و overrides.
+        يعيد سجل ملفات النتيجة (ArtifactManifest.to_record) كما سجلته العملية الفرعية."""
+        with self._slots:
+            with self._lock:
+                worker = None
+                while self._idle and worker is None:
+                    candidate = self._idle.pop()
+                    if candidate.alive():
+                        worker = candidate
+                    else:
+                        candidate.kill()
+                self.busy += 1
+            try:
+                if worker is None:
+                    worker = self._spawn()
+                outcome = self._run_on(worker, task, hooks)
+            except BaseException:
+                # العملية في حالة غير معروفة (مهمة لم تكتمل أو رسائل لم تُقرأ): لا تُعاد إلى المجمع
+                if worker is not None:
+                    worker.kill()
+                raise
+            finally:
+                with self._lock:
+                    self.busy -= 1
+            self._release(worker)
+        # خطأ أبلغت عنه العملية نفسها: انتهت المهمة والعملية سليمة وأُعيدت إلى المجمع
+        if outcome[0] == "error":
+            _, error_type, text = outcome
+            if error_type == "download":
+                raise yt_dlp.utils.DownloadError(text)
+            raise Exception(text)
+        return outcome[1]
+
+    def _run_on(self, worker: _Worker, task: dict, hooks: list) -> tuple:
+        """إرسال المهمة ونقل رسائل التقدم إلى hooks حتى تعيد العملية ("done", سجل الملفات) أو ("error", النوع، النص)."""
+        worker.conn.send(task)
+        started = time.monotonic()
+        next_check = started
+        while True:
+            if worker.conn.poll(WORKER_CHECK_INTERVAL):
+                try:
+                    message = worker.conn.recv()
+                except EOFError:
+                    message = None
+                if message is None:
+                    self._count("crashed")
+                    raise WorkerLimitError(f"توقفت عملية التنزيل بشكل غير متوقع (رمز الخروج {worker.process.wait()}).")
+                kind = message[0]
+                if kind == "progress":
+                    for hook in hooks:
+                        hook(message[1])
+                elif kind in ("done", "error"):
+                    worker.jobs += 1
+                    self._count("completed")
+                    return message
+            now = time.monotonic()
+            if now < next_check:
+                continue
+            next_check = now + WORKER_CHECK_INTERVAL
+            if not worker.alive():
+                self._count("crashed")
+                raise WorkerLimitError(f"توقفت عملية التنزيل بشكل غير متوقع (رمز الخروج {worker.process.returncode}).")
+            rss = process_rss(worker.pid) or 0
+            worker.peak_rss = max(worker.peak_rss, rss)
+            if self.max_rss and rss > self.max_rss:
+                self._count("killed")
+                raise WorkerLimitError(f"تجاوزت عملية التنزيل حد الذاكرة ({rss // (1024 * 1024)} MiB).")
+            if self.job_timeout and now - started > self.job_timeout:
+                self._count("killed")
+                raise WorkerLimitError(f"تجاوز التنزيل المدة القصوى ({int(self.job_timeout)} ثانية).")
+
+    def _release(self, worker: _Worker):
+        # العملية تُستبدل بعد عدد محدد من المهام حتى لا تتراكم الذاكرة أو الحالة الداخلية
+        if worker.jobs >= self.max_jobs or not worker.alive():
+            self._count("recycled")
+            worker.stop()
+            return
+        with self._lock:
+            if not self._closed:
+                self._idle.append(worker)
+                return
+        worker.stop()
+
+    def _count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self) -> dict:
+        with self._lock:
+            idle = list(self._idle)
+            return {
+                "max_workers": self.max_workers,
+                "busy": self.busy,
+                "idle": len(idle),
+                "started": self.started,
+                "completed": self.completed,
+                "recycled": self.recycled,
+                "killed": self.killed,
+                "crashed": self.crashed,
+                "max_jobs": self.max_jobs,
+                "max_rss": self.max_rss or None,
+                "job_timeout": self.job_timeout or None,
+                "idle_rss": [process_rss(worker.pid) for worker in idle],
+            }
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.stop()
+
+
+def worker_main(conn: Connection):
+    """حلقة العملية الفرعية: تستقبل مهمة، تنزلها بمجمع YoutubeDL محلي، وترسل التقدم والنتيجة."""
+    from ydl_pool import YoutubeDLPool
+
+    # استيراد yt-dlp الآن، قبل وصول المهمة الأولى
+    yt_dlp.load()
+    ydl_pool = YoutubeDLPool()
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        last_sent = 0.0
+
+        def progress_hook(d):
+            nonlocal last_sent
+            now = time.monotonic()
+            if d.get('status') == 'downloading' and now - last_sent < WORKER_PROGRESS_INTERVAL:
+                return
+            last_sent = now
+            message = {name: d[name] for name in PROGRESS_FIELDS if name in d}
+            message['format_id'] = (d.get('info_dict') or {}).get('format_id')
+            conn.send(("progress", message))
+
+        # التيارات المنزلة تصل إلى سجل الخادم عبر رسائل التقدم؛ هنا يُسجل المسار النهائي والمعالجات اللاحقة
+        manifest = ArtifactManifest()
+        try:
+            with ydl_pool.checkout(task["opts"], progress_hooks=[progress_hook], **manifest.ydl_overrides(),
+                                   **task["overrides"]) as ydl:
+                filename = run_download(ydl, task["url"], task.get("info_dict"), task.get("resolved_info"),
+                                        [progress_hook], task.get("connections", 1))
+            if filename:
+                manifest.set_main(filename)
+            conn.send(("done", manifest.to_record()))
+        except yt_dlp.utils.DownloadError as e:
+            conn.send(("error", "download", str(e)))
+        except Exception as e:
+            conn.send(("error", "other", str(e)))
+    ydl_pool.close()
+
+
+if __name__ == "__main__":
+    worker_main(Connection(int(sys.argv[1])))
@@ -1,30 +1,138 @@
+from startup_timing import STARTUP
+STARTUP.start("imports")
+
 import customtkinter as ctk
 from tkinter import filedialog, messagebox
-import yt_dlp
 import threading
-import os
+import time
+
+from ydl_pool import YoutubeDLPool
+from job_store import JobStore
+from format_index import FormatIndex, FORMAT_TYPES, FORMAT_VIDEO_AUDIO, FORMAT_AUDIO_ONLY, build_format_string
+from download_manager import (DownloadManager, DESKTOP_QUEUE_PATH, ITEM_QUEUED, ITEM_DOWNLOADING, ITEM_PAUSED,
+                              ITEM_FINISHED, ITEM_ERROR, ITEM_CANCELLED, ITEM_DONE_STATES)
+from lazy_import import lazy_import
+
+# yt-dlp is imported on first use (or by the warm-up once the window is shown), not before the window appears
+yt_dlp = lazy_import("yt_dlp")
+STARTUP.finish("imports")
 
 # Set the appearance mode and default color theme
 ctk.set_appearance_mode("System")  # Can be "System", "Dark", "Light"
 ctk.set_default_color_theme("blue")  # Can be "blue", "dark-blue", "green"
 
+# Fixed yt-dlp options per operation; per-download options are passed on checkout
+INFO_YDL_OPTS = {
+    'quiet': True,
+    'simulate': True,
+    'force_generic_extractor': True,
+    'skip_download': True, # Only fetch info, not download
+}
+DOWNLOAD_YDL_OPTS = {
+    'quiet': False, # Set to False to see yt-dlp output in console for debugging
+}
+
+# Reused YoutubeDL instances, so repeated fetches skip initialisation and keep connections alive
+ydl_pool = YoutubeDLPool()
+
+# How often the UI reads the download manager's state table (milliseconds)
+UI_REFRESH_MS = 250
+
+# Status text shown for each queue item state
+ITEM_STATUS_TEXT = {
+    ITEM_QUEUED: "في الانتظار", # Waiting
+    ITEM_DOWNLOADING: "جاري التنزيل", # Downloading
+    ITEM_PAUSED: "متوقف مؤقتًا", # Paused
+    ITEM_FINISHED: "اكتمل", # Complete
+    ITEM_ERROR: "خطأ", # Error
+    ITEM_CANCELLED: "أُلغي", # Cancelled
+}
+
+
+def format_speed(speed) -> str:
+    if not speed:
+        return ""
+    if speed >= 1024 * 1024:
+        return f"{speed / (1024 * 1024):.1f} MiB/s"
+    return f"{speed / 1024:.1f} KiB/s"
+
+
+class DownloadRow(ctk.CTkFrame):
+    """One queue item: title, progress bar, status and pause/resume/cancel buttons."""
+
+    def __init__(self, master, manager: DownloadManager, item_id: str):
+        super().__init__(master)
+        self.manager = manager
+        self.item_id = item_id
+        self.grid_columnconfigure(0, weight=1)
+
+        self.title_label = ctk.CTkLabel(self, text="", anchor="e")
+        self.title_label.grid(row=0, column=0, columnspan=3, padx=10, pady=(5, 0), sticky="ew")
+        self.progress_bar = ctk.CTkProgressBar(self, orientation="horizontal")
+        self.progress_bar.grid(row=1, column=0, padx=10, pady=5, sticky="ew")
+        self.progress_bar.set(0)
+        self.pause_button = ctk.CTkButton(self, text="إيقاف مؤقت", width=90, command=self.toggle_pause) # Pause
+        self.pause_button.grid(row=1, column=1, padx=(0, 5), pady=5)
+        self.cancel_button = ctk.CTkButton(self, text="إلغاء", width=70, command=self.cancel_or_remove) # Cancel
+        self.cancel_button.grid(row=1, column=2, padx=(0, 10), pady=5)
+        self.status_label = ctk.CTkLabel(self, text="", anchor="e")
+        self.status_label.grid(row=2, column=0, columnspan=3, padx=10, pady=(0, 5), sticky="ew")
+        self.item_status = None
+
+    def toggle_pause(self):
+        if self.item_status in (ITEM_PAUSED, ITEM_ERROR):
+            self.manager.resume(self.item_id)
+        else:
+            self.manager.pause(self.item_id)
+
+    def cancel_or_remove(self):
+        if self.item_status in ITEM_DONE_STATES:
+            self.manager.remove(self.item_id)
+        else:
+            self.manager.cancel(self.item_id)
+
+    def update_from(self, item: dict):
+        self.item_status = item["status"]
+        self.title_label.configure(text=item["title"])
+        self.progress_bar.set(item["progress"])
+        status_text = ITEM_STATUS_TEXT[item["status"]]
+        if item["status"] == ITEM_DOWNLOADING:
+            status_text += f": {item['progress']:.1%}"
+            if item["speed"]:
+                status_text += f" - {format_speed(item['speed'])}"
+            if item["eta"] is not None:
+                status_text += f" - الوقت المتبقي: {item['eta']} ثانية" # ETA: seconds
+        elif item["status"] == ITEM_ERROR and item["error"]:
+            status_text += f": {item['error']}"
+        elif item["status"] == ITEM_FINISHED and item["file_path"]:
+            status_text += f": {item['file_path']}"
+        self.status_label.configure(text=status_text)
+        if item["status"] in (ITEM_PAUSED, ITEM_ERROR):
+            self.pause_button.configure(text="استئناف", state="normal") # Resume
+        elif item["status"] in ITEM_DONE_STATES:
+            self.pause_button.configure(text="إيقاف مؤقت", state="disabled") # Pause
+        else:
+            self.pause_button.configure(text="إيقاف مؤقت", state="normal") # Pause
+        self.cancel_button.configure(text="إزالة" if item["status"] in ITEM_DONE_STATES else "إلغاء") # Remove / Cancel
+
 class VideoDownloaderApp(ctk.CTk):
     def __init__(self):
         super().__init__()
 
         # Configure window
         self.title("برنامج تنزيل الفيديو") # Video Downloader Program
-        self.geometry("700x500")
+        self.geometry("760x860")
         self.resizable(False, False)
 
         # Configure grid layout (4x2)
         self.grid_columnconfigure(1, weight=1)
         self.grid_columnconfigure(2, weight=1) # Added for quality column
         self.grid_rowconfigure((0, 1, 2, 3, 4, 5, 6, 7), weight=1) # Adjusted row count
+        self.grid_rowconfigure(8, weight=4) # Download manager pane
 
         # Create sidebar frame with widgets
         self.sidebar_frame = ctk.CTkFrame(self, width=140, corner_radius=0)
-        self.sidebar_frame.grid(row=0, column=0, rowspan=8, sticky="nsew") # Adjusted rowspan
+        self.sidebar_frame.grid(row=0, column=0, rowspan=9, sticky="nsew") # Adjusted rowspan
         self.sidebar_frame.grid_rowconfigure(4, weight=1)
 
         self.logo_label = ctk.CTkLabel(self.sidebar_frame, text="تنزيل الفيديو", font=ctk.CTkFont(size=20, weight="bold")) # Video Download
@@ -70,14 +178,58 @@ class VideoDownloaderApp(ctk.CTk):
         self.status_label = ctk.CTkLabel(self, text="الرجاء إدخال رابط الفيديو...", wraplength=400, anchor="e") # Please enter video link..., changed anchor
         self.status_label.grid(row=7, column=1, columnspan=2, padx=(20, 20), pady=(0, 20), sticky="ew") # Changed sticky to ew
 
+        # Download manager pane: queued downloads, a box for adding many links at once, aggregate speed
+        self.manager_frame = ctk.CTkFrame(self)
+        self.manager_frame.grid(row=8, column=1, columnspan=2, padx=(20, 20), pady=(0, 20), sticky="nsew")
+        self.manager_frame.grid_columnconfigure(0, weight=1)
+        self.manager_frame.grid_rowconfigure(1, weight=1)
+
+        self.queue_summary_label = ctk.CTkLabel(self.manager_frame, text="قائمة التنزيلات فارغة.", anchor="e") # Download list is empty.
+        self.queue_summary_label.grid(row=0, column=0, padx=10, pady=(10, 5), sticky="ew")
+        self.clear_button = ctk.CTkButton(self.manager_frame, text="إزالة المكتملة", width=110, # Remove finished
+                                          command=self.clear_finished_downloads)
+        self.clear_button.grid(row=0, column=1, padx=(0, 10), pady=(10, 5))
+
+        self.queue_frame = ctk.CTkScrollableFrame(self.manager_frame, height=220)
+        self.queue_frame.grid(row=1, column=0, columnspan=2, padx=10, pady=5, sticky="nsew")
+        self.queue_frame.grid_columnconfigure(0, weight=1)
+
+        self.bulk_urls_textbox = ctk.CTkTextbox(self.manager_frame, height=70) # One link per line
+        self.bulk_urls_textbox.grid(row=2, column=0, columnspan=2, padx=10, pady=5, sticky="ew")
+        self.bulk_format_optionmenu = ctk.CTkOptionMenu(self.manager_frame, values=list(FORMAT_TYPES))
+        self.bulk_format_optionmenu.set(FORMAT_VIDEO_AUDIO)
+        self.bulk_format_optionmenu.grid(row=3, column=0, padx=10, pady=(5, 10), sticky="ew")
+        self.bulk_add_button = ctk.CTkButton(self.manager_frame, text="إضافة الروابط إلى القائمة", # Add links to the list
+                                             command=self.add_bulk_downloads)
+        self.bulk_add_button.grid(row=3, column=1, padx=(0, 10), pady=(5, 10))
+
         self.video_info = None
-        # Store available qualities per type (combined, video_only, audio_only)
-        # {type_string: {quality_value: [list_of_exts_for_this_quality_and_type]}}
-        self.available_qualities_by_type = {
-            "فيديو + صوت": {},
-            "فيديو فقط": {},
-            "صوت فقط": {}
-        }
+        # Columnar index of the fetched formats (qualities per type, best format per quality)
+        self.format_index = FormatIndex([])
+
+        # Queue of downloads running on a bounded thread pool; it survives restarts
+        self.download_manager = DownloadManager(ydl_pool, DOWNLOAD_YDL_OPTS, store=JobStore(DESKTOP_QUEUE_PATH))
+        self.download_manager.restore()
+        self.download_rows: dict[str, DownloadRow] = {}
+        self._seen_version = -1
+        self._item_states: dict[str, str] = {}
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.after(UI_REFRESH_MS, self.refresh_downloads)
+        # Runs once the main loop has drawn the window
+        self.after(0, self.start_warm_up)
+
+    def start_warm_up(self):
+        STARTUP.milestone("window_shown")
+        threading.Thread(target=self._warm_up_thread, daemon=True).start()
+
+    def _warm_up_thread(self):
+        # Import yt-dlp and prepare an info instance so the first fetch does not pay for them
+        try:
+            with STARTUP.phase("warmup"):
+                ydl_pool.prewarm(INFO_YDL_OPTS)
+            STARTUP.print_report()
+        except Exception as e:
+            print(f"yt-dlp warm-up failed: {e}")
 
     def change_appearance_mode_event(self, new_appearance_mode: str):
         ctk.set_appearance_mode(new_appearance_mode)
@@ -100,79 +252,16 @@ class VideoDownloaderApp(ctk.CTk):
 
     def _fetch_video_info_thread(self, url):
         try:
-            ydl_opts = {
-                'quiet': True,
-                'simulate': True,
-                'force_generic_extractor': True,
-                'skip_download': True, # Only fetch info, not download
-            }
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            started = time.perf_counter()
+            with ydl_pool.checkout(INFO_YDL_OPTS) as ydl:
                 info_dict = ydl.extract_info(url, download=False)
                 self.video_info = info_dict
+            STARTUP.record("first_extract", time.perf_counter() - started, once=True)
 
-            # Reset available qualities
-            self.available_qualities_by_type = {
-                "فيديو + صوت": {},
-                "فيديو فقط": {},
-                "صوت فقط": {}
-            }
-
-            for f in self.video_info.get('formats', []):
-                ext = f.get('ext')
-                vcodec = f.get('vcodec')
-                acodec = f.get('acodec')
-                height = f.get('height')
-                abr = f.get('abr') # Average bitrate for audio
-                format_id = f.get('format_id')
-                format_note = f.get('format_note') # e.g., 'DASH video' or '480p'
-                resolution_str = f.get('resolution') # e.g., '1920x1080'
-
-                if not ext or not format_id:
-                    continue
-
-                display_quality = None
-                if height:
-                    display_quality = height
-                elif resolution_str and 'x' in resolution_str:
-                    try:
-                        display_quality = int(resolution_str.split('x')[1])
-                    except ValueError:
-                        pass
-                elif format_note and 'p' in format_note:
-                    try:
-                        display_quality = int(''.join(filter(str.isdigit, format_note)))
-                    except ValueError:
-                        pass
-
-                # Populate "فيديو + صوت" with all available video qualities (even if video-only)
-                if vcodec != 'none' and display_quality:
-                    if display_quality not in self.available_qualities_by_type["فيديو + صوت"]:
-                        self.available_qualities_by_type["فيديو + صوت"][display_quality] = []
-                    if ext not in self.available_qualities_by_type["فيديو + صوت"][display_quality]:
-                        self.available_qualities_by_type["فيديو + صوت"][display_quality].append(ext)
-
-                # Populate "فيديو فقط" for explicit video-only streams
-                if vcodec != 'none' and acodec == 'none' and display_quality:
-                    if display_quality not in self.available_qualities_by_type["فيديو فقط"]:
-                        self.available_qualities_by_type["فيديو فقط"][display_quality] = []
-                    if ext not in self.available_qualities_by_type["فيديو فقط"][display_quality]:
-                        self.available_qualities_by_type["فيديو فقط"][display_quality].append(ext)
-                
-                # Populate "صوت فقط" for explicit audio-only streams
-                if vcodec == 'none' and acodec != 'none' and abr:
-                    if int(abr) not in self.available_qualities_by_type["صوت فقط"]:
-                        self.available_qualities_by_type["صوت فقط"][int(abr)] = []
-                    if ext not in self.available_qualities_by_type["صوت فقط"][int(abr)]:
-                        self.available_qualities_by_type["صوت فقط"][int(abr)].append(ext)
+            self.format_index = FormatIndex(self.video_info.get('formats', []))
 
             # Populate format options based on what's available
-            format_options = []
-            if self.available_qualities_by_type["فيديو + صوت"]:
-                format_options.append("فيديو + صوت")
-            if self.available_qualities_by_type["فيديو فقط"]:
-                format_options.append("فيديو فقط")
-            if self.available_qualities_by_type["صوت فقط"]:
-                format_options.append("صوت فقط")
+            format_options = [t for t in FORMAT_TYPES if self.format_index.qualities(t)]
 
             if not format_options:
                 self.after(0, lambda: self.status_label.configure(text="لم يتم العثور على صيغ فيديو/صوت صالحة لهذا الرابط.")) # No valid video/audio formats found for this link.
@@ -197,13 +286,11 @@ class VideoDownloaderApp(ctk.CTk):
     def update_quality_options(self, selected_format_text: str):
         quality_options = []
         
-        if selected_format_text in self.available_qualities_by_type:
-            qualities = sorted(self.available_qualities_by_type[selected_format_text].keys(), reverse=True)
-            for q in qualities:
-                if selected_format_text == "صوت فقط":
-                    quality_options.append(f"{q}k") # e.g., 128k
-                else:
-                    quality_options.append(f"{q}p") # e.g., 1080p
+        for q in reversed(self.format_index.qualities(selected_format_text)):
+            if selected_format_text == FORMAT_AUDIO_ONLY:
+                quality_options.append(f"{q}k") # e.g., 128k
+            else:
+                quality_options.append(f"{q}p") # e.g., 1080p
         
         if not quality_options:
             quality_options = ["لا توجد جودات متاحة"] # No qualities available
@@ -230,30 +317,10 @@ class VideoDownloaderApp(ctk.CTk):
             self.status_label.configure(text="الرجاء جلب معلومات الفيديو أولاً واختيار الصيغة والجودة.") # Please fetch video info first and select format and quality.
             return
 
-        format_string = ""
-        quality_value = None
         try:
-            quality_value = int(''.join(filter(str.isdigit, selected_quality_text)))
+            # Same selector builder as the web app; the index snaps the quality to an available one
+            format_string = build_format_string(selected_format_text, selected_quality_text, self.format_index)
         except ValueError:
-            pass
-
-        if selected_format_text == "فيديو + صوت":
-            if quality_value:
-                # Prioritize best video and best audio up to the selected quality
-                format_string = f"bestvideo[height<={quality_value}]+bestaudio/best[height<={quality_value}]"
-            else:
-                format_string = "bestvideo+bestaudio/best" # Get best overall if quality not specified
-        elif selected_format_text == "فيديو فقط":
-            if quality_value:
-                format_string = f"bestvideo[height<={quality_value}]"
-            else:
-                format_string = "bestvideo" # Get best video only
-        elif selected_format_text == "صوت فقط":
-            if quality_value:
-                format_string = f"bestaudio[abr<={quality_value}]"
-            else:
-                format_string = "bestaudio" # Get best audio only
-        else:
             self.status_label.configure(text="خطأ في تحديد الصيغة.") # Error determining format.
             messagebox.showerror("خطأ", "لم يتم تحديد صيغة تنزيل صالحة.") # Error, No valid download format specified.
             return
@@ -264,54 +331,82 @@ class VideoDownloaderApp(ctk.CTk):
             self.status_label.configure(text="تم إلغاء التنزيل.") # Download cancelled.
             return
 
-        self.status_label.configure(text="بدء التنزيل...") # Starting download...
-        self.download_button.configure(state="disabled")
-        self.fetch_button.configure(state="disabled")
-        self.progress_bar.set(0)
+        # Add to the download queue; the manager runs it when a worker thread is free
+        self.download_manager.add(url, format_string, download_path, title=self.video_info.get('title'))
+        self.status_label.configure(text="تمت إضافة الفيديو إلى قائمة التنزيلات.") # Video added to the download list.
 
-        # Run download in a separate thread
-        threading.Thread(target=self._download_video_thread, args=(url, format_string, download_path)).start()
+    def add_bulk_downloads(self):
+        urls = [line.strip() for line in self.bulk_urls_textbox.get("1.0", "end").splitlines() if line.strip()]
+        if not urls:
+            self.status_label.configure(text="الرجاء إدخال رابط واحد على الأقل في كل سطر.") # Please enter at least one link per line.
+            return
 
-    def _download_video_thread(self, url, format_string, download_path):
+        download_path = filedialog.askdirectory(title="اختر مجلد الحفظ") # Choose Save Folder
+        if not download_path:
+            self.status_label.configure(text="تم إلغاء التنزيل.") # Download cancelled.
+            return
+
+        # Without fetched info there is no format index, so each link gets the best quality of the chosen type
+        format_string = build_format_string(self.bulk_format_optionmenu.get(), "")
+        for url in urls:
+            self.download_manager.add(url, format_string, download_path)
+        self.bulk_urls_textbox.delete("1.0", "end")
+        self.status_label.configure(text=f"تمت إضافة {len(urls)} رابط إلى قائمة التنزيلات.") # N links added to the download list.
+
+    def clear_finished_downloads(self):
+        self.download_manager.clear_done()
+
+    def refresh_downloads(self):
+        # Progress hooks only write to the manager's state table; the UI reads it here on a fixed timer
         try:
-            ydl_opts = {
-                'format': format_string,
-                'outtmpl': os.path.join(download_path, '%(title)s.%(ext)s'),
-                'progress_hooks': [self.download_progress_hook],
-                'quiet': False, # Set to False to see yt-dlp output in console for debugging
-            }
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
-            self.after(0, lambda: self.status_label.configure(text=f"تم التنزيل بنجاح إلى: {download_path}")) # Downloaded successfully to:
-            messagebox.showinfo("نجاح", f"تم تنزيل الفيديو بنجاح إلى:\n{download_path}") # Success, Video downloaded successfully to:
-        except yt_dlp.utils.DownloadError as e:
-            self.after(0, lambda: self.status_label.configure(text=f"خطأ في التنزيل: {e}")) # Download error:
-            messagebox.showerror("خطأ", f"تعذر تنزيل الفيديو: {e}\nتأكد من تثبيت ffmpeg إذا كنت تقوم بتنزيل فيديو وصوت معًا.") # Error, Could not download video: Make sure ffmpeg is installed if you are downloading video and audio together.
-        except Exception as e:
-            self.after(0, lambda: self.status_label.configure(text=f"حدث خطأ غير متوقع أثناء التنزيل: {e}")) # An unexpected error occurred during download:
-            messagebox.showerror("خطأ", f"حدث خطأ غير متوقع أثناء التنزيل: {e}") # Error, An unexpected error occurred during download:
+            if self.download_manager.version != self._seen_version:
+                self._seen_version = self.download_manager.version
+                items, totals = self.download_manager.snapshot()
+                self._render_downloads(items, totals)
         finally:
-            self.after(0, lambda: self.download_button.configure(state="normal"))
-            self.after(0, lambda: self.fetch_button.configure(state="normal"))
-            self.after(0, lambda: self.progress_bar.set(0))
-
-    def download_progress_hook(self, d):
-        if d['status'] == 'downloading':
-            total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate')
-            downloaded_bytes = d.get('downloaded_bytes')
-            if total_bytes and downloaded_bytes:
-                progress = downloaded_bytes / total_bytes
-                self.after(0, lambda: self.progress_bar.set(progress))
-                speed = d.get('speed')
-                eta = d.get('eta')
-                status_text = f"جاري التنزيل: {progress:.1%} - السرعة: {speed/1024:.1f} KiB/s - الوقت المتبقي: {eta} ثانية" if speed and eta else f"جاري التنزيل: {progress:.1%}" # Downloading: - Speed: KiB/s - ETA: seconds
-                self.after(0, lambda: self.status_label.configure(text=status_text))
-        elif d['status'] == 'finished':
-            self.after(0, lambda: self.progress_bar.set(1))
-            self.after(0, lambda: self.status_label.configure(text="اكتمل التنزيل!")) # Download complete!
-        elif d['status'] == 'error':
-            self.after(0, lambda: self.status_label.configure(text="خطأ في التنزيل.")) # Download error.
+            self.after(UI_REFRESH_MS, self.refresh_downloads)
+
+    def _render_downloads(self, items, totals):
+        current_ids = {item["item_id"] for item in items}
+        for item_id in list(self.download_rows):
+            if item_id not in current_ids:
+                self.download_rows.pop(item_id).destroy()
+                self._item_states.pop(item_id, None)
+
+        for position, item in enumerate(items):
+            row = self.download_rows.get(item["item_id"])
+            if row is None:
+                row = DownloadRow(self.queue_frame, self.download_manager, item["item_id"])
+                self.download_rows[item["item_id"]] = row
+            row.grid(row=position, column=0, padx=5, pady=5, sticky="ew")
+            row.update_from(item)
+
+            previous = self._item_states.get(item["item_id"])
+            if previous is not None and previous != item["status"]:
+                if item["status"] == ITEM_FINISHED:
+                    self.status_label.configure(text=f"تم التنزيل بنجاح إلى: {item['download_path']}") # Downloaded successfully to:
+                elif item["status"] == ITEM_ERROR:
+                    self.status_label.configure(text=f"خطأ في التنزيل: {item['error']}") # Download error:
+            self._item_states[item["item_id"]] = item["status"]
+
+        counts = totals["counts"]
+        if not items:
+            summary = "قائمة التنزيلات فارغة." # Download list is empty.
+        else:
+            summary = (f"جاري التنزيل: {counts.get(ITEM_DOWNLOADING, 0)} - في الانتظار: {counts.get(ITEM_QUEUED, 0)}" # Downloading: - Waiting:
+                       f" - اكتمل: {counts.get(ITEM_FINISHED, 0)}") # Complete:
+            if totals["speed"]:
+                summary += f" - السرعة الكلية: {format_speed(totals['speed'])}" # Total speed:
+        self.queue_summary_label.configure(text=summary)
+        self.progress_bar.set(totals["progress"])
+
+    def on_close(self):
+        # Running downloads are interrupted and resume from their partial files on the next start
+        self.download_manager.shutdown()
+        self.destroy()
 
 if __name__ == "__main__":
-    app = VideoDownloaderApp()
+    with STARTUP.phase("window"):
+        app = VideoDownloaderApp()
     app.mainloop()
+    ydl_pool.close()
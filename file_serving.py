@@ -0,0 +1,166 @@
+import os
+import asyncio
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote
+
+from starlette.responses import Response
+
+# حجم الجزء المرسل في كل مرة عندما لا يدعم الخادم الإرسال بدون نسخ
+FILE_CHUNK_SIZE = int(os.environ.get("FILE_CHUNK_SIZE", str(256 * 1024)))
+# عند التشغيل خلف nginx: مسار داخلي يقابل مجلد التنزيلات (مثل /protected-downloads/)
+# فيتولى nginx إرسال الملف عبر sendfile مع دعم Range بدلاً من Python
+X_ACCEL_REDIRECT_PREFIX = os.environ.get("X_ACCEL_REDIRECT_PREFIX", "")
+
+
+def content_disposition(file_name: str) -> str:
+    return f"attachment; filename*=UTF-8''{quote(file_name)}"
+
+
+def make_etag(stat_result: os.stat_result) -> str:
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def parse_range(range_header: str, size: int):
+    """تحليل ترويسة Range ذات نطاق واحد. يعيد (start, end) شاملة،
+    أو None إذا كانت الترويسة غير مدعومة، أو ValueError إذا كان النطاق غير قابل للتحقيق."""
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        # النطاقات المتعددة غير مدعومة: نعيد الملف كاملاً
+        return None
+    start_str, _, end_str = spec.strip().partition("-")
+    try:
+        if start_str == "":
+            # bytes=-N: آخر N بايت
+            length = int(end_str)
+            if length <= 0:
+                raise ValueError("empty suffix range")
+            return max(size - length, 0), size - 1
+        start = int(start_str)
+        end = int(end_str) if end_str else size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise ValueError("range not satisfiable")
+    return start, min(end, size - 1)
+
+
+class RangeFileResponse(Response):
+    """إرسال ملف مع دعم Range و If-Range و ETag و Last-Modified و HEAD.
+
+    يستخدم امتداد ASGI ``http.response.zerocopysend`` (sendfile) إذا كان الخادم يدعمه،
+    وإلا يرسل الملف على أجزاء تُقرأ خارج حلقة الأحداث.
+    """
+
+    def __init__(self, request, path: str, file_name: str, stat_result: os.stat_result,
+                 media_type: str = "application/octet-stream", cache_control: str = None):
+        super().__init__(media_type=media_type)
+        self.path = path
+        self.send_body = request.method != "HEAD"
+        self.start = 0
+        self.length = stat_result.st_size
+        self.x_accel_path = None
+
+        etag = make_etag(stat_result)
+        headers = {
+            "accept-ranges": "bytes",
+            "etag": etag,
+            "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+            "content-disposition": content_disposition(file_name),
+        }
+        if cache_control:
+            headers["cache-control"] = cache_control
+
+        if self._not_modified(request, etag, stat_result.st_mtime):
+            self.status_code = 304
+            self.length = 0
+            self.send_body = False
+        else:
+            range_header = request.headers.get("range")
+            if range_header and self._if_range_matches(request, etag, stat_result.st_mtime):
+                try:
+                    byte_range = parse_range(range_header, stat_result.st_size)
+                except ValueError:
+                    byte_range = None
+                    self.status_code = 416
+                    self.length = 0
+                    self.send_body = False
+                    headers["content-range"] = f"bytes */{stat_result.st_size}"
+                if byte_range:
+                    self.start, end = byte_range
+                    self.length = end - self.start + 1
+                    self.status_code = 206
+                    headers["content-range"] = f"bytes {self.start}-{end}/{stat_result.st_size}"
+            if self.status_code in (200, 206) and X_ACCEL_REDIRECT_PREFIX and self.send_body:
+                # nginx يتولى Range والإرسال بنفسه، لذا نرسل الترويسة فقط
+                self.x_accel_path = X_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + quote(
+                    os.path.relpath(path, os.environ.get("X_ACCEL_REDIRECT_ROOT", ".")).replace(os.sep, "/")
+                )
+                headers["x-accel-redirect"] = self.x_accel_path
+                headers.pop("content-range", None)
+                self.status_code = 200
+                self.length = 0
+                self.send_body = False
+
+        if self.status_code != 304 and not self.x_accel_path:
+            headers["content-length"] = str(self.length)
+        self.init_headers(headers)
+
+    @staticmethod
+    def _not_modified(request, etag: str, mtime: float) -> bool:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            return "*" in tags or etag in tags
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    @staticmethod
+    def _if_range_matches(request, etag: str, mtime: float) -> bool:
+        if_range = request.headers.get("if-range")
+        if not if_range:
+            return True
+        if if_range.startswith('"') or if_range.startswith("W/"):
+            return if_range == etag
+        try:
+            return int(mtime) == int(parsedate_to_datetime(if_range).timestamp())
+        except (TypeError, ValueError):
+            return False
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body or not self.length:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        f = await asyncio.to_thread(open, self.path, "rb")
+        try:
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f,
+                    "offset": self.start,
+                    "count": self.length,
+                })
+                return
+            await asyncio.to_thread(f.seek, self.start)
+            remaining = self.length
+            while remaining > 0:
+                chunk = await asyncio.to_thread(f.read, min(FILE_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            f.close()
+
+
+async def file_response(request, path: str, file_name: str, cache_control: str = None) -> RangeFileResponse:
+    stat_result = await asyncio.to_thread(os.stat, path)
+    return RangeFileResponse(request, path, file_name, stat_result, cache_control=cache_control)
@@ -0,0 +1,280 @@
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+
+# أنواع الصيغ كما تظهر في الواجهة
+FORMAT_VIDEO_AUDIO = "فيديو + صوت"
+FORMAT_VIDEO_ONLY = "فيديو فقط"
+FORMAT_AUDIO_ONLY = "صوت فقط"
+FORMAT_TYPES = (FORMAT_VIDEO_AUDIO, FORMAT_VIDEO_ONLY, FORMAT_AUDIO_ONLY)
+
+# امتدادات الصوت التي يمكن دمجها مع كل امتداد فيديو دون إعادة ترميز أو تغيير الحاوية
+COMPATIBLE_AUDIO_EXTS = {
+    "mp4": ("m4a", "mp4"),
+    "webm": ("webm",),
+}
+
+# عدد الفهارس المحفوظة لآخر قواميس معلومات تم استخدامها
+INDEX_CACHE_SIZE = 32
+
+
+def parse_quality(quality: str):
+    """'1080p' أو '128k' -> 1080 أو 128، أو None إذا لم تحتوِ على رقم."""
+    if not quality:
+        return None
+    try:
+        return int(''.join(filter(str.isdigit, quality)))
+    except ValueError:
+        return None
+
+
+def _format_height(f: dict):
+    height = f.get('height')
+    if height:
+        return int(height)
+    resolution_str = f.get('resolution')
+    if resolution_str and 'x' in resolution_str:
+        try:
+            return int(resolution_str.split('x')[1])
+        except ValueError:
+            return None
+    format_note = f.get('format_note')
+    if format_note and 'p' in format_note:
+        return parse_quality(format_note)
+    return None
+
+
+def _format_size(f: dict):
+    return f.get('filesize') or f.get('filesize_approx')
+
+
+class FormatIndex:
+    """جدول أعمدة مضغوط لصيغ فيديو واحد يُبنى مرة واحدة لكل قاموس معلومات.
+
+    كل عمود قائمة بنفس الطول (صف لكل صيغة صالحة). لكل نوع صيغة نحفظ الجودات
+    المتاحة مرتبة رقميًا مع أفضل صف لكل جودة، فتتم الاستعلامات مثل
+    "أفضل فيديو بارتفاع لا يتجاوز h" ببحث ثنائي بدلاً من المرور على كل الصيغ.
+    """
+
+    def __init__(self, formats: list[dict]):
+        self.format_id = []
+        self.ext = []
+        self.height = []
+        self.abr = []
+        self.tbr = []
+        self.filesize = []
+        self.has_video = []
+        self.has_audio = []
+
+        for f in formats or []:
+            ext = f.get('ext')
+            if not ext or not f.get('format_id'):
+                continue
+            vcodec = f.get('vcodec')
+            acodec = f.get('acodec')
+            self.format_id.append(f['format_id'])
+            self.ext.append(ext)
+            self.height.append(_format_height(f))
+            self.abr.append(int(f['abr']) if f.get('abr') else None)
+            self.tbr.append(f.get('tbr') or 0)
+            self.filesize.append(_format_size(f))
+            self.has_video.append(vcodec != 'none')
+            self.has_audio.append(acodec != 'none')
+
+        rows = range(len(self.format_id))
+        # "فيديو + صوت" يعرض كل جودات الفيديو (حتى الفيديو فقط، لأنه يُدمج مع أفضل صوت)
+        self._levels = {
+            FORMAT_VIDEO_AUDIO: self._build_levels(
+                (i for i in rows if self.has_video[i] and self.height[i]), self.height),
+            FORMAT_VIDEO_ONLY: self._build_levels(
+                (i for i in rows if self.has_video[i] and not self.has_audio[i] and self.height[i]), self.height),
+            FORMAT_AUDIO_ONLY: self._build_levels(
+                (i for i in rows if not self.has_video[i] and self.has_audio[i] and self.abr[i]), self.abr),
+        }
+        # صيغ الصوت فقط مرتبة حسب الجودة، لاختيار صوت متوافق مع امتداد الفيديو
+        self._audio_rows = sorted(
+            (i for i in rows if not self.has_video[i] and self.has_audio[i]),
+            key=lambda i: (self.abr[i] or 0, self.tbr[i]),
+        )
+
+    def _build_levels(self, row_ids, column):
+        best = {}
+        for i in row_ids:
+            value = column[i]
+            current = best.get(value)
+            if current is None or self._rank(i) > self._rank(current):
+                best[value] = i
+        values = sorted(best)
+        return values, [best[value] for value in values]
+
+    def _rank(self, i: int):
+        # عند تساوي الجودة: نفضل الصيغة المدمجة ثم الأعلى معدلاً
+        return (self.has_video[i] and self.has_audio[i], self.tbr[i])
+
+    def __len__(self):
+        return len(self.format_id)
+
+    def qualities(self, format_type: str) -> list[int]:
+        values, _ = self._levels.get(format_type, ([], []))
+        return list(values)
+
+    def available_formats(self) -> dict:
+        """الجودات المتاحة لكل نوع صيغة بالشكل الذي تعرضه الواجهة، مرتبة رقميًا."""
+        result = {}
+        for format_type, (values, _) in self._levels.items():
+            if values:
+                suffix = "k" if format_type == FORMAT_AUDIO_ONLY else "p"
+                result[format_type] = [f"{value}{suffix}" for value in values]
+        return result
+
+    def best(self, format_type: str, max_quality: int = None):
+        """رقم صف أفضل صيغة لا تتجاوز جودتها max_quality (بحث ثنائي)، أو None."""
+        values, row_ids = self._levels.get(format_type, ([], []))
+        if not values:
+            return None
+        if max_quality is None:
+            return row_ids[-1]
+        position = bisect_right(values, max_quality) - 1
+        return row_ids[position] if position >= 0 else None
+
+    def snap_quality(self, format_type: str, quality_value: int):
+        """أعلى جودة متاحة لا تتجاوز القيمة المطلوبة."""
+        values, _ = self._levels.get(format_type, ([], []))
+        position = bisect_right(values, quality_value) - 1
+        return values[position] if position >= 0 else None
+
+    def best_audio_for(self, video_row: int):
+        """أفضل صوت متوافق مع امتداد الفيديو، وإلا أفضل صوت متاح."""
+        if not self._audio_rows:
+            return None
+        compatible = COMPATIBLE_AUDIO_EXTS.get(self.ext[video_row], ())
+        for i in reversed(self._audio_rows):
+            if self.ext[i] in compatible:
+                return i
+        return self._audio_rows[-1]
+
+    def best_video_with_audio(self, max_height: int = None):
+        """(صف الفيديو، صف الصوت أو None إذا كان الفيديو يحتوي على صوت)."""
+        video_row = self.best(FORMAT_VIDEO_AUDIO, max_height)
+        if video_row is None:
+            return None, None
+        if self.has_audio[video_row]:
+            return video_row, None
+        return video_row, self.best_audio_for(video_row)
+
+    def estimated_size(self, format_type: str, quality_value: int = None):
+        """الحجم التقديري بالبايت للجودة المختارة، أو None إذا لم يكن معروفًا."""
+        if format_type == FORMAT_VIDEO_AUDIO:
+            video_row, audio_row = self.best_video_with_audio(quality_value)
+            if video_row is None or not self.filesize[video_row]:
+                return None
+            audio_size = self.filesize[audio_row] if audio_row is not None else 0
+            return int(self.filesize[video_row] + (audio_size or 0))
+        row = self.best(format_type, quality_value)
+        if row is None or not self.filesize[row]:
+            return None
+        return int(self.filesize[row])
+
+    def resolve(self, format_type: str, quality_value: int = None):
+        """معرفات الصيغ الفعلية للنوع والجودة (مثل '137+140') مع الحجم والمعدل التقديريين."""
+        if format_type == FORMAT_VIDEO_AUDIO:
+            video_row, audio_row = self.best_video_with_audio(quality_value)
+            rows = [row for row in (video_row, audio_row) if row is not None]
+        else:
+            row = self.best(format_type, quality_value)
+            rows = [row] if row is not None else []
+        if not rows:
+            return None
+        sizes = [self.filesize[row] for row in rows]
+        return {
+            "format_id": "+".join(self.format_id[row] for row in rows),
+            "filesize": int(sum(sizes)) if all(sizes) else None,
+            "tbr": round(sum(self.tbr[row] for row in rows), 1) or None,
+        }
+
+    def resolved_options(self) -> dict:
+        """الصيغ الفعلية لكل جودة معروضة في available_formats."""
+        result = {}
+        for format_type, labels in self.available_formats().items():
+            options = {label: self.resolve(format_type, parse_quality(label)) for label in labels}
+            result[format_type] = {label: option for label, option in options.items() if option}
+        return result
+
+    def estimated_sizes(self) -> dict:
+        """الحجم التقديري لكل جودة معروضة في available_formats."""
+        result = {}
+        for format_type, labels in self.available_formats().items():
+            sizes = {label: self.estimated_size(format_type, parse_quality(label)) for label in labels}
+            if any(sizes.values()):
+                result[format_type] = sizes
+        return result
+
+
+def formats_by_ids(info_dict: dict, format_id: str):
+    """بناء الصيغة المختارة مباشرة من معرفاتها (مثل '137+140') دون تشغيل محدد الصيغ في yt-dlp.
+
+    يعيد None إذا لم يعد أحد المعرفات موجودًا في قاموس المعلومات.
+    """
+    formats = {f.get('format_id'): f for f in info_dict.get('formats') or []}
+    selected = [formats.get(part) for part in format_id.split('+')]
+    if not selected or not all(selected):
+        return None
+    if len(selected) == 1:
+        return dict(selected[0])
+    return {'format_id': format_id, 'requested_formats': selected}
+
+
+_index_cache = OrderedDict()
+_index_lock = threading.Lock()
+
+
+def index_for(info_dict: dict) -> FormatIndex:
+    """فهرس الصيغ لقاموس المعلومات، يُبنى مرة واحدة لكل قاموس (مثل القواميس المحفوظة في InfoCache)."""
+    key = id(info_dict)
+    with _index_lock:
+        cached = _index_cache.get(key)
+        # نحتفظ بمرجع للقاموس نفسه حتى لا يُعاد استخدام معرّفه لقاموس آخر
+        if cached is not None and cached[0] is info_dict:
+            _index_cache.move_to_end(key)
+            return cached[1]
+    index = FormatIndex(info_dict.get('formats', []))
+    with _index_lock:
+        _index_cache[key] = (info_dict, index)
+        _index_cache.move_to_end(key)
+        while len(_index_cache) > INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return index
+
+
+def build_format_string(format_type: str, quality: str, index: FormatIndex = None) -> str:
+    """محدد صيغة yt-dlp للنوع والجودة المختارين.
+
+    إذا توفر فهرس الصيغ، تُقرب الجودة إلى أعلى جودة متاحة، ويُفضل صوت بامتداد
+    متوافق مع الفيديو حتى لا يحتاج الدمج إلى تغيير الحاوية.
+    """
+    quality_value = parse_quality(quality)
+    if index is not None and quality_value and format_type in FORMAT_TYPES:
+        quality_value = index.snap_quality(format_type, quality_value) or quality_value
+
+    if format_type == FORMAT_VIDEO_AUDIO:
+        if not quality_value:
+            return "bestvideo+bestaudio/best"
+        # الصيغة المدمجة البديلة تلتزم بالجودة المطلوبة أيضًا، و best وحدها ملاذ أخير فقط
+        selector = f"bestvideo[height<={quality_value}]+bestaudio/best[height<={quality_value}]/best"
+        if index is not None:
+            video_row, audio_row = index.best_video_with_audio(quality_value)
+            if audio_row is not None and index.ext[audio_row] in COMPATIBLE_AUDIO_EXTS.get(index.ext[video_row], ()):
+                video_ext, audio_ext = index.ext[video_row], index.ext[audio_row]
+                selector = (f"bestvideo[height<={quality_value}][ext={video_ext}]+bestaudio[ext={audio_ext}]/"
+                            + selector)
+        return selector
+    elif format_type == FORMAT_VIDEO_ONLY:
+        if quality_value:
+            return f"bestvideo[height<={quality_value}]"
+        return "bestvideo"
+    elif format_type == FORMAT_AUDIO_ONLY:
+        if quality_value:
+            # abr الفعلي قد يكون كسريًا (129.5 يظهر كـ 129k)، لذا نقارن بالحد الأعلى التالي
+            return f"bestaudio[abr<{quality_value + 1}]"
+        return "bestaudio"
+    raise ValueError("نوع صيغة غير صالح.")
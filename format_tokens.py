@@ -0,0 +1,44 @@
+import os
+import hmac
+import json
+import base64
+import hashlib
+import secrets
+
+# مفتاح توقيع رموز الصيغ. يجب ضبطه بنفس القيمة لكل العمال/الخوادم لتبقى الرموز صالحة بينها
+# وبعد إعادة التشغيل؛ وإلا يُولد مفتاح عشوائي عند بدء العملية.
+FORMAT_TOKEN_SECRET = os.environ.get("FORMAT_TOKEN_SECRET", "").encode("utf-8") or secrets.token_bytes(32)
+
+
+class InvalidFormatToken(ValueError):
+    pass
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _sign(body: str, secret: bytes) -> str:
+    return _b64encode(hmac.new(secret, body.encode("ascii"), hashlib.sha256).digest()[:16])
+
+
+def encode_format_token(payload: dict, secret: bytes = FORMAT_TOKEN_SECRET) -> str:
+    """رمز غير شفاف وموقّع يحمل الصيغة المحددة. نفس المدخلات تعطي نفس الرمز دائمًا."""
+    body = _b64encode(json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+    return f"{body}.{_sign(body, secret)}"
+
+
+def decode_format_token(token: str, secret: bytes = FORMAT_TOKEN_SECRET) -> dict:
+    """التحقق من توقيع الرمز وإعادة محتواه. يرفع InvalidFormatToken إذا كان الرمز معدلاً أو تالفًا."""
+    body, _, signature = token.partition(".")
+    # الرمز الصالح ASCII دائمًا؛ غير ذلك يُرفض قبل التوقيع (encode و compare_digest يرفعان استثناءات أخرى)
+    if not token.isascii() or not body or not signature or not hmac.compare_digest(signature, _sign(body, secret)):
+        raise InvalidFormatToken("رمز الصيغة غير صالح.")
+    try:
+        return json.loads(_b64decode(body))
+    except ValueError:
+        raise InvalidFormatToken("رمز الصيغة غير صالح.")
@@ -0,0 +1,108 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# مدة صلاحية معلومات الفيديو المخزنة (بالثواني). روابط الوسائط التي يعيدها yt-dlp
+# تنتهي صلاحيتها بعد فترة، لذلك يجب أن تبقى هذه المدة قصيرة.
+INFO_CACHE_TTL = int(os.environ.get("INFO_CACHE_TTL", "600"))
+# الحد الأقصى لعدد العناصر المخزنة
+INFO_CACHE_MAX_ENTRIES = int(os.environ.get("INFO_CACHE_MAX_ENTRIES", "256"))
+# الحد الأقصى للذاكرة التقريبية للعناصر المخزنة (بالبايت)
+INFO_CACHE_MAX_BYTES = int(os.environ.get("INFO_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# معاملات التتبع التي لا تغير محتوى الصفحة
+_IGNORED_QUERY_PARAMS = {"fbclid", "gclid", "si", "feature"}
+
+
+def normalize_url(url: str) -> str:
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    if parts.port:
+        host = f"{host}:{parts.port}"
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k not in _IGNORED_QUERY_PARAMS and not k.startswith("utm_")
+    )
+    path = parts.path.rstrip("/") or "/"
+    # يتم تجاهل الجزء بعد # لأنه لا يُرسل إلى الخادم
+    return urlunsplit(((parts.scheme or "https").lower(), host, path, urlencode(query), ""))
+
+
+class InfoCache:
+    """ذاكرة مؤقتة LRU محدودة الحجم ومنتهية الصلاحية لنتائج extract_info."""
+
+    def __init__(self, ttl: int = INFO_CACHE_TTL, max_entries: int = INFO_CACHE_MAX_ENTRIES,
+                 max_bytes: int = INFO_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_bytes = 0
+        # key -> (expires_at, size, info_dict)
+        self._entries: OrderedDict[str, tuple] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, url: str, count: bool = True):
+        """count=False: قراءة دون احتساب إصابة أو إخفاق (للاستخدامات الاختيارية)."""
+        key = normalize_url(url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += count
+                return None
+            expires_at, size, info_dict = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += count
+                return None
+            self._entries.move_to_end(key)
+            self.hits += count
+            return info_dict
+
+    def put(self, url: str, info_dict: dict):
+        try:
+            size = len(json.dumps(info_dict, default=str))
+        except (TypeError, ValueError):
+            return
+        if size > self.max_bytes:
+            return
+        key = normalize_url(url)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, info_dict)
+            self.total_bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self.total_bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            }
@@ -0,0 +1,54 @@
+import os
+import time
+import shutil
+
+# الفترة بين عمليات تنظيف المجلدات اليتيمة (بالثواني)
+JANITOR_INTERVAL = int(os.environ.get("JANITOR_INTERVAL", "600"))
+# عمر المجلد اليتيم (منذ آخر كتابة فيه) قبل حذفه (بالثواني)
+ORPHAN_MAX_AGE = int(os.environ.get("ORPHAN_MAX_AGE", str(6 * 3600)))
+# الحد الأقصى لحجم المجلدات اليتيمة؛ عند تجاوزه تُحذف الأقدم أولاً حتى لو لم تبلغ العمر المحدد
+ORPHAN_MAX_BYTES = int(os.environ.get("ORPHAN_MAX_BYTES", str(5 * 1024 * 1024 * 1024)))
+
+
+def _scan(path: str) -> tuple[int, float]:
+    """حجم المجلد وآخر وقت تعديل لأي ملف داخله."""
+    size = 0
+    newest = os.path.getmtime(path)
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                stat_result = os.stat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            size += stat_result.st_size
+            newest = max(newest, stat_result.st_mtime)
+    return size, newest
+
+
+def sweep_orphans(root: str, keep: set[str], max_age: int = ORPHAN_MAX_AGE,
+                  max_bytes: int = ORPHAN_MAX_BYTES) -> dict:
+    """حذف مجلدات التنزيل التي لا تخص أي مهمة معروفة (مثل بقايا .part و .ytdl بعد توقف مفاجئ).
+
+    keep: أسماء المجلدات داخل root التي يجب عدم لمسها (معرفات المهام ومجلد الذاكرة المؤقتة).
+    """
+    now = time.time()
+    orphans = []
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name in keep or not os.path.isdir(path):
+            continue
+        size, newest = _scan(path)
+        orphans.append((newest, size, path))
+
+    removed = 0
+    freed = 0
+    total = sum(size for _, size, _ in orphans)
+    for newest, size, path in sorted(orphans):
+        if now - newest <= max_age and total <= max_bytes:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed += 1
+        freed += size
+        total -= size
+        print(f"Janitor removed orphaned download folder {path} ({size} bytes)")
+    return {"orphans": len(orphans), "removed": removed, "freed_bytes": freed, "remaining_bytes": total}
@@ -0,0 +1,71 @@
+import os
+import json
+import sqlite3
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# ملف قاعدة بيانات حالة المهام (لاستئناف التنزيلات بعد إعادة تشغيل الخادم)
+JOB_STORE_PATH = os.environ.get("JOB_STORE_PATH", os.path.join("downloads", "jobs.sqlite3"))
+
+
+class JobStore:
+    """مخزن SQLite صغير لسجلات المهام (قاموس لكل مهمة حسب job_id).
+
+    الكتابة تتم على خيط واحد مخصص خارج حلقة الأحداث، فتُنفذ بنفس ترتيب الاستدعاء
+    ولا تكتب لقطة قديمة فوق أحدث منها.
+    """
+
+    def __init__(self, path: str = JOB_STORE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " job_id TEXT PRIMARY KEY,"
+            " status TEXT NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " record TEXT NOT NULL)"
+        )
+        self._db.commit()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-store")
+
+    def save(self, record: dict):
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (job_id, status, updated_at, record) VALUES (?, ?, strftime('%s','now'), ?)"
+                " ON CONFLICT(job_id) DO UPDATE SET status=excluded.status,"
+                " updated_at=excluded.updated_at, record=excluded.record",
+                (record["job_id"], record["status"], json.dumps(record, ensure_ascii=False)),
+            )
+            self._db.commit()
+
+    def delete(self, job_id: str):
+        with self._lock:
+            self._db.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+            self._db.commit()
+
+    def load_all(self) -> list[dict]:
+        with self._lock:
+            rows = self._db.execute("SELECT record FROM jobs ORDER BY rowid").fetchall()
+        records = []
+        for (raw,) in rows:
+            try:
+                records.append(json.loads(raw))
+            except ValueError as e:
+                print(f"Skipping unreadable job record: {e}")
+        return records
+
+    async def asave(self, record: dict):
+        await asyncio.get_running_loop().run_in_executor(self._executor, self.save, record)
+
+    async def adelete(self, job_id: str):
+        await asyncio.get_running_loop().run_in_executor(self._executor, self.delete, job_id)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,422 @@
+import os
+import time
+import uuid
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from info_cache import normalize_url
+
+# عدد عمال التنزيل (الحد الأقصى العام للتنزيلات المتزامنة)
+DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", "4"))
+# الحد الأقصى للتنزيلات المتزامنة من نفس الموقع
+PER_HOST_CONCURRENCY = int(os.environ.get("DOWNLOAD_PER_HOST_CONCURRENCY", "2"))
+# الحد الأقصى لعدد المهام المنتظرة في الطابور
+MAX_QUEUED_JOBS = int(os.environ.get("MAX_QUEUED_JOBS", "100"))
+# مدة الاحتفاظ بنتيجة المهمة (بالثواني) قبل حذفها
+JOB_RESULT_TTL = int(os.environ.get("JOB_RESULT_TTL", "900"))
+# عدد عناصر الدفعة (قائمة التشغيل) التي يمكن تنزيلها في نفس الوقت افتراضيًا
+BATCH_PARALLELISM = int(os.environ.get("BATCH_PARALLELISM", "2"))
+# الحد الأقصى لعدد العناصر في الدفعة الواحدة
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "200"))
+
+# حالات المهمة
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_FINISHED = "finished"
+JOB_ERROR = "error"
+
+
+class QueueFullError(Exception):
+    pass
+
+
+def url_host(url: str) -> str:
+    host = urlparse(url).hostname or ""
+    if host.startswith("www."):
+        host = host[4:]
+    return host
+
+
+class Job:
+    def __init__(self, url: str, format_string: str, client_id: str,
+                 use_custom_folder: bool = False, file_name: str = "video", extras: tuple = ()):
+        self.job_id = str(uuid.uuid4())
+        self.url = url
+        self.host = url_host(url)
+        self.format_string = format_string
+        # جميع العملاء المشتركين في هذه المهمة (الطلبات المتطابقة المتزامنة تُدمج في مهمة واحدة)
+        self.client_ids = [client_id]
+        # صاحب المهمة في جدولة التقاسم العادل (client_id أو عنوان IP)
+        self.owner = client_id
+        self.use_custom_folder = use_custom_folder
+        self.file_name = file_name
+        # ملفات إضافية مطلوبة مع الوسائط ("subtitles" و/أو "thumbnail")
+        self.extras = tuple(sorted(extras))
+        # format_string معرفات صيغ دقيقة (من رمز صيغة) وليس محدد صيغة، والحجم المتوقع إن كان معروفًا
+        self.exact_format = False
+        self.expected_size = None
+        # معرف الصيغة الفعلية بعد التحديد (يُستخدم كما هو عند استئناف المهمة بعد إعادة التشغيل)
+        self.format_id = None
+        self.resumed = False
+        self.status = JOB_QUEUED
+        self.error = None
+        # المجلد الذي تم التنزيل إليه والملف الناتج
+        self.download_path = None
+        self.file_path = None
+        # اسم الملف الذي يظهر للمستخدم (قد يختلف عن اسم الملف في الذاكرة المؤقتة)
+        self.result_name = None
+        # جميع الملفات الناتجة: قائمة (الاسم الظاهر، المسار)، والملف الرئيسي هو file_path
+        self.files: list[tuple[str, str]] = []
+        # مفتاح الملف في الذاكرة المؤقتة الدائمة (إن تم نشره هناك)
+        self.artifact_key = None
+        # الملف الجزئي أثناء التنزيل، وهل يمكن بثه للمتصفح قبل اكتماله
+        self.partial_path = None
+        self.streamable = False
+        # مجموعة المهمة (مثل الدفعة) وحد التزامن الخاص بها
+        self.group = None
+        self.group_limit = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # مدة كل مرحلة بالثواني (queue و extract و select و download و postprocess و serve)
+        self.timings: dict[str, float] = {}
+        # ملخص ملفات النتيجة كما أبلغ عنها yt-dlp (الملفات وأحجامها والصيغ والمعالجات اللاحقة)
+        self.manifest = None
+
+    @property
+    def dedupe_key(self) -> tuple:
+        return (normalize_url(self.url), self.format_string, self.use_custom_folder, self.extras)
+
+    # الحقول التي تُحفظ في مخزن المهام وتُستعاد بعد إعادة تشغيل الخادم
+    RECORD_FIELDS = (
+        "job_id", "url", "format_string", "client_ids", "owner", "use_custom_folder", "file_name", "extras",
+        "exact_format", "expected_size", "format_id", "status", "error", "download_path", "file_path",
+        "result_name", "artifact_key", "files", "partial_path", "created_at", "started_at", "finished_at", "timings",
+        "manifest",
+    )
+
+    def to_record(self) -> dict:
+        return {name: getattr(self, name) for name in self.RECORD_FIELDS}
+
+    @classmethod
+    def from_record(cls, record: dict) -> "Job":
+        job = cls(record["url"], record["format_string"], "")
+        for name in cls.RECORD_FIELDS:
+            if name in record:
+                setattr(job, name, record[name])
+        job.host = url_host(job.url)
+        job.extras = tuple(job.extras or ())
+        job.files = [tuple(item) for item in job.files or []]
+        if "owner" not in record:
+            job.owner = job.client_ids[0] if job.client_ids else ""
+        return job
+
+    def add_client(self, client_id: str):
+        if client_id not in self.client_ids:
+            self.client_ids.append(client_id)
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "url": self.url,
+            "error": self.error,
+            "file_name": self.result_name,
+            "files": [name for name, _ in self.files],
+            "streamable": self.streamable,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "timings": self.timings,
+            "manifest": self.manifest,
+        }
+
+
+class Batch:
+    """مجموعة مهام ناتجة عن قائمة تشغيل أو قائمة روابط، تُنفذ بحد تزامن خاص بها."""
+
+    def __init__(self, source: str, parallelism: int = BATCH_PARALLELISM):
+        self.batch_id = str(uuid.uuid4())
+        self.source = source
+        self.parallelism = parallelism
+        # كل عنصر: {"index", "url", "title", "job_id", "status", "error"}
+        self.items: list[dict] = []
+        self.created_at = time.time()
+        self.finished_at = None
+
+    @property
+    def completed(self) -> int:
+        return sum(1 for item in self.items if item["status"] == JOB_FINISHED)
+
+    @property
+    def failed(self) -> int:
+        return sum(1 for item in self.items if item["status"] == JOB_ERROR)
+
+    def summary(self) -> dict:
+        return {
+            "batch_id": self.batch_id,
+            "status": JOB_FINISHED if self.finished_at else JOB_RUNNING,
+            "total": len(self.items),
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            **self.summary(),
+            "source": self.source,
+            "parallelism": self.parallelism,
+            "items": self.items,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """طابور مهام التنزيل مع مجموعة محدودة من العمال.
+
+    كل عامل يأخذ مهمة لا يتجاوز موقعها حد التزامن الخاص بالموقع، مع تقاسم العمال
+    بالتساوي بين أصحاب المهام، ثم يشغل ``handler(job)`` ويسجل النتيجة في حالة المهمة.
+    """
+
+    def __init__(self, handler, workers: int = DOWNLOAD_WORKERS,
+                 per_host_limit: int = PER_HOST_CONCURRENCY,
+                 max_queued: int = MAX_QUEUED_JOBS,
+                 result_ttl: int = JOB_RESULT_TTL,
+                 on_expire=None,
+                 on_batch_expire=None,
+                 store=None,
+                 admission=None):
+        self.handler = handler
+        self.workers = workers
+        self.per_host_limit = per_host_limit
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self.on_expire = on_expire
+        # تُستدعى عند حذف دفعة منتهية (مثل حذف آخر حالة تقدم محفوظة لها)
+        self.on_batch_expire = on_batch_expire
+        # مخزن دائم لحالة المهام (JobStore) أو None للعمل في الذاكرة فقط
+        self.store = store
+        # التحكم في القبول حسب مساحة القرص (DiskQuota) أو None بلا حد
+        self.admission = admission
+        # منفذ خيوط مخصص لعمليات yt-dlp بدلاً من المنفذ الافتراضي غير المحدود
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="download")
+        self.jobs: dict[str, Job] = {}
+        # المهام المنتظرة أو الجارية حسب مفتاح الدمج
+        self._inflight: dict[tuple, Job] = {}
+        self.coalesced = 0
+        self.batches: dict[str, Batch] = {}
+        self._pending: list[Job] = []
+        self._host_active: dict[str, int] = {}
+        self._group_active: dict[str, int] = {}
+        # المهام الجارية لكل صاحب، وترتيب آخر مرة بدأت فيها مهمة له (للتقاسم العادل)
+        self._owner_active: dict[str, int] = {}
+        self._owner_served: dict[str, int] = {}
+        self._served = 0
+        self._cond = None
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self):
+        self._cond = asyncio.Condition()
+        if self.store:
+            await self._restore()
+        if self.admission:
+            await asyncio.to_thread(self.admission.refresh)
+        for n in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(n)))
+        self._tasks.append(asyncio.create_task(self._reaper()))
+        if self.admission:
+            self._tasks.append(asyncio.create_task(self._refresh_admission()))
+        print(f"Job manager started with {self.workers} workers (per-host limit: {self.per_host_limit})")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _restore(self):
+        """استعادة المهام بعد إعادة التشغيل: المنتهية تبقى متاحة حتى انتهاء مدة الاحتفاظ،
+        وغير المكتملة تعود إلى الطابور لتستأنف من ملفاتها الجزئية."""
+        records = await asyncio.to_thread(self.store.load_all)
+        now = time.time()
+        resumed = 0
+        for record in records:
+            try:
+                job = Job.from_record(record)
+            except (KeyError, TypeError) as e:
+                print(f"Skipping invalid job record: {e}")
+                continue
+            if job.finished_at:
+                if now - job.finished_at > self.result_ttl:
+                    await self._expire(job)
+                    continue
+                self.jobs[job.job_id] = job
+                continue
+            job.status = JOB_QUEUED
+            job.started_at = None
+            job.resumed = True
+            self.jobs[job.job_id] = job
+            self._inflight[job.dedupe_key] = job
+            self._pending.append(job)
+            resumed += 1
+        if records:
+            print(f"Restored {len(self.jobs)} jobs from store ({resumed} resumed)")
+
+    async def persist(self, job: Job):
+        if not self.store:
+            return
+        try:
+            await self.store.asave(job.to_record())
+        except Exception as e:
+            print(f"Error persisting job {job.job_id}: {e}")
+
+    async def _expire_batch(self, batch: Batch):
+        if self.on_batch_expire:
+            try:
+                await self.on_batch_expire(batch)
+            except Exception as e:
+                print(f"Error expiring batch {batch.batch_id}: {e}")
+
+    async def _expire(self, job: Job):
+        if self.on_expire:
+            try:
+                await self.on_expire(job)
+            except Exception as e:
+                print(f"Error expiring job {job.job_id}: {e}")
+        if self.store:
+            try:
+                await self.store.adelete(job.job_id)
+            except Exception as e:
+                print(f"Error deleting stored job {job.job_id}: {e}")
+
+    async def submit(self, job: Job) -> Job:
+        """إضافة مهمة إلى الطابور. إذا كانت هناك مهمة مطابقة قيد الانتظار أو التنفيذ
+        يتم ضم العميل إليها وإعادتها بدلاً من إنشاء تنزيل جديد."""
+        async with self._cond:
+            existing = self._inflight.get(job.dedupe_key)
+            if existing is not None:
+                for client_id in job.client_ids:
+                    existing.add_client(client_id)
+                self.coalesced += 1
+                print(f"Coalesced request for {job.url} into job {existing.job_id}")
+                return existing
+            if len(self._pending) >= self.max_queued:
+                raise QueueFullError("طابور التنزيل ممتلئ، حاول لاحقًا.")
+            if self.admission:
+                self.admission.check(self.admission.reservation_for_job(job))
+            self.jobs[job.job_id] = job
+            self._inflight[job.dedupe_key] = job
+            self._pending.append(job)
+            self._cond.notify_all()
+        print(f"Queued job {job.job_id} for URL: {job.url}")
+        await self.persist(job)
+        return job
+
+    def get(self, job_id: str):
+        return self.jobs.get(job_id)
+
+    def free_slots(self) -> int:
+        return max(self.max_queued - len(self._pending), 0)
+
+    def queue_position(self, job: Job):
+        try:
+            return self._pending.index(job)
+        except ValueError:
+            return None
+
+    def _next_runnable(self):
+        # تقاسم عادل بين العملاء: من بين المهام التي يسمح بها حد الموقع والمجموعة نبدأ بصاحب
+        # أقل عدد من المهام الجارية، ثم الأقدم خدمة، ثم الأقدم في الطابور. هكذا لا يحجز
+        # عميل واحد كل العمال بإرسال طابور طويل، ويتناوب العملاء على العمال المتاحين
+        candidates = [
+            (self._owner_active.get(job.owner, 0), self._owner_served.get(job.owner, 0), i)
+            for i, job in enumerate(self._pending)
+            if self._host_active.get(job.host, 0) < self.per_host_limit
+            and not (job.group and self._group_active.get(job.group, 0) >= job.group_limit)
+        ]
+        for _, _, i in sorted(candidates):
+            job = self._pending[i]
+            if self.admission:
+                nbytes = self.admission.reservation_for_job(job)
+                if nbytes and not self.admission.try_reserve(job.job_id, nbytes):
+                    continue
+            del self._pending[i]
+            self._host_active[job.host] = self._host_active.get(job.host, 0) + 1
+            if job.group:
+                self._group_active[job.group] = self._group_active.get(job.group, 0) + 1
+            self._owner_active[job.owner] = self._owner_active.get(job.owner, 0) + 1
+            self._served += 1
+            self._owner_served[job.owner] = self._served
+            return job
+        return None
+
+    async def _worker(self, n: int):
+        while True:
+            async with self._cond:
+                job = await self._cond.wait_for(self._next_runnable)
+            job.status = JOB_RUNNING
+            job.started_at = time.time()
+            await self.persist(job)
+            interrupted = False
+            try:
+                await self.handler(job)
+                job.status = JOB_FINISHED
+            except asyncio.CancelledError:
+                # إيقاف الخادم أثناء التنزيل: تبقى المهمة غير مكتملة في المخزن لتُستأنف لاحقًا
+                interrupted = True
+                raise
+            except Exception as e:
+                print(f"Job {job.job_id} failed in worker {n}: {e}")
+                job.status = JOB_ERROR
+                job.error = str(e)
+            finally:
+                if not interrupted:
+                    job.finished_at = time.time()
+                    await self.persist(job)
+                if self.admission:
+                    self.admission.release(job.job_id)
+                async with self._cond:
+                    if self._inflight.get(job.dedupe_key) is job:
+                        del self._inflight[job.dedupe_key]
+                    self._host_active[job.host] -= 1
+                    if not self._host_active[job.host]:
+                        del self._host_active[job.host]
+                    if job.group:
+                        self._group_active[job.group] -= 1
+                        if not self._group_active[job.group]:
+                            del self._group_active[job.group]
+                    self._owner_active[job.owner] -= 1
+                    if not self._owner_active[job.owner]:
+                        del self._owner_active[job.owner]
+                        del self._owner_served[job.owner]
+                    self._cond.notify_all()
+
+    async def _refresh_admission(self):
+        # إعادة حساب استخدام القرص دوريًا، وإيقاظ العمال إذا توفرت مساحة لمهام منتظرة
+        while True:
+            await asyncio.sleep(self.admission.refresh_interval)
+            try:
+                await asyncio.to_thread(self.admission.refresh)
+            except Exception as e:
+                print(f"Error refreshing disk usage: {e}")
+            async with self._cond:
+                self._cond.notify_all()
+
+    async def _reaper(self):
+        # حذف المهام المنتهية بعد انتهاء مدة الاحتفاظ بنتيجتها
+        while True:
+            await asyncio.sleep(min(60, self.result_ttl))
+            now = time.time()
+            expired = [
+                job for job in self.jobs.values()
+                if job.finished_at and now - job.finished_at > self.result_ttl
+            ]
+            for job in expired:
+                del self.jobs[job.job_id]
+                await self._expire(job)
+            for batch in [b for b in self.batches.values() if b.finished_at and now - b.finished_at > self.result_ttl]:
+                del self.batches[batch.batch_id]
+                await self._expire_batch(batch)
@@ -0,0 +1,49 @@
+import time
+import types
+import importlib
+import threading
+
+from startup_timing import STARTUP
+
+
+class LazyModule(types.ModuleType):
+    """وحدة تُستورد عند أول وصول إلى أي من خصائصها بدلاً من وقت استيراد الوحدة التي تستخدمها.
+
+    استيراد yt_dlp يكلف مئات المللي ثواني، فلا يدفعها بدء التشغيل نفسه بل أول استخدام
+    (أو الإحماء في الخلفية). الاستيراد الأول محمي بقفل، فالخيوط المتزامنة تنتظره ولا تكرره.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self) -> types.ModuleType:
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    started = time.perf_counter()
+                    module = importlib.import_module(self.__name__)
+                    STARTUP.record(f"import_{self.__name__}", time.perf_counter() - started, once=True)
+                    self._module = module
+        return self._module
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, name: str):
+        return getattr(self.load(), name)
+
+
+# وحدة كسولة واحدة لكل اسم، فيُقاس الاستيراد ويُعرف تحميله من أي مكان يستخدمها
+_LAZY_MODULES: dict[str, LazyModule] = {}
+_registry_lock = threading.Lock()
+
+
+def lazy_import(name: str) -> LazyModule:
+    with _registry_lock:
+        module = _LAZY_MODULES.get(name)
+        if module is None:
+            module = _LAZY_MODULES[name] = LazyModule(name)
+        return module
@@ -1,27 +1,108 @@
+# يُسجل أولاً حتى يشمل قياس مرحلة الاستيراد كل الوحدات التالية
+from startup_timing import STARTUP
+STARTUP.start("imports")
+
 import os
 import shutil
-import uuid
 import asyncio
 import platform
+import copy
 import json
+import math
+import time
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
 
-from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi import FastAPI, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, StreamingResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 
-import yt_dlp
 from pydantic import BaseModel
 
+from jobs import Job, Batch, JobManager, QueueFullError, url_host, JOB_QUEUED, JOB_RUNNING, JOB_ERROR, JOB_FINISHED, BATCH_PARALLELISM, BATCH_MAX_ITEMS, DOWNLOAD_WORKERS
+from info_cache import InfoCache, normalize_url
+from singleflight import SingleFlight
+from artifact_cache import ArtifactCache, artifact_key, request_alias
+from streaming import is_streamable, wait_for_file, tail_growing_file
+from file_serving import file_response, content_disposition
+from progress import ProgressChannel, compact_progress
+from progress_broker import create_progress_broker, is_terminal
+from archives import iter_zip, iter_tar, open_tar_entries, tar_size, ARCHIVE_MEDIA_TYPES
+from ydl_pool import YoutubeDLPool
+from parallel_download import connection_budget, wanted_connections, is_ranged_candidate, is_fragmented, requires_ytdlp_processing
+from mux_pipeline import is_mux_candidate
+from download_workers import ProcessWorkerPool, run_download, DOWNLOAD_BACKEND, PROCESS_WORKERS
+from artifact_manifest import ArtifactManifest
+from thumbnails import ThumbnailCache, ThumbnailError, read_limited, THUMBNAIL_FORMATS
+from job_store import JobStore
+from disk_quota import DiskQuota, InsufficientStorageError, StorageBusyError
+from metrics import (Gauge, Counter, MetricsMiddleware, job_stage, record_stage, render as render_metrics,
+                     monitor_event_loop,
+                     EXTRACT_SECONDS, JOBS_TOTAL, DOWNLOAD_THROUGHPUT, DOWNLOADED_BYTES, MERGE_SECONDS,
+                     PROGRESS_SUBSCRIBERS)
+from rate_limit import (RateLimiter, RateLimitedError, CLIENT_REQUESTS_PER_MINUTE, CLIENT_BURST,
+                        HOST_REQUESTS_PER_MINUTE, HOST_BURST, HOST_MAX_WAIT)
+from janitor import sweep_orphans, JANITOR_INTERVAL
+from format_index import index_for, build_format_string, formats_by_ids, parse_quality
+from format_tokens import encode_format_token, decode_format_token, InvalidFormatToken
+from lazy_import import lazy_import
+
+# yt-dlp يُستورد عند أول استخدام (أو في الإحماء بعد بدء الخادم) وليس عند بدء التشغيل
+yt_dlp = lazy_import("yt_dlp")
+STARTUP.finish("imports")
+STARTUP.milestone("imported")
+STARTUP.start("app")
+
+# إحماء yt-dlp في الخلفية بعد بدء الخادم: استيراده وتجهيز كائن لجلب المعلومات وتحميل المستخرج العام
+YTDL_WARMUP = os.environ.get("YTDL_WARMUP", "1").lower() in ("1", "true", "yes", "on")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # تشغيل عمال طابور التنزيل مع بدء الخادم وإيقافهم عند الإغلاق
+    # استعادة المهام المحفوظة (واستئناف غير المكتملة) قبل تنظيف المجلدات اليتيمة
+    with STARTUP.phase("lifespan"):
+        await job_manager.start()
+    janitor_task = asyncio.create_task(run_janitor())
+    loop_monitor_task = asyncio.create_task(monitor_event_loop())
+    # الإحماء لا يؤخر بدء الاستماع: الطلبات التي تصل أثناءه تنتظر نفس الاستيراد ولا تكرره
+    warmup_task = asyncio.create_task(warm_up_ytdl()) if YTDL_WARMUP else None
+    STARTUP.milestone("ready")
+    STARTUP.print_report()
+    yield
+    janitor_task.cancel()
+    loop_monitor_task.cancel()
+    if warmup_task:
+        warmup_task.cancel()
+    await job_manager.stop()
+    job_store.close()
+    ydl_pool.close()
+    if download_workers is not None:
+        await asyncio.to_thread(download_workers.close)
+    artifact_cache.close()
+    await progress_broker.close()
+    info_executor.shutdown(wait=False, cancel_futures=True)
+
 # تهيئة تطبيق FastAPI
 app = FastAPI(
     title="Video Downloader Web App",
     description="تطبيق ويب بسيط لتنزيل الفيديوهات باستخدام FastAPI و yt-dlp.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
+# زمن الطلبات وعدد البايتات المرسلة لكل مسار (تظهر في /metrics)
+app.add_middleware(MetricsMiddleware)
 
 # دليل مؤقت للتنزيلات داخل مجلد المشروع
 PROJECT_DOWNLOAD_DIR = "downloads"
+# دليل الذاكرة المؤقتة الدائمة للملفات المنزلة
+ARTIFACT_CACHE_DIR = os.environ.get("ARTIFACT_CACHE_DIR", os.path.join(PROJECT_DOWNLOAD_DIR, "cache"))
+# ترويسة Cache-Control لروابط الملفات الثابتة في الذاكرة المؤقتة (تسمح لشبكة CDN بتخزينها)
+ARTIFACT_CACHE_CONTROL = os.environ.get("ARTIFACT_CACHE_CONTROL", "public, max-age=86400")
+# دليل الذاكرة المؤقتة للصور المصغرة (الأصلية والنسخ المصغرة)
+THUMBNAIL_CACHE_DIR = os.environ.get("THUMBNAIL_CACHE_DIR", os.path.join(PROJECT_DOWNLOAD_DIR, "thumbnails"))
+# ترويسة Cache-Control للصور المصغرة: محتوى الرابط الموقّع لا يتغير، فيُخزن طويلاً
+THUMBNAIL_CACHE_CONTROL = os.environ.get("THUMBNAIL_CACHE_CONTROL", "public, max-age=604800, immutable")
 # دليل الملفات الثابتة (لواجهة المستخدم HTML/CSS/JS)
 STATIC_DIR = "static"
 # اسم المجلد المخصص لتنزيل الفيديوهات داخله (في مجلد تنزيلات المستخدم)
@@ -31,96 +112,164 @@ APP_DOWNLOAD_FOLDER_NAME = "MyVideoDownloads"
 os.makedirs(PROJECT_DOWNLOAD_DIR, exist_ok=True)
 os.makedirs(STATIC_DIR, exist_ok=True)
 
-# تهيئة Jinja2Templates لخدمة ملفات HTML
-templates = Jinja2Templates(directory=STATIC_DIR)
+# قوالب Jinja2 لخدمة ملفات HTML، تُنشأ عند أول طلب للصفحة الرئيسية (استيراد jinja2 يبطئ بدء التشغيل)
+_templates = None
+
+def get_templates():
+    global _templates
+    if _templates is None:
+        from fastapi.templating import Jinja2Templates
+        _templates = Jinja2Templates(directory=STATIC_DIR)
+    return _templates
 
 # خدمة الملفات الثابتة (مثل ملف index.html)
 app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
-# قاموس لتخزين اتصالات WebSocket النشطة
-active_websockets: dict[str, WebSocket] = {}
+# الذاكرة المؤقتة الدائمة للملفات المنزلة (تبقى بعد إعادة تشغيل الخادم)
+artifact_cache = ArtifactCache(ARTIFACT_CACHE_DIR)
 
-# منطق جلب معلومات الفيديو
-def get_video_info_core(url: str) -> dict:
-    print(f"Attempting to fetch info for URL: {url}")
-    ydl_opts = {
-        'quiet': False,
-        'simulate': True,
-        'force_generic_extractor': True,
-        'skip_download': True,
-        'allow_playlist_skiplinks': True,
-    }
+# وسيط نشر تقدم المهام: أي عدد من المشتركين (WebSocket أو SSE) لكل مهمة،
+# مع إعادة إرسال آخر حالة معروفة عند الاشتراك. يستخدم Redis إذا تم ضبط PROGRESS_BROKER_URL.
+progress_broker = create_progress_broker()
+
+# مجمع كائنات YoutubeDL يُعاد استخدامها بين الطلبات (مع اتصالات keep-alive لنفس الخوادم)
+ydl_pool = YoutubeDLPool()
+
+# DOWNLOAD_BACKEND=process: كل تنزيل في عملية فرعية بحدود ذاكرة ومدة (يتطلب نظام POSIX)
+if DOWNLOAD_BACKEND == "process" and os.name != "posix":
+    print("DOWNLOAD_BACKEND=process is only supported on POSIX systems; using threads")
+download_workers = (ProcessWorkerPool(PROCESS_WORKERS or DOWNLOAD_WORKERS)
+                    if DOWNLOAD_BACKEND == "process" and os.name == "posix" else None)
+
+# خيارات yt-dlp الثابتة لكل نوع من العمليات؛ ما يختلف بين الطلبات يُمرر عند الاستعارة من المجمع
+INFO_YDL_OPTS = {
+    'quiet': False,
+    'simulate': True,
+    'force_generic_extractor': True,
+    'skip_download': True,
+    'allow_playlist_skiplinks': True,
+}
+RESOLVE_YDL_OPTS = {
+    'quiet': True,
+    'simulate': True,
+    'noplaylist': True,
+}
+DOWNLOAD_YDL_OPTS = {
+    'quiet': True,
+    'noplaylist': True,
+    # استئناف الملفات الجزئية (.part) للمهام المستعادة بعد إعادة التشغيل
+    'continuedl': True,
+}
+PLAYLIST_YDL_OPTS = {
+    'quiet': True,
+    'extract_flat': 'in_playlist',
+    'lazy_playlist': True,
+    'skip_download': True,
+}
+
+# خيوط مخصصة لاستخراج المعلومات وتوسيع قوائم التشغيل، حتى لا تستهلك الطلبات الكثيرة
+# منفذ asyncio.to_thread الافتراضي الذي تعتمد عليه بقية عمليات الملفات
+INFO_WORKERS = int(os.environ.get("INFO_WORKERS", "8"))
+info_executor = ThreadPoolExecutor(max_workers=INFO_WORKERS, thread_name_prefix="info")
+
+# حدود معدل الطلبات: لكل عميل (IP و client_id) ولكل موقع مصدر عند الاستخراج الفعلي
+client_limiter = RateLimiter(CLIENT_REQUESTS_PER_MINUTE, CLIENT_BURST)
+host_limiter = RateLimiter(HOST_REQUESTS_PER_MINUTE, HOST_BURST)
+
+# ذاكرة مؤقتة لنتائج استخراج المعلومات، يستخدمها /api/info ثم /api/download لنفس الرابط
+info_cache = InfoCache()
+# دمج طلبات /api/info المتزامنة لنفس الرابط في عملية استخراج واحدة
+info_flight = SingleFlight()
+
+# جلب الصورة المصغرة من المصدر بنفس إعدادات الشبكة في yt-dlp (الوكيل والترويسات)
+def fetch_thumbnail(url: str, max_bytes: int) -> bytes:
+    with ydl_pool.checkout(INFO_YDL_OPTS) as ydl:
+        response = ydl.urlopen(yt_dlp.networking.Request(url))
+        try:
+            return read_limited(response, max_bytes)
+        finally:
+            response.close()
+
+# الصور المصغرة تُجلب مرة واحدة لكل رابط وتُخدم نسخًا مصغرة عبر /api/thumbnail
+thumbnail_cache = ThumbnailCache(THUMBNAIL_CACHE_DIR, fetch_thumbnail, executor=info_executor)
+
+# رابط الصورة المصغرة عبر الخادم: رمز موقّع يحمل رابط المصدر، فلا يُجلب عبره إلا ما أعاده الاستخراج
+def thumbnail_proxy_url(thumbnail: str):
+    if not thumbnail or not thumbnail.startswith(("http://", "https://")):
+        return None
+    return f"/api/thumbnail/{encode_format_token({'i': thumbnail})}"
+
+def warm_up_ytdl_sync():
+    with STARTUP.phase("warmup"):
+        ydl_pool.prewarm(INFO_YDL_OPTS)
+        with ydl_pool.checkout(INFO_YDL_OPTS) as ydl:
+            # المستخرج العام هو المستخدم دائمًا لجلب المعلومات (force_generic_extractor)
+            ydl.get_info_extractor('Generic')
+        if download_workers is not None:
+            download_workers.prewarm()
+    STARTUP.milestone("warm")
+    STARTUP.print_report("Startup timing after warm-up")
+
+async def warm_up_ytdl():
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info_dict = ydl.extract_info(url, download=False)
-        print(f"Successfully fetched info for URL: {url}")
-
-        available_formats_by_type = {
-            "فيديو + صوت": {},
-            "فيديو فقط": {},
-            "صوت فقط": {}
+        await asyncio.get_running_loop().run_in_executor(info_executor, warm_up_ytdl_sync)
+    except Exception as e:
+        print(f"yt-dlp warm-up failed: {e}")
+
+# استخراج معلومات الفيديو الخام (مع الذاكرة المؤقتة). يعيد (info_dict, من_الذاكرة_المؤقتة)
+def extract_video_info(url: str, use_cache: bool = True) -> tuple[dict, bool]:
+    if use_cache:
+        info_dict = info_cache.get(url)
+        if info_dict is not None:
+            print(f"Info cache hit for URL: {url}")
+            EXTRACT_SECONDS.observe(0, cache="hit")
+            return info_dict, True
+
+    print(f"Attempting to fetch info for URL: {url}")
+    started = time.perf_counter()
+    with EXTRACT_SECONDS.time(cache="miss"), ydl_pool.checkout(INFO_YDL_OPTS) as ydl:
+        info_dict = ydl.sanitize_info(ydl.extract_info(url, download=False))
+    STARTUP.record("first_extract", time.perf_counter() - started, once=True)
+    STARTUP.milestone("first_extract")
+    print(f"Successfully fetched info for URL: {url}")
+    info_cache.put(url, info_dict)
+    return info_dict, False
+
+# رموز الصيغ لكل جودة: تحمل معرفات الصيغ الفعلية ليتم تنزيلها كما هي دون إعادة اختيار
+def format_tokens_for(url: str, format_index) -> dict:
+    normalized_url = normalize_url(url)
+    tokens = {}
+    for format_type, options in format_index.resolved_options().items():
+        tokens[format_type] = {
+            label: {
+                "token": encode_format_token({"u": normalized_url, "f": option["format_id"],
+                                              "t": format_type, "s": option["filesize"]}),
+                "format_id": option["format_id"],
+                "filesize": option["filesize"],
+                "tbr": option["tbr"],
+            }
+            for label, option in options.items()
         }
+    return tokens
+
+# منطق جلب معلومات الفيديو
+def get_video_info_core(url: str, use_cache: bool = True) -> dict:
+    try:
+        info_dict, cache_hit = extract_video_info(url, use_cache)
 
-        for f in info_dict.get('formats', []):
-            ext = f.get('ext')
-            vcodec = f.get('vcodec')
-            acodec = f.get('acodec')
-            height = f.get('height')
-            abr = f.get('abr')
-            format_note = f.get('format_note')
-            resolution_str = f.get('resolution')
-
-            if not ext:
-                continue
-
-            display_quality = None
-            if height:
-                display_quality = height
-            elif resolution_str and 'x' in resolution_str:
-                try:
-                    display_quality = int(resolution_str.split('x')[1])
-                except ValueError:
-                    pass
-            elif format_note and 'p' in format_note:
-                try:
-                    display_quality = int(''.join(filter(str.isdigit, format_note)))
-                except ValueError:
-                    pass
-
-            if vcodec != 'none' and display_quality:
-                if display_quality not in available_formats_by_type["فيديو + صوت"]:
-                    available_formats_by_type["فيديو + صوت"][display_quality] = []
-                if ext not in available_formats_by_type["فيديو + صوت"][display_quality]:
-                    available_formats_by_type["فيديو + صوت"][display_quality].append(ext)
-
-            if vcodec != 'none' and acodec == 'none' and display_quality:
-                if display_quality not in available_formats_by_type["فيديو فقط"]:
-                    available_formats_by_type["فيديو فقط"][display_quality] = []
-                if ext not in available_formats_by_type["فيديو فقط"][display_quality]:
-                    available_formats_by_type["فيديو فقط"][display_quality].append(ext)
-
-            if vcodec == 'none' and acodec != 'none' and abr:
-                quality_kbps = int(abr)
-                if quality_kbps not in available_formats_by_type["صوت فقط"]:
-                    available_formats_by_type["صوت فقط"][quality_kbps] = []
-                if ext not in available_formats_by_type["صوت فقط"][quality_kbps]:
-                    available_formats_by_type["صوت فقط"][quality_kbps].append(ext)
-
-        formatted_formats = {}
-        if available_formats_by_type.get("فيديو + صوت"):
-            formatted_formats["فيديو + صوت"] = sorted([f"{q}p" for q in available_formats_by_type["فيديو + صوت"].keys()], reverse=False)
-        if available_formats_by_type.get("فيديو فقط"):
-            formatted_formats["فيديو فقط"] = sorted([f"{q}p" for q in available_formats_by_type["فيديو فقط"].keys()], reverse=False)
-        if available_formats_by_type.get("صوت فقط"):
-            formatted_formats["صوت فقط"] = sorted([f"{q}k" for q in available_formats_by_type["صوت فقط"].keys()], reverse=False)
+        format_index = index_for(info_dict)
 
         return {
             "title": info_dict.get('title', 'عنوان غير متاح'),
             "thumbnail": info_dict.get('thumbnail', None),
+            "thumbnail_url": thumbnail_proxy_url(info_dict.get('thumbnail')),
             "duration": info_dict.get('duration', None),
             "duration_string": info_dict.get('duration_string', None),
-            "available_formats": formatted_formats,
-            "original_filename": info_dict.get('title', 'video')
+            "available_formats": format_index.available_formats(),
+            "estimated_sizes": format_index.estimated_sizes(),
+            "format_tokens": format_tokens_for(url, format_index),
+            "original_filename": info_dict.get('title', 'video'),
+            "cached": cache_hit
         }
     except yt_dlp.utils.DownloadError as e:
         print(f"yt-dlp DownloadError in get_video_info_core: {e}")
@@ -129,57 +278,68 @@ def get_video_info_core(url: str) -> dict:
         print(f"Unexpected error in get_video_info_core: {e}")
         raise Exception(f"حدث خطأ غير متوقع أثناء جلب المعلومات: {e}")
 
-async def download_video_core(url: str, format_string: str, download_path: str, websocket: WebSocket = None):
-    main_event_loop = asyncio.get_event_loop()
+def _download_with_info(ydl, url: str, info_dict: dict = None, resolved_info: dict = None, hooks: list = (),
+                        manifest: ArtifactManifest = None):
+    # كل تنزيل يحجز اتصالاته من الحد العام؛ وضع الإنتاجية العالية يطلب أكثر من اتصال
+    with connection_budget.reserve(_wanted_download_connections(info_dict, resolved_info, ydl.params)) as connections:
+        filename = run_download(ydl, url, info_dict, resolved_info, hooks, connections)
+    if filename and manifest is not None:
+        manifest.set_main(filename)
 
-    async def _progress_hook_async(d):
-        if websocket:
-            try:
-                if d['status'] == 'downloading':
-                    total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate')
-                    downloaded_bytes = d.get('downloaded_bytes')
-                    progress = (downloaded_bytes / total_bytes * 100) if total_bytes else 0
-                    speed = d.get('speed')
-                    eta = d.get('eta')
-
-                    if total_bytes and total_bytes >= (1024 * 1024 * 1000):
-                        total_size_display = f"{total_bytes/(1024*1024*1024):.1f} GiB"
-                    elif total_bytes:
-                        total_size_display = f"{total_bytes/(1024*1024):.1f} MiB"
-                    else:
-                        total_size_display = "N/A"
-
-                    speed_mib_s = f"{speed/(1024*1024):.1f} MiB/s" if speed else "N/A"
-
-                    await websocket.send_json({
-                        "status": "downloading",
-                        "progress": round(progress, 1),
-                        "speed": speed_mib_s,
-                        "total_size": total_size_display,
-                        "eta": eta
-                    })
-                elif d['status'] == 'finished':
-                    pass
-                elif d['status'] == 'error':
-                    await websocket.send_json({"status": "error", "message": d.get('error', "خطأ في التنزيل.")})
-            except RuntimeError as e:
-                print(f"WebSocket closed by client during progress update: {e}")
-            except Exception as e:
-                print(f"Error sending WebSocket progress: {e}")
+def _download_in_worker(url: str, overrides: dict, info_dict: dict = None, resolved_info: dict = None,
+                        hooks: list = (), manifest: ArtifactManifest = None):
+    # الاتصالات تُحجز هنا من الحد العام للخادم كله، والعملية الفرعية تستخدم العدد المحجوز فقط
+    params = {**DOWNLOAD_YDL_OPTS, **overrides}
+    with connection_budget.reserve(_wanted_download_connections(info_dict, resolved_info, params)) as connections:
+        record = download_workers.run({"url": url, "info_dict": info_dict, "resolved_info": resolved_info,
+                                       "connections": connections, "opts": DOWNLOAD_YDL_OPTS,
+                                       "overrides": overrides}, hooks)
+    if manifest is not None:
+        manifest.merge(record)
+
+# params: خيارات yt-dlp الفعلية للمهمة (تحدد إن كانت المسارات السريعة مسموحة)
+def _wanted_download_connections(info_dict: dict = None, resolved_info: dict = None, params: dict = None) -> int:
+    if resolved_info and requires_ytdlp_processing(params or {}, resolved_info):
+        # يبقى فقط التنزيل المتوازي للأجزاء داخل yt-dlp نفسه
+        return wanted_connections(resolved_info) if is_fragmented(resolved_info) else 1
+    wanted = wanted_connections(resolved_info) if resolved_info else 1
+    if info_dict is not None and resolved_info is not None and is_mux_candidate(resolved_info):
+        # الفيديو والصوت يُنزلان معًا، فيحتاجان إلى اتصالين على الأقل
+        wanted = max(wanted, 2)
+    return wanted
+
+# progress_channel: قناة تقدم (ProgressChannel) تجمع التحديثات وترسلها بمعدل محدود
+# extra_hooks: دوال progress_hooks إضافية تُستدعى مباشرة من خيط التنزيل
+# extras: ملفات إضافية تُكتب بجانب الوسائط ("subtitles" و/أو "thumbnail")
+# resolved_info: الصيغة المختارة مسبقًا، تحدد إمكانية التنزيل المتوازي
+# manifest: سجل ملفات النتيجة (ArtifactManifest) يُملأ من hooks الخاصة بـ yt-dlp
+async def download_video_core(url: str, format_string: str, download_path: str, progress_channel: ProgressChannel = None, executor=None, info_dict: dict = None, extra_hooks: list = None, extras: tuple = (), resolved_info: dict = None, manifest: ArtifactManifest = None):
+    main_event_loop = asyncio.get_running_loop()
 
     def progress_hook_sync(d):
-        asyncio.run_coroutine_threadsafe(_progress_hook_async(d), main_event_loop)
+        # يُستدعى من خيط التنزيل: نحفظ آخر حالة فقط دون جدولة رسالة لكل استدعاء
+        if progress_channel and d['status'] == 'downloading':
+            progress_channel.publish(compact_progress(d))
 
-    ydl_opts = {
+    hooks = [progress_hook_sync, *(extra_hooks or [])]
+    if manifest is not None:
+        hooks.append(manifest.progress_hook)
+    overrides = {
         'format': format_string,
         'outtmpl': os.path.join(download_path, '%(title)s.%(ext)s'),
-        'quiet': True,
-        'noplaylist': True,
-        'progress_hooks': [progress_hook_sync],
+        'writesubtitles': 'subtitles' in extras,
+        'writethumbnail': 'thumbnail' in extras,
+        'concurrent_fragment_downloads': 1,
     }
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            await asyncio.to_thread(ydl.download, [url])
+        if download_workers is not None:
+            await main_event_loop.run_in_executor(executor, _download_in_worker, url, overrides, info_dict,
+                                                  resolved_info, hooks, manifest)
+            return True
+        manifest_hooks = manifest.ydl_overrides() if manifest is not None else {}
+        with ydl_pool.checkout(DOWNLOAD_YDL_OPTS, progress_hooks=hooks, **manifest_hooks, **overrides) as ydl:
+            await main_event_loop.run_in_executor(executor, _download_with_info, ydl, url, info_dict,
+                                                  resolved_info, hooks, manifest)
         return True
     except yt_dlp.utils.DownloadError as e:
         print(f"yt-dlp DownloadError: {e}")
@@ -191,14 +351,29 @@ async def download_video_core(url: str, format_string: str, download_path: str,
 # --- نماذج Pydantic لطلبات API ---
 class InfoRequest(BaseModel):
     url: str
+    client_id: str = ""
 
 class DownloadRequest(BaseModel):
     url: str
-    format_type: str
-    quality: str
-    client_id: str
+    format_type: str = ""
+    quality: str = ""
+    # رمز صيغة من /api/info: يحدد معرفات الصيغ بدقة بدلاً من النوع والجودة
+    format_token: str = ""
+    client_id: str = ""
     use_custom_folder: bool = False
     file_name: str = "video"
+    # تنزيل الترجمات و/أو الصورة المصغرة مع الفيديو (تُعاد النتيجة كأرشيف)
+    subtitles: bool = False
+    thumbnail: bool = False
+
+class BatchRequest(BaseModel):
+    # رابط قائمة تشغيل أو قائمة روابط منفصلة (أو كلاهما)
+    url: str = ""
+    urls: list[str] = []
+    format_type: str
+    quality: str
+    client_id: str = ""
+    parallelism: int | None = None
 
 class ChatRequest(BaseModel):
     message: str
@@ -208,30 +383,98 @@ class ChatRequest(BaseModel):
 
 @app.get("/", response_class=HTMLResponse, summary="عرض صفحة تنزيل الفيديو")
 async def read_root(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+    return get_templates().TemplateResponse("index.html", {"request": request})
 
-@app.websocket("/ws/progress/{client_id}")
-async def websocket_endpoint(websocket: WebSocket, client_id: str):
+# متابعة تقدم مهمة عبر WebSocket. يمكن الاتصال في أي وقت (حتى بعد انقطاع)
+# لأن آخر حالة معروفة تُرسل أولاً عند الاشتراك.
+@app.websocket("/ws/jobs/{job_id}")
+async def job_websocket_endpoint(websocket: WebSocket, job_id: str):
     await websocket.accept()
-    active_websockets[client_id] = websocket
-    print(f"WebSocket connected for client: {client_id}")
-    try:
+    print(f"WebSocket subscribed to job: {job_id}")
+    PROGRESS_SUBSCRIBERS.inc(transport="websocket")
+
+    async def forward_progress():
+        async for message in progress_broker.subscribe(job_id):
+            await websocket.send_json(message)
+
+    async def wait_for_disconnect():
         while True:
             await websocket.receive_text()
+
+    forward_task = asyncio.create_task(forward_progress())
+    disconnect_task = asyncio.create_task(wait_for_disconnect())
+    try:
+        done, _ = await asyncio.wait({forward_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+        if forward_task in done:
+            forward_task.result()
+            await websocket.close()
     except WebSocketDisconnect:
-        print(f"WebSocket disconnected for client: {client_id}")
+        print(f"WebSocket disconnected from job: {job_id}")
     except Exception as e:
-        print(f"WebSocket error for client {client_id}: {e}")
+        print(f"WebSocket error for job {job_id}: {e}")
     finally:
-        if client_id in active_websockets:
-            del active_websockets[client_id]
+        for task in (forward_task, disconnect_task):
+            task.cancel()
+        await asyncio.gather(forward_task, disconnect_task, return_exceptions=True)
+        PROGRESS_SUBSCRIBERS.dec(transport="websocket")
+
+# متابعة تقدم مهمة عبر Server-Sent Events (بديل لـ WebSocket يعمل عبر HTTP عادي)
+@app.get("/api/jobs/{job_id}/events", summary="بث تقدم المهمة (SSE)")
+async def job_events_endpoint(job_id: str):
+    async def event_stream():
+        PROGRESS_SUBSCRIBERS.inc(transport="sse")
+        try:
+            async for message in progress_broker.subscribe(job_id):
+                yield f"data: {json.dumps(message, ensure_ascii=False)}\n\n"
+        finally:
+            PROGRESS_SUBSCRIBERS.dec(transport="sse")
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def wants_fresh_info(http_request: Request) -> bool:
+    # يمكن للعميل تجاوز الذاكرة المؤقتة بإرسال Cache-Control: no-cache أو no-store
+    cache_control = http_request.headers.get("cache-control", "").lower()
+    return "no-cache" in cache_control or "no-store" in cache_control
+
+def rate_limited_response(e: RateLimitedError) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+
+# تطبيق حد المعدل على العميل (عنوان IP، و client_id إن أُرسل). يعيد صاحب الطلب لجدولة التقاسم العادل.
+# خلف وكيل عكسي يجب أن يثق uvicorn بترويسة X-Forwarded-For منه (--proxy-headers و FORWARDED_ALLOW_IPS)،
+# وإلا يصبح عنوان الوكيل هو عنوان كل المستخدمين، فيتحول الحد إلى حد عام ويفقد التقاسم العادل معناه
+def limit_client(http_request: Request, client_id: str = "") -> str:
+    owner = f"ip:{http_request.client.host if http_request.client else 'unknown'}"
+    try:
+        # الدلوان يُفحصان معًا: طلب يرفضه حد client_id لا يستهلك رصيد عنوان IP المشترك
+        client_limiter.hit(owner, *([f"client:{client_id}"] if client_id else []))
+    except RateLimitedError as e:
+        raise rate_limited_response(e)
+    return owner
+
+# انتظار دور الموقع المصدر قبل استخراج جديد (الاستخراج من الذاكرة المؤقتة لا يُحتسب)
+async def throttle_upstream(url: str, max_wait: float = HOST_MAX_WAIT, use_cache: bool = True):
+    if not use_cache or info_cache.get(url, count=False) is None:
+        await host_limiter.wait(url_host(url), max_wait)
 
 # نقطة نهاية جلب المعلومات
 @app.post("/api/info", summary="جلب معلومات الفيديو المتاحة")
-async def get_info_endpoint(request: InfoRequest):
+async def get_info_endpoint(request: InfoRequest, http_request: Request, response: Response):
+    limit_client(http_request, request.client_id)
     try:
-        info = await asyncio.to_thread(get_video_info_core, request.url)
+        use_cache = not wants_fresh_info(http_request)
+
+        async def fetch_info():
+            await throttle_upstream(request.url, use_cache=use_cache)
+            return await asyncio.get_running_loop().run_in_executor(
+                info_executor, get_video_info_core, request.url, use_cache)
+
+        # طلب تحديث (no-cache) لا ينضم إلى استخراج جارٍ قد يعيد نتيجة من الذاكرة المؤقتة، والعكس
+        info = await info_flight.do((normalize_url(request.url), use_cache), fetch_info)
+        response.headers["X-Info-Cache"] = "HIT" if info["cached"] else "MISS"
         return info
+    except RateLimitedError as e:
+        raise rate_limited_response(e)
     except ValueError as e:
         print(f"Error in API info endpoint (ValueError): {e}")
         raise HTTPException(status_code=400, detail=str(e))
@@ -239,147 +482,630 @@ async def get_info_endpoint(request: InfoRequest):
         print(f"Error in API info endpoint (Unexpected Exception): {e}")
         raise HTTPException(status_code=500, detail=f"خطأ داخلي في الخادم: {e}")
 
-# نقطة نهاية تنزيل الفيديو
-@app.post("/api/download", summary="بدء تنزيل الفيديو")
-async def start_download_endpoint(request: DownloadRequest):
-    final_download_dir = ""
-    temp_download_path = "" # هذا يمثل المجلد الفريد الذي تم إنشاؤه لهذا التنزيل
-
-    if request.use_custom_folder:
-        if platform.system() == "Windows":
-            downloads_folder = os.path.join(os.path.expanduser("~"), "Downloads")
-        elif platform.system() == "Darwin": # macOS
-            downloads_folder = os.path.join(os.path.expanduser("~"), "Downloads")
-        else: # For Linux and other OS
-            downloads_folder = os.path.join(os.path.expanduser("~"), "Downloads")
-
-        final_download_dir = os.path.join(downloads_folder, APP_DOWNLOAD_FOLDER_NAME)
-        os.makedirs(final_download_dir, exist_ok=True)
-        print(f"Custom download folder path: {final_download_dir}")
-        temp_download_path = final_download_dir # هنا يكون المجلد المخصص هو نفسه المسار النهائي
-    else:
-        unique_download_id = str(uuid.uuid4())
-        temp_download_path = os.path.join(PROJECT_DOWNLOAD_DIR, unique_download_id)
-        os.makedirs(temp_download_path, exist_ok=True)
-        final_download_dir = temp_download_path
-        print(f"Temporary download folder path: {final_download_dir}")
+@app.get("/api/info/cache", summary="إحصائيات الذاكرة المؤقتة لمعلومات الفيديو")
+async def get_info_cache_stats():
+    return {**info_cache.stats(), "in_flight": info_flight.stats(), "coalesced_downloads": job_manager.coalesced}
+
+@app.get("/api/artifacts/cache", summary="إحصائيات الذاكرة المؤقتة للملفات المنزلة")
+async def get_artifact_cache_stats():
+    return artifact_cache.stats()
+
+@app.get("/api/thumbnails/cache", summary="إحصائيات الذاكرة المؤقتة للصور المصغرة")
+async def get_thumbnail_cache_stats():
+    return thumbnail_cache.stats()
+
+@app.get("/api/ydl/pool", summary="إحصائيات مجمع كائنات yt-dlp")
+async def get_ydl_pool_stats():
+    return ydl_pool.stats()
+
+@app.get("/api/connections", summary="الاتصالات المستخدمة من الحد العام للتنزيل")
+async def get_connection_stats():
+    return connection_budget.stats()
+
+@app.get("/api/disk", summary="استخدام مساحة القرص والحجوزات الحالية")
+async def get_disk_stats():
+    return disk_quota.stats()
+
+@app.get("/api/limits", summary="إحصائيات حدود معدل الطلبات")
+async def get_rate_limit_stats():
+    return {"clients": client_limiter.stats(), "hosts": host_limiter.stats()}
+
+@app.get("/api/workers", summary="إحصائيات عمليات التنزيل الفرعية")
+async def get_worker_stats():
+    if download_workers is None:
+        return {"backend": "thread"}
+    return {"backend": "process", **await asyncio.to_thread(download_workers.stats)}
+
+@app.get("/api/startup", summary="زمن بدء التشغيل لكل مرحلة")
+async def get_startup_stats():
+    return {**STARTUP.report(), "ytdl_loaded": yt_dlp.loaded, "warmup_enabled": YTDL_WARMUP}
+
+# مقاييس محسوبة من الإحصائيات الموجودة عند كل قراءة لـ /metrics
+Counter("cache_hits_total", "Cache hits by cache.", ("cache",), collect=lambda: [
+    ({"cache": "info"}, info_cache.hits), ({"cache": "artifact"}, artifact_cache.hits),
+    ({"cache": "ydl_pool"}, ydl_pool.reused), ({"cache": "thumbnail"}, thumbnail_cache.hits)])
+Counter("cache_misses_total", "Cache misses by cache.", ("cache",), collect=lambda: [
+    ({"cache": "info"}, info_cache.misses), ({"cache": "artifact"}, artifact_cache.misses),
+    ({"cache": "ydl_pool"}, ydl_pool.checkouts - ydl_pool.reused), ({"cache": "thumbnail"}, thumbnail_cache.misses)])
+Gauge("cache_hit_ratio", "Cache hit ratio by cache.", ("cache",), collect=lambda: [
+    ({"cache": "info"}, info_cache.stats()["hit_ratio"]), ({"cache": "artifact"}, artifact_cache.stats()["hit_ratio"]),
+    ({"cache": "ydl_pool"}, ydl_pool.stats()["reuse_ratio"]),
+    ({"cache": "thumbnail"}, thumbnail_cache.stats()["hit_ratio"])])
+Gauge("jobs", "Known download jobs by status.", ("status",), collect=lambda: [
+    ({"status": status}, sum(1 for job in list(job_manager.jobs.values()) if job.status == status))
+    for status in (JOB_QUEUED, JOB_RUNNING, JOB_FINISHED, JOB_ERROR)])
+Gauge("download_connections_in_use", "Connections reserved from the global download budget.",
+      collect=lambda: [({}, connection_budget.stats()["in_use"])])
+Gauge("download_worker_processes", "Download worker processes by state.", ("state",), collect=lambda: [
+    ({"state": "busy"}, download_workers.busy), ({"state": "idle"}, download_workers.idle_count),
+] if download_workers is not None else [])
+Counter("download_worker_exits_total", "Download worker processes stopped, by reason.", ("reason",), collect=lambda: [
+    ({"reason": reason}, getattr(download_workers, reason)) for reason in ("recycled", "killed", "crashed")
+] if download_workers is not None else [])
+Gauge("startup_phase_seconds", "Duration of each startup phase.", ("phase",), collect=lambda: [
+    ({"phase": phase}, seconds) for phase, seconds in STARTUP.report()["phases"].items()])
+Gauge("disk_bytes", "Download directory usage.", ("kind",), collect=lambda: [
+    ({"kind": kind}, value) for kind, value in disk_quota.stats().items()
+    if kind in ("used", "outstanding", "free", "available")])
+
+@app.get("/metrics", summary="مقاييس Prometheus", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
-    format_string = ""
-    quality_value = None
+def get_custom_download_dir() -> str:
+    if platform.system() == "Windows":
+        downloads_folder = os.path.join(os.path.expanduser("~"), "Downloads")
+    elif platform.system() == "Darwin": # macOS
+        downloads_folder = os.path.join(os.path.expanduser("~"), "Downloads")
+    else: # For Linux and other OS
+        downloads_folder = os.path.join(os.path.expanduser("~"), "Downloads")
+    return os.path.join(downloads_folder, APP_DOWNLOAD_FOLDER_NAME)
 
-    websocket_connection = active_websockets.get(request.client_id)
-    if not websocket_connection:
-        print(f"Error: WebSocket connection not found for client_id: {request.client_id}")
-        raise HTTPException(status_code=400, detail="WebSocket connection not found for this client_id.")
+# فهرس الصيغ إن كانت معلومات الرابط محفوظة (عادةً بعد /api/info)، دون أي استخراج جديد
+def cached_format_index(url: str):
+    info_dict = info_cache.get(url, count=False)
+    return index_for(info_dict) if info_dict is not None else None
 
+# نشر رسالة لجميع المشتركين في المهمة
+async def send_job_message(job: Job, message: dict):
     try:
-        if request.quality:
+        await progress_broker.publish(job.job_id, {"job_id": job.job_id, **message})
+    except Exception as e:
+        print(f"Error publishing progress for job {job.job_id}: {e}")
+
+# تحديد الصيغة الفعلية (format_id) التي ستختارها yt-dlp دون تنزيل أي شيء
+def resolve_format(info_dict: dict, format_string: str) -> dict:
+    with ydl_pool.checkout(RESOLVE_YDL_OPTS, format=format_string) as ydl:
+        return ydl.process_ie_result(copy.deepcopy(info_dict), download=False)
+
+def get_artifact_key(info_dict: dict, resolved_info: dict, url: str):
+    format_id = resolved_info.get('format_id')
+    extractor = info_dict.get('extractor_key')
+    video_id = info_dict.get('id')
+    if not (format_id and extractor and video_id):
+        return None
+    if extractor == 'Generic':
+        # معرف المستخرج العام مشتق من اسم الملف فقط، لذا نستخدم الرابط نفسه
+        video_id = normalize_url(info_dict.get('webpage_url') or url)
+    return artifact_key(extractor, video_id, format_id)
+
+# جميع الملفات المكتملة في مجلد التنزيل (احتياطي لمجلدات المهام الخاصة فقط)، مرتبة بحيث يكون ملف الوسائط (الأكبر) أولاً
+def find_downloaded_files(download_path: str) -> list[str]:
+    downloaded_files = os.listdir(download_path)
+    actual_downloaded_files = [
+        f for f in downloaded_files
+        if not f.endswith(('.part', '.ytdl')) and os.path.isfile(os.path.join(download_path, f))
+    ]
+    return sorted(actual_downloaded_files, key=lambda f: os.path.getsize(os.path.join(download_path, f)), reverse=True)
+
+# الحجم المعروف للصيغة المختارة (مجموع التيارين عند دمج فيديو وصوت)، أو None
+def resolved_filesize(resolved_info: dict):
+    formats = resolved_info.get('requested_formats') or [resolved_info]
+    sizes = [f.get('filesize') or f.get('filesize_approx') for f in formats]
+    return int(sum(sizes)) if all(sizes) else None
+
+# رابط التنزيل الثابت: أرشيف إذا كانت النتيجة عدة ملفات، أو رابط الملف في الذاكرة المؤقتة إن وُجد،
+# وإلا رابط ملف المهمة
+def job_download_url(job: Job) -> str:
+    if len(job.files) > 1:
+        return f"/api/jobs/{job.job_id}/archive"
+    if job.artifact_key:
+        return f"/api/artifacts/{job.artifact_key}/{quote(job.result_name or 'download')}"
+    return f"/api/jobs/{job.job_id}/file"
+
+# منطق تنفيذ مهمة تنزيل واحدة (يستدعيه عمال الطابور)
+async def run_download_job(job: Job):
+    loop = asyncio.get_running_loop()
+    executor = job_manager.executor
+
+    alias = request_alias(normalize_url(job.url), job.format_string)
+    record_stage(job, "queue", job.started_at - job.created_at)
+
+    try:
+        # طلب مطابق سابق: نخدم الملف من الذاكرة المؤقتة دون أي استدعاء لـ yt-dlp.
+        # الذاكرة المؤقتة تحفظ ملف الوسائط وحده، لذا لا تُستخدم عند طلب ملفات إضافية
+        cached_entry = await asyncio.to_thread(artifact_cache.lookup, alias=alias) if not job.extras else None
+        cache_key = None
+        if not cached_entry:
             try:
-                quality_value = int(''.join(filter(str.isdigit, request.quality)))
-            except ValueError:
-                pass
+                with job_stage(job, "extract"):
+                    # المهمة في الطابور بالفعل، فتنتظر دور الموقع مهما طال بدلاً من الفشل
+                    await throttle_upstream(job.url, max_wait=math.inf)
+                    info_dict, _ = await loop.run_in_executor(executor, extract_video_info, job.url)
+                with job_stage(job, "select"):
+                    # الصيغ المحددة برمز من /api/info لا تحتاج إلى محدد الصيغ في yt-dlp، والمهمة المستعادة
+                    # تستخدم نفس الصيغة التي بدأت بها ليتطابق اسم الملف الجزئي الذي سيُستأنف
+                    resolved_info = None
+                    if job.resumed and job.format_id:
+                        resolved_info = formats_by_ids(info_dict, job.format_id)
+                    elif job.exact_format:
+                        resolved_info = formats_by_ids(info_dict, job.format_string)
+                    if resolved_info is None:
+                        resolved_info = await loop.run_in_executor(executor, resolve_format, info_dict,
+                                                                   job.format_string)
+            except yt_dlp.utils.YoutubeDLError as e:
+                print(f"yt-dlp error while preparing job {job.job_id}: {e}")
+                raise ValueError(f"خطأ في التنزيل: {e}. تأكد من صحة الرابط.")
+            cache_key = get_artifact_key(info_dict, resolved_info, job.url) if not job.extras else None
+            format_id = resolved_info.get('format_id') or job.format_string
+            job.format_id = format_id
+            # الحجم الفعلي للصيغة المختارة يحل محل التقدير الذي حُجزت به المساحة
+            resolved_size = resolved_filesize(resolved_info)
+            if resolved_size:
+                job.expected_size = resolved_size
+                disk_quota.update(job.job_id, disk_quota.reservation_for_job(job))
+            cached_entry = await asyncio.to_thread(artifact_cache.lookup, cache_key, alias=alias) if cache_key else None
 
-        if request.format_type == "فيديو + صوت":
-            if quality_value:
-                format_string = f"bestvideo[height<={quality_value}]+bestaudio/best"
-            else:
-                format_string = "bestvideo+bestaudio/best"
-        elif request.format_type == "فيديو فقط":
-            if quality_value:
-                format_string = f"bestvideo[height<={quality_value}]"
-            else:
-                format_string = "bestvideo"
-        elif request.format_type == "صوت فقط":
-            if quality_value:
-                format_string = f"bestaudio[abr<={quality_value}]"
-            else:
-                format_string = "bestaudio"
+        if cached_entry:
+            # الملف موجود مسبقًا في الذاكرة المؤقتة: لا حاجة لتشغيل yt-dlp
+            print(f"Artifact cache hit for job {job.job_id}: {cached_entry['name']}")
+            cached_path = artifact_cache.path_for(cached_entry)
+            with job_stage(job, "serve"):
+                if job.use_custom_folder:
+                    job.download_path = get_custom_download_dir()
+                    job.file_path = os.path.join(job.download_path, cached_entry['name'])
+                    await asyncio.to_thread(os.makedirs, job.download_path, exist_ok=True)
+                    await asyncio.to_thread(shutil.copyfile, cached_path, job.file_path)
+                else:
+                    job.file_path = cached_path
+                    job.artifact_key = cache_key or artifact_cache.key_for(cached_entry)
+            job.result_name = cached_entry['name']
+            job.files = [(job.result_name, job.file_path)]
+            JOBS_TOTAL.inc(status="cached")
+            await send_job_message(job, {"status": "finished", "progress": 100, "file_name": job.result_name,
+                                         "download_url": job_download_url(job), "cached": True,
+                                         "timings": job.timings})
+            return
+
+        if job.use_custom_folder:
+            # هنا يكون المجلد المخصص هو نفسه المسار النهائي
+            job.download_path = get_custom_download_dir()
+            print(f"Custom download folder path: {job.download_path}")
         else:
-            raise HTTPException(status_code=400, detail="نوع صيغة غير صالح.")
+            # مجلد فريد لكل مهمة داخل مجلد التنزيلات المؤقت
+            job.download_path = os.path.join(PROJECT_DOWNLOAD_DIR, job.job_id)
+            print(f"Temporary download folder path: {job.download_path}")
+        await asyncio.to_thread(os.makedirs, job.download_path, exist_ok=True)
 
-        await download_video_core(request.url, format_string, final_download_dir, websocket_connection)
+        def record_partial_file(d):
+            # تسجيل مسار الملف الجزئي ليتمكن /stream من قراءته أثناء التنزيل، وحفظه في مخزن المهام
+            if d['status'] == 'downloading' and not job.partial_path:
+                job.partial_path = d.get('tmpfilename') or d.get('filename')
+                job.result_name = os.path.basename(d.get('filename') or job.partial_path)
+                asyncio.run_coroutine_threadsafe(job_manager.persist(job), loop)
 
-        downloaded_files = os.listdir(final_download_dir)
-        
-        actual_downloaded_files = [
-            f for f in downloaded_files
-            if not f.endswith(('.part', '.ytdl')) and os.path.isfile(os.path.join(final_download_dir, f))
-        ]
-
-        if actual_downloaded_files:
-            file_name = actual_downloaded_files[0]
-            file_path = os.path.join(final_download_dir, file_name)
-
-            if request.use_custom_folder:
-                # إذا كان المجلد المخصص قيد الاستخدام، فلا يتم إرسال الملف مباشرة
-                # يتم إرسال إشعار الانتهاء عبر WebSocket
-                if websocket_connection:
-                    await websocket_connection.send_json({"status": "finished", "progress": 100, "file_name": file_name})
-                return {"message": f"تم تنزيل الفيديو بنجاح إلى مجلد '{APP_DOWNLOAD_FOLDER_NAME}' في تنزيلات جهازك."}
+        # ملفات النتيجة كما أبلغ عنها yt-dlp: لا حاجة للبحث في المجلد (قد يكون مشتركًا مع مهام أخرى)
+        manifest = ArtifactManifest()
+
+        # التنزيل بنطاقات متوازية يكتب الملف بترتيب غير متسلسل، فلا يمكن بثه أثناء التنزيل
+        job.streamable = (not job.use_custom_folder and is_streamable(resolved_info)
+                          and not is_ranged_candidate(resolved_info))
+        await job_manager.persist(job)
+        await send_job_message(job, {"status": "started", "streamable": job.streamable})
+        progress_channel = ProgressChannel(lambda message: send_job_message(job, message))
+        download_started = time.perf_counter()
+        try:
+            await download_video_core(job.url, format_id, job.download_path, progress_channel,
+                                      executor=executor, info_dict=info_dict,
+                                      extra_hooks=[record_partial_file], extras=job.extras,
+                                      resolved_info=resolved_info, manifest=manifest)
+        finally:
+            # إرسال آخر حالة تقدم معلقة قبل رسالة الانتهاء أو الخطأ
+            await progress_channel.close()
+        # نهاية آخر تيار منزل؛ ما بعدها حتى عودة yt-dlp هو الدمج والمعالجة اللاحقة
+        download_finished = manifest.download_finished_at or time.perf_counter()
+        download_seconds = download_finished - download_started
+        record_stage(job, "download", download_seconds)
+        merge_seconds = time.perf_counter() - download_finished
+        record_stage(job, "postprocess", merge_seconds)
+        if resolved_info.get('requested_formats'):
+            MERGE_SECONDS.observe(merge_seconds)
+        downloaded_bytes = manifest.downloaded_bytes
+        if downloaded_bytes:
+            DOWNLOADED_BYTES.inc(downloaded_bytes)
+            if download_seconds > 0:
+                DOWNLOAD_THROUGHPUT.observe(downloaded_bytes / download_seconds)
+
+        with job_stage(job, "serve"):
+            files = await asyncio.to_thread(manifest.finalize)
+            if not files and not job.use_custom_folder:
+                # لم يُبلغ yt-dlp بالمسار (مستخرج لا يمر بالمعالجات اللاحقة): مجلد المهمة خاص بها
+                # فالبحث فيه آمن، بخلاف المجلد المخصص المشترك
+                files = await asyncio.to_thread(
+                    lambda: [(name, os.path.join(job.download_path, name), os.path.getsize(os.path.join(job.download_path, name)))
+                             for name in find_downloaded_files(job.download_path)]
+                )
+            if not files:
+                raise Exception("اكتمل التنزيل ولكن لم يتم العثور على ملف نهائي في المجلد.")
+            file_name, file_path, _ = files[0]
+            job.manifest = manifest.summary(files)
+
+            if not job.use_custom_folder and cache_key:
+                # نشر الملف في الذاكرة المؤقتة الدائمة ثم حذف المجلد المؤقت الفارغ
+                entry = await asyncio.to_thread(
+                    artifact_cache.publish, cache_key, file_path, file_name,
+                    {"url": job.url, "format_id": format_id}, alias
+                )
+                job.file_path = artifact_cache.path_for(entry)
+                job.artifact_key = cache_key
+                await asyncio.to_thread(shutil.rmtree, job.download_path, True)
             else:
-                # إذا لم يتم استخدام مجلد مخصص، يتم إرسال الملف مباشرة للمتصفح
-                # أرسل إشعار الانتهاء عبر WebSocket هنا قبل إرجاع FileResponse
-                if websocket_connection:
-                    await websocket_connection.send_json({"status": "finished", "progress": 100, "file_name": file_name})
-                
-                response = FileResponse(path=file_path, filename=file_name, media_type="application/octet-stream")
-                return response
+                job.file_path = file_path
+        job.result_name = file_name
+        job.files = [(job.result_name, job.file_path)] + [(name, path) for name, path, _ in files[1:]]
+        JOBS_TOTAL.inc(status="finished")
+        await send_job_message(job, {"status": "finished", "progress": 100, "file_name": file_name,
+                                     "files": [name for name, _ in job.files],
+                                     "download_url": job_download_url(job), "timings": job.timings,
+                                     "manifest": job.manifest})
+    except ValueError as e:
+        JOBS_TOTAL.inc(status="error")
+        await send_job_message(job, {"status": "error", "message": str(e)})
+        raise
+    except Exception as e:
+        JOBS_TOTAL.inc(status="error")
+        await send_job_message(job, {"status": "error", "message": f"حدث خطأ غير متوقع: {e}"})
+        raise
+
+async def remove_job_files(job: Job):
+    # حذف المجلد الفريد للمهمة بعد انتهاء مدة الاحتفاظ (لا يتم حذف المجلد المخصص أبدًا).
+    # الملفات المنشورة في الذاكرة المؤقتة تبقى هناك وتخضع لسياسة الإزالة الخاصة بها.
+    if job.use_custom_folder or not job.download_path:
+        return
+    if await asyncio.to_thread(os.path.isdir, job.download_path):
+        await asyncio.to_thread(shutil.rmtree, job.download_path, True)
+        print(f"Cleaned up temporary folder: {job.download_path}")
+
+async def expire_job(job: Job):
+    await remove_job_files(job)
+    await progress_broker.forget(job.job_id)
+
+async def expire_batch(batch: Batch):
+    await progress_broker.forget(batch.batch_id)
+
+# حالة المهام محفوظة في SQLite لاستئنافها بعد إعادة تشغيل الخادم
+job_store = JobStore()
+# حجز مساحة القرص لكل مهمة قبل بدئها، مقابل حد مجلد التنزيلات والمساحة الحرة
+disk_quota = DiskQuota(PROJECT_DOWNLOAD_DIR)
+job_manager = JobManager(run_download_job, on_expire=expire_job, on_batch_expire=expire_batch,
+                         store=job_store, admission=disk_quota)
+
+# تنظيف دوري لمجلدات التنزيل التي لا تخص أي مهمة (بقايا توقف الخادم قبل انتهاء المهمة)
+async def run_janitor():
+    while True:
+        keep = set(job_manager.jobs)
+        # مجلدات الذاكرة المؤقتة الدائمة داخل مجلد التنزيلات ليست مجلدات مهام يتيمة
+        for directory in (ARTIFACT_CACHE_DIR, THUMBNAIL_CACHE_DIR):
+            cache_dir = os.path.relpath(directory, PROJECT_DOWNLOAD_DIR)
+            if os.sep not in cache_dir and not cache_dir.startswith(".."):
+                keep.add(cache_dir)
+        try:
+            await asyncio.to_thread(sweep_orphans, PROJECT_DOWNLOAD_DIR, keep)
+        except Exception as e:
+            print(f"Janitor error: {e}")
+        await asyncio.sleep(JANITOR_INTERVAL)
+
+# نقطة نهاية تنزيل الفيديو: تضيف المهمة إلى الطابور وتعيد معرفها فورًا
+@app.post("/api/download", summary="بدء تنزيل الفيديو")
+async def start_download_endpoint(request: DownloadRequest, http_request: Request):
+    owner = limit_client(http_request, request.client_id)
+    try:
+        if request.format_token:
+            token = decode_format_token(request.format_token)
+            if token.get("u") != normalize_url(request.url):
+                raise InvalidFormatToken("رمز الصيغة لا يخص هذا الرابط.")
+            format_string, expected_size = token["f"], token.get("s")
         else:
-            if websocket_connection:
-                await websocket_connection.send_json({"status": "error", "message": "اكتمل التنزيل ولكن لم يتم العثور على ملف نهائي في المجلد."})
-            raise HTTPException(status_code=500, detail="اكتمل التنزيل ولكن لم يتم العثور على ملف نهائي في المجلد.")
+            format_index = cached_format_index(request.url)
+            format_string = build_format_string(request.format_type, request.quality, format_index)
+            # الحجم التقديري من معلومات الرابط المحفوظة (إن وُجدت) لحجز مساحة القرص
+            expected_size = (format_index.estimated_size(request.format_type, parse_quality(request.quality))
+                             if format_index is not None else None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
+    extras = [name for name, wanted in (("subtitles", request.subtitles), ("thumbnail", request.thumbnail)) if wanted]
+    job = Job(request.url, format_string, request.client_id,
+              use_custom_folder=request.use_custom_folder, file_name=request.file_name, extras=extras)
+    job.exact_format = bool(request.format_token)
+    job.owner = owner
+    job.expected_size = expected_size
+    try:
+        # قد تعيد مهمة قائمة مطابقة إذا كان نفس التنزيل قيد التنفيذ لعميل آخر
+        submitted_job = await job_manager.submit(job)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except InsufficientStorageError as e:
+        raise HTTPException(status_code=507, detail=str(e))
+    except StorageBusyError as e:
+        raise HTTPException(status_code=429, detail=str(e),
+                            headers={"Retry-After": str(int(disk_quota.refresh_interval))})
+    if submitted_job is job and job.status == JOB_QUEUED:
+        await send_job_message(job, {"status": JOB_QUEUED})
+    job = submitted_job
+
+    return {"job_id": job.job_id, "status": job.status}
+
+@app.get("/api/jobs/{job_id}", summary="حالة مهمة التنزيل")
+async def get_job_endpoint(job_id: str):
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="المهمة غير موجودة أو انتهت صلاحيتها.")
+    result = job.to_dict()
+    result["queue_position"] = job_manager.queue_position(job)
+    result["download_url"] = job_download_url(job) if job.file_path else None
+    return result
+
+@app.api_route("/api/jobs/{job_id}/file", methods=["GET", "HEAD"], summary="تنزيل الملف الناتج عن المهمة")
+async def get_job_file_endpoint(job_id: str, request: Request):
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="المهمة غير موجودة أو انتهت صلاحيتها.")
+    # file_path لا يُعيَّن إلا بعد نجاح التنزيل
+    if not job.file_path:
+        raise HTTPException(status_code=409, detail="لم يكتمل التنزيل بعد.")
+    if not await asyncio.to_thread(os.path.isfile, job.file_path):
+        raise HTTPException(status_code=410, detail="لم يعد الملف متاحًا على الخادم.")
+    file_name = job.result_name or os.path.basename(job.file_path)
+    return await file_response(request, job.file_path, file_name)
+
+# أرشيف ZIP (بدون ضغط) أو TAR يُبث مباشرة من الملفات دون إنشاء ملف مؤقت على القرص
+async def archive_response(files: list[tuple[str, str]], base_name: str, archive_format: str) -> StreamingResponse:
+    if archive_format not in ARCHIVE_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="صيغة الأرشيف غير مدعومة. استخدم zip أو tar.")
+    headers = {"Content-Disposition": content_disposition(f"{base_name}.{archive_format}")}
+    if archive_format == "tar":
+        # الملفات تُفتح قبل الرد، فحجم TAR يُحسب من نفس الملفات التي تُبث ويظهر للمتصفح شريط تقدم دقيق
+        entries = await asyncio.to_thread(open_tar_entries, files)
+        if not entries:
+            raise HTTPException(status_code=410, detail="لم تعد الملفات متاحة على الخادم.")
+        headers["Content-Length"] = str(tar_size(entries))
+        body = iter_tar(entries)
+    else:
+        files = await asyncio.to_thread(lambda: [(name, path) for name, path in files if os.path.isfile(path)])
+        if not files:
+            raise HTTPException(status_code=410, detail="لم تعد الملفات متاحة على الخادم.")
+        body = iter_zip(files)
+    return StreamingResponse(body, media_type=ARCHIVE_MEDIA_TYPES[archive_format], headers=headers)
+
+@app.get("/api/jobs/{job_id}/archive", summary="تنزيل جميع ملفات المهمة كأرشيف")
+async def get_job_archive_endpoint(job_id: str, format: str = "zip"):
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="المهمة غير موجودة أو انتهت صلاحيتها.")
+    if not job.files:
+        raise HTTPException(status_code=409, detail="لم يكتمل التنزيل بعد.")
+    base_name = os.path.splitext(job.result_name or "download")[0]
+    return await archive_response(job.files, base_name, format)
+
+# رابط ثابت لكل ملف في الذاكرة المؤقتة يدعم Range و ETag، ويبقى صالحًا بعد انتهاء المهمة
+@app.api_route("/api/artifacts/{key}/{file_name}", methods=["GET", "HEAD"], summary="تنزيل ملف من الذاكرة المؤقتة")
+async def get_artifact_endpoint(key: str, file_name: str, request: Request):
+    entry = await asyncio.to_thread(artifact_cache.lookup, key)
+    if not entry:
+        raise HTTPException(status_code=404, detail="الملف غير موجود في الذاكرة المؤقتة.")
+    try:
+        return await file_response(request, artifact_cache.path_for(entry), entry['name'],
+                                   cache_control=ARTIFACT_CACHE_CONTROL)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="الملف غير موجود في الذاكرة المؤقتة.")
+
+# الصورة المصغرة للفيديو بحجم مصغر (WebP أو JPEG حسب Accept أو المعامل format)، مع ETag
+@app.api_route("/api/thumbnail/{token}", methods=["GET", "HEAD"], summary="الصورة المصغرة للفيديو بحجم مصغر")
+async def get_thumbnail_endpoint(token: str, request: Request, w: int = None, format: str = ""):
+    try:
+        source_url = decode_format_token(token).get("i")
+    except InvalidFormatToken:
+        source_url = None
+    if not source_url:
+        raise HTTPException(status_code=400, detail="رابط الصورة المصغرة غير صالح.")
+    if format and format not in THUMBNAIL_FORMATS:
+        raise HTTPException(status_code=400, detail="صيغة الصورة غير مدعومة. الصيغ المتاحة: webp و jpeg.")
+    image_format = format or ("webp" if "image/webp" in request.headers.get("accept", "") else "jpeg")
+    try:
+        thumbnail = await thumbnail_cache.get(source_url, w, image_format)
+    except ThumbnailError as e:
+        print(f"Thumbnail error for {source_url}: {e}")
+        raise HTTPException(status_code=502, detail="تعذر جلب الصورة المصغرة من المصدر.")
+
+    headers = {"ETag": thumbnail.etag, "Cache-Control": THUMBNAIL_CACHE_CONTROL}
+    if not format:
+        headers["Vary"] = "Accept"
+    if_none_match = request.headers.get("if-none-match", "")
+    if thumbnail.etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    body = b"" if request.method == "HEAD" else thumbnail.data
+    headers["Content-Length"] = str(len(thumbnail.data))
+    return Response(body, media_type=thumbnail.media_type, headers=headers)
+
+# بث الملف للمتصفح أثناء تنزيله بواسطة yt-dlp (للصيغ ذات التيار الواحد فقط)
+@app.get("/api/jobs/{job_id}/stream", summary="بث الملف أثناء التنزيل")
+async def stream_job_file_endpoint(job_id: str, request: Request):
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="المهمة غير موجودة أو انتهت صلاحيتها.")
+    if job.file_path:
+        # اكتمل التنزيل مسبقًا: نعيد الملف النهائي مباشرة
+        return await get_job_file_endpoint(job_id, request)
+    if job.status == JOB_ERROR:
+        raise HTTPException(status_code=410, detail=job.error or "فشل التنزيل.")
+    if not job.streamable:
+        raise HTTPException(status_code=409, detail="هذه الصيغة لا تدعم البث أثناء التنزيل.")
+
+    is_done = lambda: job.file_path is not None or job.status == JOB_ERROR
+    partial_path = await wait_for_file(lambda: job.partial_path, is_done)
+    if not partial_path:
+        if job.file_path:
+            return await get_job_file_endpoint(job_id, request)
+        raise HTTPException(status_code=504, detail="لم يبدأ التنزيل في الوقت المحدد.")
+
+    file_name = job.result_name or os.path.basename(partial_path)
+    return StreamingResponse(
+        tail_growing_file(partial_path, lambda: job.file_path is not None, lambda: job.status == JOB_ERROR),
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": content_disposition(file_name)}
+    )
+
+
+# مهام الخلفية الجارية (متابعة عناصر الدفعات)
+background_tasks: set[asyncio.Task] = set()
+
+# توسيع رابط قائمة التشغيل إلى روابط عناصرها باستخراج سطحي (بدون استخراج كل فيديو)
+def expand_playlist(url: str, max_items: int = BATCH_MAX_ITEMS) -> list[dict]:
+    with ydl_pool.checkout(PLAYLIST_YDL_OPTS, playlistend=max_items) as ydl:
+        info_dict = ydl.extract_info(url, download=False, process=True)
+    if info_dict.get('_type') not in ('playlist', 'multi_video'):
+        return [{"url": url, "title": info_dict.get('title')}]
+    entries = []
+    for entry in info_dict.get('entries') or []:
+        if not entry:
+            continue
+        if entry.get('_type') in ('url', 'url_transparent'):
+            entry_url = entry.get('url')
+        elif entry.get('webpage_url') and normalize_url(entry['webpage_url']) != normalize_url(url):
+            entry_url = entry['webpage_url']
+        else:
+            # عناصر مضمنة في نفس الصفحة: صفحتها هي القائمة نفسها، فنستخدم رابط الوسائط مباشرة
+            entry_url = entry.get('url')
+        if entry_url:
+            entries.append({"url": entry_url, "title": entry.get('title')})
+        if len(entries) >= max_items:
+            break
+    return entries
+
+# متابعة تقدم عنصر في الدفعة وإعادة نشره على قناة الدفعة مع ملخص محدث
+async def follow_batch_item(batch: Batch, item: dict):
+    async for message in progress_broker.subscribe(item["job_id"]):
+        if message.get("status") in (JOB_FINISHED, JOB_ERROR):
+            item["status"] = message["status"]
+            item["error"] = message.get("message")
+            item["download_url"] = message.get("download_url")
+        elif message.get("status"):
+            item["status"] = message["status"]
+        if all(i["status"] in (JOB_FINISHED, JOB_ERROR) for i in batch.items):
+            batch.finished_at = time.time()
+        update = {**batch.summary(), "item": {"index": item["index"], **message}}
+        if not batch.finished_at:
+            # رسائل العناصر ليست نهائية بالنسبة لقناة الدفعة
+            update["status"] = "running"
+        await progress_broker.publish(batch.batch_id, update)
+        if is_terminal(message):
+            return
+
+# نقطة نهاية تنزيل دفعة: قائمة تشغيل أو عدة روابط، تُوزع على عمال الطابور
+@app.post("/api/batch", summary="تنزيل قائمة تشغيل أو مجموعة روابط")
+async def start_batch_endpoint(request: BatchRequest, http_request: Request):
+    owner = limit_client(http_request, request.client_id)
+    try:
+        format_string = build_format_string(request.format_type, request.quality)
     except ValueError as e:
-        if websocket_connection:
-            await websocket_connection.send_json({"status": "error", "message": str(e)})
         raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        if websocket_connection:
-            await websocket_connection.send_json({"status": "error", "message": f"حدث خطأ غير متوقع: {e}"})
-        raise HTTPException(status_code=500, detail=f"خطأ داخلي في الخادم أثناء التنزيل: {e}")
-    finally:
-        # هذا الجزء مسؤول عن تنظيف المجلدات المؤقتة.
-        # المنطق الحالي يقوم بحذف المجلد الفريد الذي تم إنشاؤه لكل تنزيل
-        # عندما لا يتم استخدام مجلد مخصص.
-        if not request.use_custom_folder and os.path.exists(temp_download_path):
-            async def cleanup_temp_folder():
-                # إعطاء مهلة قصيرة لضمان إرسال الملف بالكامل للمتصفح قبل الحذف
-                # هذه المهلة ضرورية لأن FileResponse قد لا تكون قد أتمت إرسال الملف
-                # بالكامل عندما يتم استدعاء finally.
-                await asyncio.sleep(3) # زيادة المهلة قليلاً للتأكد
-                try:
-                    shutil.rmtree(temp_download_path)
-                    print(f"Cleaned up temporary folder: {temp_download_path}")
-                except OSError as e:
-                    print(f"Error removing temporary folder {temp_download_path}: {e}")
-            asyncio.create_task(cleanup_temp_folder())
-
-        # **تحذير: الكود أدناه سيقوم بحذف مجلد PROJECT_DOWNLOAD_DIR بالكامل**
-        # **(أي المجلد "downloads" الرئيسي في مشروعك) بعد كل عملية تنزيل.**
-        # **هذا السلوك غير موصى به بشدة لأنه قد يؤدي إلى:**
-        # 1.  **فقدان بيانات:** إذا كان هناك أي ملفات أخرى غير مرتبطة بالتنزيل الحالي في هذا المجلد.
-        # 2.  **تعارض مع تنزيلات متزامنة:** إذا كان هناك أكثر من عملية تنزيل تحدث في نفس الوقت، فقد يقوم بحذف ملفات تنزيلات أخرى جارية.
-        # 3.  **مشاكل في الأداء:** إعادة إنشاء المجلد مرارًا وتكرارًا.
-        # **استخدم هذا الكود على مسؤوليتك الخاصة إذا كنت تفهم المخاطر وتتحملها.**
-        #
-        # if os.path.exists(PROJECT_DOWNLOAD_DIR):
-        #     async def cleanup_main_download_dir_contents():
-        #         # مهلة أطول للتأكد من انتهاء جميع العمليات
-        #         await asyncio.sleep(5) 
-        #         try:
-        #             for item in os.listdir(PROJECT_DOWNLOAD_DIR):
-        #                 item_path = os.path.join(PROJECT_DOWNLOAD_DIR, item)
-        #                 if os.path.isfile(item_path):
-        #                     os.remove(item_path)
-        #                     print(f"Removed file: {item_path}")
-        #                 elif os.path.isdir(item_path):
-        #                     shutil.rmtree(item_path)
-        #                     print(f"Removed directory: {item_path}")
-        #             print(f"Cleaned up all contents of PROJECT_DOWNLOAD_DIR: {PROJECT_DOWNLOAD_DIR}")
-        #         except OSError as e:
-        #             print(f"Error cleaning PROJECT_DOWNLOAD_DIR {PROJECT_DOWNLOAD_DIR}: {e}")
-        #     asyncio.create_task(cleanup_main_download_dir_contents())
 
+    entries = [{"url": u, "title": None} for u in request.urls if u.strip()]
+    if request.url:
+        try:
+            await host_limiter.wait(url_host(request.url), HOST_MAX_WAIT)
+            entries = await asyncio.get_running_loop().run_in_executor(
+                info_executor, expand_playlist, request.url) + entries
+        except RateLimitedError as e:
+            raise rate_limited_response(e)
+        except yt_dlp.utils.YoutubeDLError as e:
+            print(f"yt-dlp error while expanding playlist {request.url}: {e}")
+            raise HTTPException(status_code=400, detail=f"خطأ في جلب قائمة التشغيل: {e}")
+    entries = entries[:BATCH_MAX_ITEMS]
+    if not entries:
+        raise HTTPException(status_code=400, detail="لا توجد روابط لتنزيلها.")
+    if len(entries) > job_manager.free_slots():
+        raise HTTPException(status_code=429, detail="طابور التنزيل ممتلئ، حاول لاحقًا.")
+
+    parallelism = max(1, request.parallelism or BATCH_PARALLELISM)
+    batch = Batch(request.url or "urls", parallelism)
+    for index, entry in enumerate(entries):
+        job = Job(entry["url"], format_string, request.client_id)
+        job.group = batch.batch_id
+        job.owner = owner
+        job.group_limit = parallelism
+        rejection = None
+        try:
+            submitted_job = await job_manager.submit(job)
+        except (QueueFullError, InsufficientStorageError, StorageBusyError) as e:
+            submitted_job = None
+            rejection = str(e)
+            print(f"Batch {batch.batch_id} item {index} rejected: {e}")
+        if submitted_job is job:
+            await send_job_message(job, {"status": JOB_QUEUED})
+        batch.items.append({
+            "index": index,
+            "url": entry["url"],
+            "title": entry["title"],
+            "job_id": submitted_job.job_id if submitted_job else None,
+            "status": submitted_job.status if submitted_job else JOB_ERROR,
+            "error": rejection,
+            "download_url": None,
+        })
+    if not any(item["job_id"] for item in batch.items):
+        # رُفضت كل العناصر: لا توجد مهمة تُكمل الدفعة لاحقًا، فهي منتهية الآن
+        batch.finished_at = time.time()
+    job_manager.batches[batch.batch_id] = batch
+    await progress_broker.publish(batch.batch_id, batch.summary())
+    for item in batch.items:
+        if item["job_id"]:
+            task = asyncio.create_task(follow_batch_item(batch, item))
+            # الاحتفاظ بمرجع للمهمة حتى لا يحذفها جامع القمامة قبل انتهائها
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
+    print(f"Queued batch {batch.batch_id} with {len(batch.items)} items (parallelism: {parallelism})")
+    return batch.to_dict()
+
+@app.get("/api/batches/{batch_id}", summary="حالة دفعة التنزيل")
+async def get_batch_endpoint(batch_id: str):
+    batch = job_manager.batches.get(batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="الدفعة غير موجودة أو انتهت صلاحيتها.")
+    return batch.to_dict()
+
+# متابعة تقدم جميع عناصر الدفعة عبر WebSocket (نفس وسيط التقدم، بمعرف الدفعة)
+@app.websocket("/ws/batches/{batch_id}")
+async def batch_websocket_endpoint(websocket: WebSocket, batch_id: str):
+    await job_websocket_endpoint(websocket, batch_id)
+
+# أرشيف يُبث مباشرة من ملفات العناصر المكتملة (/zip باقٍ للتوافق مع الروابط السابقة)
+@app.get("/api/batches/{batch_id}/archive", summary="تنزيل عناصر الدفعة كأرشيف")
+@app.get("/api/batches/{batch_id}/zip", summary="تنزيل عناصر الدفعة كأرشيف ZIP")
+async def get_batch_archive_endpoint(batch_id: str, format: str = "zip"):
+    batch = job_manager.batches.get(batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="الدفعة غير موجودة أو انتهت صلاحيتها.")
+    if not batch.finished_at:
+        raise HTTPException(status_code=409, detail="لم تكتمل الدفعة بعد.")
+    files = []
+    for item in batch.items:
+        job = job_manager.get(item["job_id"]) if item["job_id"] else None
+        if job:
+            files.extend(job.files)
+    if not files:
+        raise HTTPException(status_code=410, detail="لا توجد ملفات متاحة في هذه الدفعة.")
+    return await archive_response(files, f"batch-{batch_id[:8]}", format)
 
 # --- نقطة نهاية الدردشة مع الذكاء الاصطناعي ---
 @app.post("/api/chat", summary="الدردشة مع نموذج Gemini AI")
@@ -433,5 +1159,11 @@ async def chat_with_gemini(chat_request: ChatRequest):
         raise HTTPException(status_code=500, detail=f"حدث خطأ غير متوقع أثناء الدردشة مع الذكاء الاصطناعي: {e}")
 import uvicorn
 
+STARTUP.finish("app")
+
+# عناوين الوكلاء العكسيين الموثوق بترويسة X-Forwarded-For منهم (مفصولة بفواصل، أو * لأي عنوان).
+# Procfile يثق بأي عنوان لأن موجه المنصة هو المدخل الوحيد للتطبيق؛ عند التشغيل المباشر يُثق بـ 127.0.0.1 فقط
+FORWARDED_ALLOW_IPS = os.environ.get("FORWARDED_ALLOW_IPS", "127.0.0.1")
+
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000)
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, proxy_headers=True, forwarded_allow_ips=FORWARDED_ALLOW_IPS)
@@ -0,0 +1,239 @@
+import os
+import time
+import asyncio
+import threading
+from contextlib import contextmanager
+
+# حدود فئات المدد الزمنية (بالثواني)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# الفترة بين قياسات تأخر حلقة الأحداث (بالثواني)
+EVENT_LOOP_LAG_INTERVAL = float(os.environ.get("EVENT_LOOP_LAG_INTERVAL", "0.25"))
+# حدود فئات سرعة التنزيل (بايت في الثانية): من 64KiB/s حتى 1GiB/s
+THROUGHPUT_BUCKETS = tuple(64 * 1024 * 4 ** n for n in range(8))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """أساس المقاييس. إذا مُررت ``collect`` تُحسب القيم عند كل قراءة لـ /metrics
+    (قائمة أزواج (labels, value)) من إحصائيات موجودة بدلاً من تحديثها يدويًا."""
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), collect=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _labels(self, key: tuple, **extra) -> dict:
+        return {**dict(zip(self.labelnames, key)), **extra}
+
+    def render(self) -> list[str]:
+        header = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        if self.collect is None:
+            return header + self._samples()
+        try:
+            pairs = list(self.collect())
+        except Exception as e:
+            print(f"Error collecting metric {self.name}: {e}")
+            return header
+        return header + [f"{self.name}{_format_labels(labels)} {_format_value(value)}"
+                         for labels, value in pairs if value is not None]
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), collect=None):
+        super().__init__(name, documentation, labelnames, collect)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_format_labels(self._labels(key))} {_format_value(value)}"
+                for key, value in values.items()]
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), collect=None):
+        super().__init__(name, documentation, labelnames, collect)
+        self._values: dict[tuple, float] = {}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_format_labels(self._labels(key))} {_format_value(value)}"
+                for key, value in values.items()]
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # key -> [عدد كل فئة..., المجموع، العدد الكلي]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            values = {key: list(state) for key, state in self._values.items()}
+        lines = []
+        for key, state in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                labels = self._labels(key, le=_format_value(float(bound)))
+                lines.append(f"{self.name}_bucket{_format_labels(labels)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self._labels(key))} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self._labels(key))} {state[-1]}")
+        return lines
+
+
+REGISTRY: list[_Metric] = []
+
+
+def render() -> str:
+    """كل المقاييس بصيغة نص Prometheus (text exposition format 0.0.4)."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- المقاييس المشتركة بين الوحدات ---
+
+EXTRACT_SECONDS = Histogram("ytdl_extract_seconds", "Video info extraction latency.", ("cache",))
+JOB_STAGE_SECONDS = Histogram("job_stage_seconds", "Time spent by download jobs in each stage.", ("stage",))
+JOBS_TOTAL = Counter("jobs_total", "Finished download jobs by outcome.", ("status",))
+DOWNLOAD_THROUGHPUT = Histogram("download_throughput_bytes_per_second", "Average download speed per job.",
+                                buckets=THROUGHPUT_BUCKETS)
+DOWNLOADED_BYTES = Counter("downloaded_bytes_total", "Bytes downloaded from upstream sites.")
+MERGE_SECONDS = Histogram("merge_seconds", "Time spent merging video and audio streams.")
+HTTP_REQUEST_SECONDS = Histogram("http_request_seconds", "HTTP request latency by route.", ("method", "route", "status"))
+BYTES_SERVED = Counter("http_bytes_served_total", "Response body bytes sent to clients by route.", ("route",))
+PROGRESS_SUBSCRIBERS = Gauge("progress_subscribers", "Open progress subscriptions.", ("transport",))
+EVENT_LOOP_LAG = Histogram("event_loop_lag_seconds", "Delay between a scheduled wakeup and when the loop ran it.",
+                           buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+
+
+async def monitor_event_loop(interval: float = EVENT_LOOP_LAG_INTERVAL):
+    """قياس تأخر حلقة الأحداث: أي عمل متزامن طويل عليها يؤخر استيقاظ هذه المهمة."""
+    loop = asyncio.get_running_loop()
+    while True:
+        scheduled = loop.time() + interval
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(loop.time() - scheduled, 0))
+
+
+@contextmanager
+def job_stage(job, stage: str):
+    """قياس مرحلة من مراحل المهمة: تُحفظ مدتها في job.timings وتُضاف إلى job_stage_seconds."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(job, stage, time.perf_counter() - start)
+
+
+def record_stage(job, stage: str, seconds: float):
+    if seconds < 0:
+        return
+    job.timings[stage] = round(job.timings.get(stage, 0) + seconds, 3)
+    JOB_STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+class MetricsMiddleware:
+    """وسيط ASGI يقيس زمن كل طلب HTTP وعدد بايتات الاستجابة حسب قالب المسار
+    (مثل /api/jobs/{job_id}/file) حتى لا تتضخم التسميات بمعرفات المهام."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+        sent = 0
+
+        async def counting_send(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            elif message["type"] == "http.response.zerocopysend":
+                sent += message.get("count") or 0
+            await send(message)
+
+        try:
+            await self.app(scope, receive, counting_send)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, method=scope["method"],
+                                         route=route, status=status)
+            if sent:
+                BYTES_SERVED.inc(sent, route=route)
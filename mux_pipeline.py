@@ -0,0 +1,233 @@
+import os
+import re
+import time
+import threading
+import subprocess
+
+from lazy_import import lazy_import
+
+from parallel_download import RangedDownload, probe_ranges, PARALLEL_MIN_SIZE, PARALLEL_READ_SIZE
+
+yt_dlp = lazy_import("yt_dlp")
+
+# وضع تنزيل "فيديو + صوت":
+#   off        - السلوك الافتراضي في yt-dlp (الفيديو ثم الصوت ثم دمج منفصل)
+#   concurrent - تنزيل التيارين معًا ثم الدمج بـ ffmpeg -c copy فور اكتمالهما
+#   stream     - ffmpeg يقرأ التيارين مباشرة من الشبكة ويدمجهما أثناء التنزيل (بدون ملفات وسيطة)
+MUX_PIPELINE = os.environ.get("MUX_PIPELINE", "off").lower()
+
+# الحاوية الناتجة عند دمج امتدادات متوافقة دون إعادة ترميز
+MERGE_EXTS = {
+    ("mp4", "m4a"): "mp4",
+    ("mp4", "mp4"): "mp4",
+    ("webm", "webm"): "webm",
+}
+
+
+class MuxError(Exception):
+    pass
+
+
+def is_mux_candidate(resolved_info: dict) -> bool:
+    """فيديو + صوت من تيارين HTTP منفصلين يمكن تنزيلهما ودمجهما بأنفسنا."""
+    if MUX_PIPELINE not in ("concurrent", "stream"):
+        return False
+    formats = resolved_info.get('requested_formats') or []
+    if len(formats) != 2:
+        return False
+    return all(f.get('protocol') in ('http', 'https') and f.get('url') for f in formats)
+
+
+def merge_ext(resolved_info: dict) -> str:
+    video, audio = resolved_info['requested_formats']
+    return MERGE_EXTS.get((video.get('ext'), audio.get('ext')), "mkv")
+
+
+def ffmpeg_executable(ydl):
+    # نفس اكتشاف ffmpeg الذي تستخدمه yt-dlp (يحترم خيار ffmpeg_location)
+    from yt_dlp.postprocessor.ffmpeg import FFmpegPostProcessor
+    processor = FFmpegPostProcessor(ydl)
+    return processor.executable if processor.available else None
+
+
+def _header_args(headers: dict) -> list[str]:
+    if not headers:
+        return []
+    return ['-headers', ''.join(f"{name}: {value}\r\n" for name, value in headers.items())]
+
+
+def _input_args(ydl, fmt: dict) -> list[str]:
+    # مثل FFmpegFD في yt-dlp: الكوكيز من cookiejar الخاص بـ yt-dlp مع ترويسات الصيغة
+    args = []
+    cookies = ydl.cookiejar.get_cookies_for_url(fmt['url'])
+    if cookies:
+        args.extend(['-cookies', ''.join(
+            f"{cookie.name}={cookie.value}; path={cookie.path}; domain={cookie.domain};\r\n" for cookie in cookies)])
+    return [*args, *_header_args(fmt.get('http_headers')), '-i', fmt['url']]
+
+
+def _proxy_url(ydl):
+    proxy = ydl.params.get('proxy')
+    if proxy and not re.match(r'[\da-zA-Z]+://', proxy):
+        proxy = f"http://{proxy}"
+    return proxy or None
+
+
+def _ffmpeg_env(proxy: str = None):
+    # ffmpeg يقرأ الوكيل من متغير البيئة http_proxy (نفس طريقة yt-dlp)
+    if not proxy:
+        return None
+    return {**os.environ, 'HTTP_PROXY': proxy, 'http_proxy': proxy}
+
+
+def _mux_command(ffmpeg: str, inputs: list[list[str]], output: str) -> list[str]:
+    command = [ffmpeg, '-hide_banner', '-nostdin', '-loglevel', 'error']
+    for input_args in inputs:
+        command.extend(input_args)
+    command.extend(['-map', '0:v:0', '-map', '1:a:0', '-c', 'copy', '-progress', 'pipe:1', '-y', output])
+    return command
+
+
+def _run_ffmpeg(command: list[str], on_output_size=None, env: dict = None):
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               stdin=subprocess.DEVNULL, text=True, env=env)
+    # -progress يكتب أسطر key=value؛ total_size هو حجم الملف الناتج حتى الآن
+    for line in process.stdout:
+        key, _, value = line.strip().partition('=')
+        if key == 'total_size' and value.isdigit() and on_output_size:
+            on_output_size(int(value))
+    stderr = process.stderr.read()
+    if process.wait() != 0:
+        raise MuxError(f"ffmpeg failed ({process.returncode}): {stderr.strip()[-500:]}")
+
+
+class _Progress:
+    """تجميع تقدم عدة تيارات في حالة واحدة بنفس شكل progress_hooks في yt-dlp."""
+
+    def __init__(self, hooks: list, total, filename: str, tmpfilename: str, info: dict):
+        self.hooks = hooks
+        self.total = total
+        self.filename = filename
+        self.tmpfilename = tmpfilename
+        self.info = info
+        self.started_at = time.monotonic()
+        self._parts = {}
+        self._lock = threading.Lock()
+
+    def update(self, part, downloaded: int):
+        with self._lock:
+            self._parts[part] = downloaded
+            downloaded = sum(self._parts.values())
+        elapsed = time.monotonic() - self.started_at
+        speed = downloaded / elapsed if elapsed > 0 else None
+        status = {
+            'status': 'downloading',
+            'downloaded_bytes': downloaded,
+            'total_bytes': self.total,
+            'speed': speed,
+            'eta': int((self.total - downloaded) / speed) if speed and self.total and self.total > downloaded else None,
+            'elapsed': elapsed,
+            'filename': self.filename,
+            'tmpfilename': self.tmpfilename,
+            'info_dict': self.info,
+        }
+        for hook in self.hooks:
+            hook(status)
+
+    def finish(self, size: int):
+        for hook in self.hooks:
+            hook({'status': 'finished', 'downloaded_bytes': size, 'total_bytes': size, 'filename': self.filename,
+                  'elapsed': time.monotonic() - self.started_at, 'info_dict': self.info})
+
+
+def _fetch_stream(ydl, fmt: dict, path: str, connections: int, on_bytes):
+    """تنزيل تيار واحد إلى ملف: بنطاقات متوازية إن أمكن، وإلا باتصال واحد."""
+    url = fmt['url']
+    headers = dict(fmt.get('http_headers') or {})
+    size = probe_ranges(ydl, url, headers) if connections > 1 else None
+    if size and size >= PARALLEL_MIN_SIZE:
+        RangedDownload(ydl, url, headers, path, size, connections,
+                       on_progress=lambda downloaded, total, elapsed: on_bytes(downloaded)).run()
+        return
+    response = ydl.urlopen(yt_dlp.networking.Request(url, headers=headers))
+    downloaded = 0
+    try:
+        with open(path, 'wb') as f:
+            while True:
+                data = response.read(PARALLEL_READ_SIZE)
+                if not data:
+                    break
+                f.write(data)
+                downloaded += len(data)
+                on_bytes(downloaded)
+    finally:
+        response.close()
+
+
+def _fetch_concurrently(ydl, formats: list[dict], paths: list[str], connections: int, progress: _Progress):
+    errors = []
+    per_stream = max(1, connections // len(formats))
+
+    def run(index: int):
+        try:
+            _fetch_stream(ydl, formats[index], paths[index], per_stream,
+                          lambda downloaded: progress.update(index, downloaded))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(i,), daemon=True) for i in range(len(formats))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+def download_muxed(ydl, info_dict: dict, resolved_info: dict, connections: int, hooks: list):
+    """تنزيل فيديو + صوت ودمجهما بـ ffmpeg -c copy. يعيد مسار الملف النهائي،
+    أو None إذا لم يكن ffmpeg متاحًا (فيتولى yt-dlp التنزيل كالمعتاد)."""
+    ffmpeg = ffmpeg_executable(ydl)
+    if not ffmpeg:
+        print("ffmpeg not found, using the default yt-dlp merge")
+        return None
+
+    formats = resolved_info['requested_formats']
+    ext = merge_ext(resolved_info)
+    filename = ydl.prepare_filename({**info_dict, **resolved_info, 'ext': ext})
+    base = os.path.splitext(filename)[0]
+    # ffmpeg يحدد الحاوية من الامتداد، لذا يبقى الامتداد في آخر اسم الملف المؤقت
+    tmpfilename = f"{base}.temp.{ext}"
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+    sizes = [f.get('filesize') or f.get('filesize_approx') for f in formats]
+    progress = _Progress(hooks, int(sum(sizes)) if all(sizes) else None, filename, tmpfilename, resolved_info)
+    stream_paths = [f"{base}.f{f['format_id']}.{f.get('ext') or 'bin'}.part" for f in formats]
+    proxy = _proxy_url(ydl)
+    # ffmpeg لا يدعم وكلاء SOCKS، فيُنزل التياران عبر yt-dlp نفسه (الوضع المتزامن) بدلاً من ذلك
+    stream = MUX_PIPELINE == "stream" and not (proxy or "").startswith("socks")
+
+    try:
+        if stream:
+            print(f"Streaming mux of {resolved_info.get('format_id')} into {filename}")
+            inputs = [_input_args(ydl, f) for f in formats]
+            _run_ffmpeg(_mux_command(ffmpeg, inputs, tmpfilename),
+                        on_output_size=lambda size: progress.update('output', size), env=_ffmpeg_env(proxy))
+        else:
+            print(f"Concurrent fetch of {resolved_info.get('format_id')} with {connections} connections")
+            _fetch_concurrently(ydl, formats, stream_paths, connections, progress)
+            # مثل yt-dlp: حالة finished عند اكتمال التنزيل، ثم الدمج كمعالجة لاحقة
+            progress.finish(sum(os.path.getsize(path) for path in stream_paths))
+            _run_ffmpeg(_mux_command(ffmpeg, [['-i', path] for path in stream_paths], tmpfilename))
+        os.replace(tmpfilename, filename)
+    finally:
+        for path in (*stream_paths, tmpfilename):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Error removing temporary mux file {path}: {e}")
+
+    if stream:
+        progress.finish(os.path.getsize(filename))
+    return filename
@@ -0,0 +1,259 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+from lazy_import import lazy_import
+
+yt_dlp = lazy_import("yt_dlp")
+
+# وضع الإنتاجية العالية: تنزيل أجزاء HLS/DASH بالتوازي وتقسيم ملفات HTTP الكبيرة إلى نطاقات متوازية
+PARALLEL_DOWNLOADS = os.environ.get("PARALLEL_DOWNLOADS", "0").lower() in ("1", "true", "yes", "on")
+# الحد الأقصى للاتصالات المتزامنة لمهمة واحدة
+DOWNLOAD_CONNECTIONS_PER_JOB = int(os.environ.get("DOWNLOAD_CONNECTIONS_PER_JOB", "4"))
+# الحد الأقصى للاتصالات المتزامنة لكل التنزيلات في هذه العملية
+DOWNLOAD_MAX_CONNECTIONS = int(os.environ.get("DOWNLOAD_MAX_CONNECTIONS", "16"))
+# أصغر حجم ملف يستحق التقسيم إلى نطاقات (الملفات الأصغر تُنزل باتصال واحد)
+PARALLEL_MIN_SIZE = int(os.environ.get("PARALLEL_MIN_SIZE", str(8 * 1024 * 1024)))
+# حجم النطاق الواحد الذي يسحبه كل اتصال من قائمة العمل
+PARALLEL_CHUNK_SIZE = int(os.environ.get("PARALLEL_CHUNK_SIZE", str(8 * 1024 * 1024)))
+# حجم القراءة من الشبكة في كل مرة
+PARALLEL_READ_SIZE = int(os.environ.get("PARALLEL_READ_SIZE", str(256 * 1024)))
+# عدد محاولات إعادة تنزيل النطاق عند انقطاع الاتصال (تستأنف من آخر بايت مكتوب)
+PARALLEL_RETRIES = int(os.environ.get("PARALLEL_RETRIES", "3"))
+
+# بروتوكولات الأجزاء التي يدعم yt-dlp تنزيلها بالتوازي (concurrent_fragment_downloads)
+FRAGMENT_PROTOCOLS = ("m3u8_native", "http_dash_segments", "http_dash_segments_generator")
+# خيارات yt-dlp التي تكتب ملفات أو تعالج النتيجة داخل process_info فقط
+YTDL_PROCESSING_PARAMS = ('writesubtitles', 'writeautomaticsub', 'writethumbnail', 'write_all_thumbnails',
+                          'writeinfojson', 'writedescription', 'postprocessors')
+
+
+class ConnectionBudget:
+    """عداد الاتصالات المتاحة لكل التنزيلات (حد عام).
+
+    كل تنزيل يحجز اتصالاً واحدًا على الأقل (ينتظر إذا لم يتوفر)، ثم ما يتوفر حتى
+    الحد المطلوب، فلا تستحوذ مهمة واحدة على كل الاتصالات ولا تتوقف مهمة بانتظار الحد الكامل.
+    """
+
+    def __init__(self, total: int = DOWNLOAD_MAX_CONNECTIONS):
+        self.total = total
+        self.in_use = 0
+        self.peak_in_use = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, wanted: int) -> int:
+        with self._cond:
+            while self.in_use >= self.total:
+                self._cond.wait()
+            granted = max(1, min(wanted, self.total - self.in_use))
+            self.in_use += granted
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            return granted
+
+    def release(self, count: int):
+        with self._cond:
+            self.in_use -= count
+            self._cond.notify_all()
+
+    @contextmanager
+    def reserve(self, wanted: int):
+        granted = self.acquire(wanted)
+        try:
+            yield granted
+        finally:
+            self.release(granted)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"total": self.total, "in_use": self.in_use, "peak_in_use": self.peak_in_use}
+
+
+connection_budget = ConnectionBudget()
+
+
+def _formats(resolved_info: dict) -> list[dict]:
+    return resolved_info.get('requested_formats') or [resolved_info]
+
+
+def is_fragmented(resolved_info: dict) -> bool:
+    return any(f.get('protocol') in FRAGMENT_PROTOCOLS for f in _formats(resolved_info))
+
+
+def is_ranged_candidate(resolved_info: dict) -> bool:
+    """صيغة HTTP واحدة (غير مجزأة) يمكن تقسيمها إلى نطاقات إذا دعم الخادم Range."""
+    if not PARALLEL_DOWNLOADS or resolved_info.get('requested_formats'):
+        return False
+    if resolved_info.get('protocol') not in ('http', 'https') or not resolved_info.get('url'):
+        return False
+    size = resolved_info.get('filesize')
+    return not size or size >= PARALLEL_MIN_SIZE
+
+
+def requires_ytdlp_processing(params: dict, resolved_info: dict) -> bool:
+    """هل يحتاج التنزيل إلى مراحل yt-dlp بعد التنزيل (ترجمات، صورة مصغرة، معالجات لاحقة، إصلاحات)؟
+    المسارات السريعة تعيد الملف دون process_info، فلا تُستخدم عندها."""
+    if any(params.get(name) for name in YTDL_PROCESSING_PARAMS):
+        return True
+    if params.get('fixup') == 'never':
+        return False
+    # الإصلاحات التي يطبقها yt-dlp على تيارات HTTP: نسبة العرض المشوهة وحاوية m4a_dash
+    return any(f.get('stretched_ratio') not in (None, 1) or f.get('container') == 'm4a_dash'
+               for f in [resolved_info, *_formats(resolved_info)])
+
+
+def wanted_connections(resolved_info: dict) -> int:
+    if PARALLEL_DOWNLOADS and (is_fragmented(resolved_info) or is_ranged_candidate(resolved_info)):
+        return DOWNLOAD_CONNECTIONS_PER_JOB
+    return 1
+
+
+def probe_ranges(ydl, url: str, headers: dict):
+    """يعيد حجم الملف إذا كان الخادم يدعم طلبات Range، وإلا None."""
+    response = ydl.urlopen(yt_dlp.networking.Request(url, headers={**headers, 'Range': 'bytes=0-0'}))
+    try:
+        if response.status != 206:
+            return None
+        content_range = response.headers.get('Content-Range') or ''
+        total = content_range.rpartition('/')[2]
+        return int(total) if total.isdigit() else None
+    finally:
+        response.close()
+
+
+class RangedDownload:
+    """تنزيل ملف HTTP واحد عبر عدة اتصالات، كل اتصال يسحب نطاقًا من قائمة العمل
+    ويكتبه في موضعه داخل ملف محجوز مسبقًا بالحجم الكامل."""
+
+    def __init__(self, ydl, url: str, headers: dict, path: str, size: int, connections: int,
+                 on_progress=None, chunk_size: int = PARALLEL_CHUNK_SIZE):
+        self.ydl = ydl
+        self.url = url
+        self.headers = headers
+        self.path = path
+        self.size = size
+        self.connections = max(1, connections)
+        self.on_progress = on_progress
+        self.downloaded = 0
+        self.started_at = None
+        self._chunks = [(start, min(start + chunk_size, size) - 1) for start in range(0, size, chunk_size)]
+        self._lock = threading.Lock()
+        self._error = None
+
+    def _next_chunk(self):
+        with self._lock:
+            if self._error is not None or not self._chunks:
+                return None
+            return self._chunks.pop(0)
+
+    def _report(self, count: int):
+        with self._lock:
+            self.downloaded += count
+            downloaded = self.downloaded
+        if self.on_progress:
+            self.on_progress(downloaded, self.size, time.monotonic() - self.started_at)
+
+    def _fetch(self, f, start: int, end: int):
+        offset = start
+        for attempt in range(PARALLEL_RETRIES + 1):
+            try:
+                response = self.ydl.urlopen(yt_dlp.networking.Request(self.url, headers={**self.headers, 'Range': f'bytes={offset}-{end}'}))
+                try:
+                    if response.status != 206:
+                        raise OSError(f"Server ignored range request (HTTP {response.status})")
+                    f.seek(offset)
+                    while offset <= end:
+                        data = response.read(min(PARALLEL_READ_SIZE, end - offset + 1))
+                        if not data:
+                            raise OSError(f"Connection closed at byte {offset} of range {start}-{end}")
+                        f.write(data)
+                        offset += len(data)
+                        self._report(len(data))
+                finally:
+                    response.close()
+                return
+            except Exception:
+                if attempt >= PARALLEL_RETRIES or self._error is not None:
+                    raise
+                time.sleep(0.5 * (attempt + 1))
+
+    def _worker(self):
+        try:
+            with open(self.path, 'r+b') as f:
+                while True:
+                    chunk = self._next_chunk()
+                    if chunk is None:
+                        return
+                    self._fetch(f, *chunk)
+        except Exception as e:
+            with self._lock:
+                if self._error is None:
+                    self._error = e
+
+    def run(self):
+        # حجز الملف بحجمه الكامل حتى يكتب كل اتصال في موضعه مباشرة
+        with open(self.path, 'wb') as f:
+            f.truncate(self.size)
+        self.started_at = time.monotonic()
+        threads = [threading.Thread(target=self._worker, daemon=True)
+                   for _ in range(min(self.connections, len(self._chunks)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self._error is not None:
+            raise self._error
+
+
+def download_ranged(ydl, info_dict: dict, resolved_info: dict, connections: int, hooks: list):
+    """تنزيل صيغة HTTP واحدة بنطاقات متوازية إلى نفس المسار الذي تختاره yt-dlp.
+
+    يعيد مسار الملف النهائي، أو None إذا كان الخادم لا يدعم Range أو كان الملف صغيرًا
+    (فيتولى yt-dlp التنزيل كالمعتاد). استدعاءات التقدم بنفس شكل progress_hooks في yt-dlp.
+    """
+    url = resolved_info['url']
+    headers = dict(resolved_info.get('http_headers') or {})
+    size = probe_ranges(ydl, url, headers)
+    if not size or size < PARALLEL_MIN_SIZE:
+        return None
+
+    filename = ydl.prepare_filename({**info_dict, **resolved_info})
+    if os.path.exists(f"{filename}.part"):
+        # ملف جزئي متسلسل من تشغيل سابق: yt-dlp يستأنفه من حيث توقف بدلاً من إعادة التنزيل
+        return None
+    # اسم مختلف عن .part الخاص بـ yt-dlp: الملف المحجوز مسبقًا فيه فجوات، فلا يجوز أن
+    # يستأنفه yt-dlp على أنه متسلسل؛ بقاياه من تشغيل سابق تُستبدل بتنزيل جديد
+    tmpfilename = f"{filename}.ranged.part"
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+
+    def on_progress(downloaded: int, total: int, elapsed: float):
+        speed = downloaded / elapsed if elapsed > 0 else None
+        status = {
+            'status': 'downloading',
+            'downloaded_bytes': downloaded,
+            'total_bytes': total,
+            'speed': speed,
+            'eta': int((total - downloaded) / speed) if speed else None,
+            'elapsed': elapsed,
+            'filename': filename,
+            'tmpfilename': tmpfilename,
+            'info_dict': resolved_info,
+        }
+        for hook in hooks:
+            hook(status)
+
+    download = RangedDownload(ydl, url, headers, tmpfilename, size, connections, on_progress)
+    print(f"Parallel ranged download with {download.connections} connections: {filename} ({size} bytes)")
+    try:
+        download.run()
+    except Exception:
+        try:
+            os.remove(tmpfilename)
+        except OSError:
+            pass
+        raise
+    os.replace(tmpfilename, filename)
+    for hook in hooks:
+        hook({'status': 'finished', 'downloaded_bytes': size, 'total_bytes': size, 'filename': filename,
+              'elapsed': time.monotonic() - download.started_at, 'info_dict': resolved_info})
+    return filename
@@ -0,0 +1,87 @@
+import os
+import asyncio
+import threading
+
+# الحد الأقصى لعدد رسائل التقدم المرسلة في الثانية لكل مهمة
+PROGRESS_RATE_HZ = float(os.environ.get("PROGRESS_RATE_HZ", "4"))
+
+
+def compact_progress(d: dict) -> dict:
+    """تحويل حالة تقدم yt-dlp إلى رسالة مختصرة بأرقام فقط (التنسيق يتم في الواجهة)."""
+    total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate')
+    downloaded_bytes = d.get('downloaded_bytes') or 0
+    progress = (downloaded_bytes / total_bytes * 100) if total_bytes else 0
+    speed = d.get('speed')
+    return {
+        "status": "downloading",
+        "progress": round(progress, 1),
+        "downloaded": downloaded_bytes,
+        "total": int(total_bytes) if total_bytes else None,
+        "speed": int(speed) if speed else None,
+        "eta": d.get('eta'),
+    }
+
+
+class ProgressChannel:
+    """قناة تقدم لمهمة واحدة تجمع التحديثات وترسلها بمعدل محدود.
+
+    ``publish`` آمنة للاستدعاء من خيط التنزيل: تحفظ آخر حالة فقط وتوقظ مهمة الإرسال
+    مرة واحدة. إذا كان المستقبل بطيئًا يتم استبدال الحالات الوسيطة بأحدثها بدلاً من
+    تكديس رسائل في حلقة الأحداث.
+    """
+
+    def __init__(self, send, rate_hz: float = PROGRESS_RATE_HZ, loop=None):
+        self.send = send
+        self.interval = 1.0 / rate_hz if rate_hz > 0 else 0
+        self.loop = loop or asyncio.get_running_loop()
+        self.published = 0
+        self.sent = 0
+        self._lock = threading.Lock()
+        self._latest = None
+        self._wakeup_pending = False
+        self._event = asyncio.Event()
+        self._closed = False
+        self._task = self.loop.create_task(self._run())
+
+    def publish(self, message: dict):
+        with self._lock:
+            if self._closed:
+                return
+            self._latest = message
+            self.published += 1
+            if self._wakeup_pending:
+                return
+            self._wakeup_pending = True
+        self.loop.call_soon_threadsafe(self._event.set)
+
+    def _take(self):
+        with self._lock:
+            message, self._latest = self._latest, None
+            self._wakeup_pending = False
+            return message
+
+    async def _run(self):
+        while True:
+            await self._event.wait()
+            self._event.clear()
+            message = self._take()
+            if message is not None:
+                try:
+                    await self.send(message)
+                    self.sent += 1
+                except Exception as e:
+                    print(f"Error sending progress update: {e}")
+            if self._closed:
+                return
+            if self.interval:
+                await asyncio.sleep(self.interval)
+
+    async def close(self):
+        """إرسال آخر حالة معلقة ثم إيقاف القناة."""
+        with self._lock:
+            self._closed = True
+        self._event.set()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
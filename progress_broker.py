@@ -0,0 +1,149 @@
+import os
+import json
+import asyncio
+
+# عنوان Redis لمشاركة التقدم بين عدة عمال uvicorn أو عدة خوادم (اختياري)
+PROGRESS_BROKER_URL = os.environ.get("PROGRESS_BROKER_URL", "")
+# مدة الاحتفاظ بآخر حالة معروفة للمهمة (بالثواني)
+PROGRESS_SNAPSHOT_TTL = int(os.environ.get("PROGRESS_SNAPSHOT_TTL", os.environ.get("JOB_RESULT_TTL", "900")))
+# الحد الأقصى للرسائل المنتظرة لكل مشترك قبل إسقاط الأقدم
+SUBSCRIBER_QUEUE_SIZE = int(os.environ.get("SUBSCRIBER_QUEUE_SIZE", "16"))
+
+TERMINAL_STATUSES = ("finished", "error")
+
+
+def is_terminal(message: dict) -> bool:
+    return message.get("status") in TERMINAL_STATUSES
+
+
+class ProgressBroker:
+    """وسيط نشر/اشتراك لتقدم المهام داخل العملية الواحدة.
+
+    يحتفظ بآخر حالة معروفة لكل مهمة (دمج جميع الرسائل المنشورة) ويرسلها لكل مشترك
+    جديد أولاً، ثم يرسل الرسائل الحية حتى رسالة الانتهاء أو الخطأ.
+    """
+
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._snapshots: dict[str, dict] = {}
+        self._subscribers: dict[str, set] = {}
+
+    async def publish(self, job_id: str, message: dict):
+        self._snapshots[job_id] = {**self._snapshots.get(job_id, {}), **message}
+        for queue in self._subscribers.get(job_id, ()):
+            if queue.full():
+                # مشترك بطيء: نسقط أقدم حالة وسيطة بدلاً من حجز الناشر
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+    async def snapshot(self, job_id: str):
+        return self._snapshots.get(job_id)
+
+    async def subscribe(self, job_id: str):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        # التسجيل وأخذ آخر حالة يتمان دون انتظار بينهما، فلا تضيع أي رسالة
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        snapshot = self._snapshots.get(job_id)
+        try:
+            if snapshot:
+                yield dict(snapshot)
+                if is_terminal(snapshot):
+                    return
+            while True:
+                message = await queue.get()
+                yield message
+                if is_terminal(message):
+                    return
+        finally:
+            subscribers = self._subscribers.get(job_id)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self._subscribers[job_id]
+
+    async def forget(self, job_id: str):
+        self._snapshots.pop(job_id, None)
+
+    def subscriber_count(self) -> int:
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    async def close(self):
+        pass
+
+
+class RedisProgressBroker:
+    """نفس واجهة ProgressBroker لكن عبر Redis pub/sub، ليعمل التقدم مع عدة عمال أو خوادم.
+
+    آخر حالة معروفة تُحفظ في مفتاح بمدة صلاحية، والرسائل الحية تُنشر على قناة لكل مهمة.
+    يقبل أي عميل متوافق مع redis.asyncio (مثل fakeredis للاختبار المحلي).
+    """
+
+    def __init__(self, url: str = PROGRESS_BROKER_URL, client=None, ttl: int = PROGRESS_SNAPSHOT_TTL,
+                 prefix: str = "video-downloader:progress"):
+        if client is None:
+            # اعتمادية اختيارية: يجب تثبيت redis فقط عند استخدام هذا الوسيط
+            import redis.asyncio as redis
+            client = redis.from_url(url)
+        self.redis = client
+        self.ttl = ttl
+        self.prefix = prefix
+        # آخر حالة لكل مهمة ينشرها هذا العامل، لتجنب قراءة Redis عند كل رسالة
+        self._local_snapshots: dict[str, dict] = {}
+        self._subscriber_count = 0
+
+    def _channel(self, job_id: str) -> str:
+        return f"{self.prefix}:{job_id}"
+
+    def _snapshot_key(self, job_id: str) -> str:
+        return f"{self.prefix}:last:{job_id}"
+
+    async def publish(self, job_id: str, message: dict):
+        snapshot = {**self._local_snapshots.get(job_id, {}), **message}
+        self._local_snapshots[job_id] = snapshot
+        await self.redis.set(self._snapshot_key(job_id), json.dumps(snapshot), ex=self.ttl)
+        await self.redis.publish(self._channel(job_id), json.dumps(message))
+        if is_terminal(message):
+            self._local_snapshots.pop(job_id, None)
+
+    async def snapshot(self, job_id: str):
+        raw = await self.redis.get(self._snapshot_key(job_id))
+        return json.loads(raw) if raw else None
+
+    async def subscribe(self, job_id: str):
+        pubsub = self.redis.pubsub()
+        # الاشتراك قبل قراءة آخر حالة حتى لا تضيع رسالة بينهما
+        await pubsub.subscribe(self._channel(job_id))
+        self._subscriber_count += 1
+        try:
+            snapshot = await self.snapshot(job_id)
+            if snapshot:
+                yield snapshot
+                if is_terminal(snapshot):
+                    return
+            async for item in pubsub.listen():
+                if item.get("type") != "message":
+                    continue
+                message = json.loads(item["data"])
+                yield message
+                if is_terminal(message):
+                    return
+        finally:
+            self._subscriber_count -= 1
+            await pubsub.unsubscribe(self._channel(job_id))
+            await pubsub.aclose()
+
+    async def forget(self, job_id: str):
+        self._local_snapshots.pop(job_id, None)
+
+    def subscriber_count(self) -> int:
+        return self._subscriber_count
+
+    async def close(self):
+        await self.redis.aclose()
+
+
+def create_progress_broker():
+    if PROGRESS_BROKER_URL:
+        print(f"Using Redis progress broker at {PROGRESS_BROKER_URL}")
+        return RedisProgressBroker(PROGRESS_BROKER_URL)
+    return ProgressBroker()
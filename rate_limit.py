@@ -0,0 +1,88 @@
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+
+# عدد طلبات /api/info و /api/download و /api/batch المسموح بها لكل عميل (client_id أو IP) في الدقيقة
+CLIENT_REQUESTS_PER_MINUTE = float(os.environ.get("CLIENT_REQUESTS_PER_MINUTE", "30"))
+# عدد الطلبات المتتالية المسموح بها دفعة واحدة قبل تطبيق المعدل
+CLIENT_BURST = int(os.environ.get("CLIENT_BURST", "10"))
+# عدد عمليات الاستخراج الجديدة (بدون الذاكرة المؤقتة) المسموح بها لكل موقع في الدقيقة
+HOST_REQUESTS_PER_MINUTE = float(os.environ.get("HOST_REQUESTS_PER_MINUTE", "60"))
+HOST_BURST = int(os.environ.get("HOST_BURST", "10"))
+# أقصى مدة انتظار لدور الموقع قبل رفض الطلب (بالثواني)
+HOST_MAX_WAIT = float(os.environ.get("HOST_MAX_WAIT", "10"))
+# الحد الأقصى لعدد المفاتيح المتتبعة (الأقدم استخدامًا يُحذف أولاً)
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", "10000"))
+
+
+class RateLimitedError(Exception):
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """دلو رموز (token bucket) لكل مفتاح: يمتلئ بمعدل ثابت حتى سعة burst،
+    وكل طلب يستهلك رمزًا واحدًا."""
+
+    def __init__(self, per_minute: float, burst: int, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.rate = per_minute / 60
+        self.burst = max(1, burst)
+        self.max_keys = max_keys
+        self.allowed = 0
+        self.limited = 0
+        # key -> (عدد الرموز، وقت آخر تحديث)
+        self._buckets: OrderedDict[str, tuple] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _take(self, keys: tuple, max_wait: float) -> tuple[bool, float]:
+        """استهلاك رمز من كل المفاتيح معًا إذا كان الانتظار حتى توفرها لا يتجاوز max_wait ثانية،
+        وإلا لا يُستهلك شيء من أي منها. يعيد (هل قُبل الطلب، مدة الانتظار حتى توفر الرموز)."""
+        if self.rate <= 0:
+            return True, 0.0
+        now = time.monotonic()
+        with self._lock:
+            balances = {}
+            for key in keys:
+                tokens, updated = self._buckets.pop(key, (self.burst, now))
+                balances[key] = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = max(max(0.0, (1 - tokens) / self.rate) for tokens in balances.values())
+            if wait > max_wait:
+                self.limited += 1
+                for key, tokens in balances.items():
+                    self._buckets[key] = (tokens, now)
+                return False, wait
+            # الرصيد قد يصبح سالبًا: الطلبات المنتظرة تحجز أدوارها بالترتيب
+            for key, tokens in balances.items():
+                self._buckets[key] = (tokens - 1, now)
+            self.allowed += 1
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return True, wait
+
+    def hit(self, *keys: str):
+        """طلب فوري: يرفع RateLimitedError إذا لم يتوفر رمز الآن في أي من المفاتيح.
+        المفاتيح تُفحص معًا، فرفض أحدها لا يستهلك رصيد البقية."""
+        allowed, wait = self._take(keys, 0)
+        if not allowed:
+            raise RateLimitedError("طلبات كثيرة جدًا، حاول لاحقًا.", wait)
+
+    async def wait(self, key: str, max_wait: float):
+        """انتظار الدور حتى max_wait ثانية، وإلا RateLimitedError."""
+        allowed, wait = self._take((key,), max_wait)
+        if not allowed:
+            raise RateLimitedError("تم تجاوز حد الطلبات لهذا الموقع، حاول لاحقًا.", wait)
+        if wait:
+            await asyncio.sleep(wait)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "per_minute": round(self.rate * 60, 2),
+                "burst": self.burst,
+                "keys": len(self._buckets),
+                "allowed": self.allowed,
+                "limited": self.limited,
+            }
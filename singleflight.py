@@ -0,0 +1,39 @@
+import asyncio
+
+
+class SingleFlight:
+    """تنفيذ عملية واحدة فقط لكل مفتاح في نفس الوقت.
+
+    الطلبات المتزامنة التي تحمل نفس المفتاح تنتظر نفس المهمة وتحصل على نفس النتيجة
+    (أو نفس الاستثناء) بدلاً من تكرار العمل.
+    """
+
+    def __init__(self):
+        self._calls: dict = {}
+        self.started = 0
+        self.shared = 0
+
+    async def do(self, key, fn):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            self.started += 1
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.shared += 1
+        # shield: إلغاء أحد المنتظرين لا يلغي العملية على البقية
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # تجنب تحذير "exception was never retrieved" إذا غادر جميع المنتظرين
+            task.exception()
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._calls), "started": self.started, "shared": self.shared}
@@ -0,0 +1,82 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+
+def _process_start_time() -> float:
+    """وقت بدء العملية (epoch) من /proc على Linux، ليشمل القياس بدء المفسر واستيراد uvicorn.
+    على الأنظمة الأخرى يُستخدم وقت استيراد هذه الوحدة."""
+    try:
+        with open("/proc/self/stat") as f:
+            # الحقول بعد اسم الأمر (بين قوسين)؛ starttime هو الحقل 22 (بوحدة clock ticks منذ الإقلاع)
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        elapsed = uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK")
+        return time.time() - max(elapsed, 0.0)
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+
+class StartupTimer:
+    """مدد مراحل بدء التشغيل (الاستيراد، بناء التطبيق، أول استخراج...) ولحظات الوصول
+    إلى كل مرحلة محسوبة من بدء العملية، لمتابعة زمن البدء البارد."""
+
+    def __init__(self):
+        self.process_started = _process_start_time()
+        # مدة كل مرحلة بالثواني
+        self.phases: dict[str, float] = {}
+        # الثواني من بدء العملية حتى كل لحظة (مثل ready و first_extract)
+        self.milestones: dict[str, float] = {}
+        self._open: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def start(self, phase: str):
+        with self._lock:
+            self._open[phase] = time.perf_counter()
+
+    def finish(self, phase: str):
+        with self._lock:
+            started = self._open.pop(phase, None)
+        if started is not None:
+            self.record(phase, time.perf_counter() - started)
+
+    @contextmanager
+    def phase(self, phase: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, time.perf_counter() - started)
+
+    def record(self, phase: str, seconds: float, once: bool = False):
+        with self._lock:
+            if once and phase in self.phases:
+                return
+            self.phases[phase] = round(seconds, 4)
+
+    def milestone(self, name: str):
+        """تسجيل لحظة الوصول إلى name (مرة واحدة فقط، أول وصول)."""
+        with self._lock:
+            if name not in self.milestones:
+                self.milestones[name] = round(time.time() - self.process_started, 4)
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                "process_started_at": self.process_started,
+                "uptime": round(time.time() - self.process_started, 1),
+                "phases": dict(self.phases),
+                "milestones": dict(self.milestones),
+            }
+
+    def print_report(self, title: str = "Startup timing"):
+        report = self.report()
+        phases = ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in report["phases"].items())
+        milestones = ", ".join(f"{name} at {seconds * 1000:.0f}ms" for name, seconds in report["milestones"].items())
+        print(f"{title}: {phases}; {milestones}")
+
+
+# مؤقت بدء التشغيل المشترك للعملية الحالية
+STARTUP = StartupTimer()
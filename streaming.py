@@ -0,0 +1,70 @@
+import os
+import asyncio
+
+# حجم الجزء المقروء من الملف في كل مرة أثناء البث
+STREAM_CHUNK_SIZE = int(os.environ.get("STREAM_CHUNK_SIZE", str(256 * 1024)))
+# الفترة بين محاولات القراءة عندما لا توجد بيانات جديدة بعد (بالثواني)
+STREAM_POLL_INTERVAL = float(os.environ.get("STREAM_POLL_INTERVAL", "0.25"))
+# المدة القصوى لانتظار بدء كتابة الملف قبل رفض طلب البث (بالثواني)
+STREAM_START_TIMEOUT = float(os.environ.get("STREAM_START_TIMEOUT", "30"))
+
+
+class StreamAborted(Exception):
+    pass
+
+
+def is_streamable(resolved_info: dict) -> bool:
+    """الصيغ المكونة من تيار واحد عبر HTTP فقط يمكن بثها أثناء التنزيل.
+
+    الصيغ المدمجة (فيديو+صوت) تحتاج إلى ffmpeg بعد التنزيل، وصيغ DASH/HLS
+    قد يُعاد كتابتها بواسطة المعالجات اللاحقة، لذلك لا تُبث.
+    """
+    format_id = resolved_info.get('format_id') or ''
+    if '+' in format_id or resolved_info.get('requested_formats'):
+        return False
+    if resolved_info.get('protocol') not in ('http', 'https'):
+        return False
+    if (resolved_info.get('container') or '').endswith('_dash'):
+        return False
+    return True
+
+
+async def wait_for_file(get_path, is_done, timeout: float = STREAM_START_TIMEOUT):
+    """انتظار ظهور الملف الجزئي. يعيد المسار أو None عند انتهاء المهلة أو انتهاء المهمة."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while loop.time() < deadline:
+        path = get_path()
+        if path and await asyncio.to_thread(os.path.exists, path):
+            return path
+        if is_done():
+            return None
+        await asyncio.sleep(STREAM_POLL_INTERVAL)
+    return None
+
+
+async def tail_growing_file(path: str, is_done, is_failed, chunk_size: int = STREAM_CHUNK_SIZE):
+    """قراءة ملف ما زال قيد الكتابة وإرسال أجزائه حتى انتهاء التنزيل.
+
+    الواصف المفتوح يبقى صالحًا بعد إعادة تسمية الملف (.part -> الاسم النهائي)
+    أو نقله إلى الذاكرة المؤقتة، لذا نواصل القراءة من نفس الواصف حتى النهاية.
+    """
+    f = await asyncio.to_thread(open, path, 'rb')
+    try:
+        while True:
+            chunk = await asyncio.to_thread(f.read, chunk_size)
+            if chunk:
+                yield chunk
+                continue
+            if is_failed():
+                # قطع الاتصال حتى لا يحفظ المتصفح ملفًا ناقصًا على أنه مكتمل
+                raise StreamAborted(f"Download failed while streaming {path}")
+            if is_done():
+                chunk = await asyncio.to_thread(f.read, chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+                continue
+            await asyncio.sleep(STREAM_POLL_INTERVAL)
+    finally:
+        f.close()
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+# الوحدات في جذر المستودع (بدون حزمة)، فتُضاف إلى مسار الاستيراد للاختبارات
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def main_module(tmp_path_factory):
+    # main يستخدم مسارات نسبية (downloads و static) عند الاستيراد وأثناء الطلبات،
+    # فيعمل من مجلد مؤقت طوال الاختبارات بدلاً من جذر المستودع
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("app"))
+    try:
+        import main
+        yield main
+    finally:
+        os.chdir(cwd)
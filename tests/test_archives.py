@@ -0,0 +1,74 @@
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from archives import iter_tar, iter_zip, open_tar_entries, tar_size
+
+
+@pytest.fixture
+def files(tmp_path):
+    contents = {
+        "video.mp4": os.urandom(70_000),
+        "فيديو.ar.srt": "1\n00:00:00,000 --> 00:00:01,000\nمرحبا\n".encode("utf-8"),
+        "empty.jpg": b"",
+    }
+    result = []
+    for name, data in contents.items():
+        path = tmp_path / name
+        path.write_bytes(data)
+        result.append((name, str(path)))
+    # اسم مكرر داخل الأرشيف
+    result.append(("video.mp4", result[0][1]))
+    return result, contents
+
+
+def test_tar_matches_announced_size_and_reads_back(files):
+    files, contents = files
+    entries = open_tar_entries(files)
+    size = tar_size(entries)
+    data = b"".join(iter_tar(entries, chunk_size=4096))
+
+    assert len(data) == size
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        assert tar.getnames() == ["video.mp4", "فيديو.ar.srt", "empty.jpg", "video (2).mp4"]
+        for member in tar.getmembers():
+            expected = contents[member.name.replace(" (2)", "")]
+            assert tar.extractfile(member).read() == expected
+
+
+def test_tar_size_is_pinned_when_file_is_replaced(files, tmp_path):
+    files, contents = files
+    entries = open_tar_entries(files)
+    size = tar_size(entries)
+    # استبدال الملف بعد حساب الحجم (مثل إعادة التنزيل) لا يغير ما يُبث
+    replacement = tmp_path / "replacement"
+    replacement.write_bytes(b"x" * 5)
+    os.replace(replacement, files[0][1])
+    data = b"".join(iter_tar(entries))
+
+    assert len(data) == size
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        assert tar.extractfile("video.mp4").read() == contents["video.mp4"]
+
+
+def test_tar_skips_missing_files(files):
+    files, _ = files
+    entries = open_tar_entries([*files, ("gone.mp4", "/nonexistent/gone.mp4")])
+    data = b"".join(iter_tar(entries))
+
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        assert "gone.mp4" not in tar.getnames()
+
+
+def test_zip_reads_back(files):
+    files, contents = files
+    data = b"".join(iter_zip(files, chunk_size=4096))
+
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == ["video.mp4", "فيديو.ar.srt", "empty.jpg", "video (2).mp4"]
+        for name in zf.namelist():
+            assert zf.read(name) == contents[name.replace(" (2)", "")]
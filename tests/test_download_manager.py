@@ -0,0 +1,56 @@
+import os
+
+from download_manager import DownloadManager, DownloadItem
+
+
+def _touch(directory, name):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(b"x")
+    return path
+
+
+def test_cancel_removes_only_ytdlp_temp_files(tmp_path):
+    directory = str(tmp_path)
+    keep = ["Title.mp4", "Title.mp4.srt", "Title.mp4.bak", "Title.mp4.part.txt", "Title.mp4.part-Fragment"]
+    remove = ["Title.mp4.part", "Title.mp4.part.ytdl", "Title.mp4.ytdl", "Title.mp4.part-Frag3",
+              "Title.mp4.part-Frag4.part"]
+    for name in keep + remove:
+        _touch(directory, name)
+
+    manager = DownloadManager(ydl_pool=None, ydl_opts={}, max_workers=1)
+    item = DownloadItem("https://example.com/v", "best", directory)
+    manager._update_progress(item, {
+        "status": "downloading", "downloaded_bytes": 1, "total_bytes": 10,
+        "filename": os.path.join(directory, "Title.mp4"), "tmpfilename": os.path.join(directory, "Title.mp4.part"),
+    })
+    manager._remove_partial_files(item)
+    manager.shutdown()
+
+    assert sorted(os.listdir(directory)) == sorted(keep)
+    assert item.streams == {}
+
+
+def test_finished_status_updates_the_temp_stream(tmp_path):
+    manager = DownloadManager(ydl_pool=None, ydl_opts={}, max_workers=1)
+    item = DownloadItem("https://example.com/v", "best", str(tmp_path))
+    final = os.path.join(str(tmp_path), "Title.mp4")
+    manager._update_progress(item, {"status": "downloading", "downloaded_bytes": 5, "total_bytes": 10,
+                                    "filename": final, "tmpfilename": f"{final}.part"})
+    manager._update_progress(item, {"status": "finished", "downloaded_bytes": 10, "total_bytes": 10,
+                                    "filename": final})
+    manager.shutdown()
+
+    assert item.streams == {f"{final}.part": [10, 10]}
+
+
+def test_cancel_never_removes_streams_without_a_temp_file(tmp_path):
+    # nopart: yt-dlp يكتب مباشرة في الملف النهائي، فلا يُحذف
+    final = _touch(str(tmp_path), "Title.mp4")
+    manager = DownloadManager(ydl_pool=None, ydl_opts={}, max_workers=1)
+    item = DownloadItem("https://example.com/v", "best", str(tmp_path))
+    manager._update_progress(item, {"status": "downloading", "downloaded_bytes": 1, "filename": final})
+    manager._remove_partial_files(item)
+    manager.shutdown()
+
+    assert os.path.exists(final)
@@ -0,0 +1,23 @@
+from format_index import FORMAT_VIDEO_AUDIO, FormatIndex, build_format_string
+
+
+def _format(format_id, ext, height=None, vcodec="none", acodec="none", abr=None):
+    return {"format_id": format_id, "ext": ext, "height": height, "vcodec": vcodec, "acodec": acodec, "abr": abr}
+
+
+def test_video_audio_fallback_keeps_the_quality_cap():
+    assert build_format_string(FORMAT_VIDEO_AUDIO, "720p") == \
+        "bestvideo[height<=720]+bestaudio/best[height<=720]/best"
+
+
+def test_video_audio_prefers_compatible_audio_then_falls_back_within_quality():
+    index = FormatIndex([
+        _format("137", "mp4", height=1080, vcodec="avc1"),
+        _format("136", "mp4", height=720, vcodec="avc1"),
+        _format("140", "m4a", acodec="mp4a", abr=128),
+        _format("251", "webm", acodec="opus", abr=160),
+    ])
+
+    assert build_format_string(FORMAT_VIDEO_AUDIO, "720p", index) == (
+        "bestvideo[height<=720][ext=mp4]+bestaudio[ext=m4a]/"
+        "bestvideo[height<=720]+bestaudio/best[height<=720]/best")
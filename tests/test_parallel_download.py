@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import yt_dlp
+
+import parallel_download
+from parallel_download import ConnectionBudget, RangedDownload, download_ranged, probe_ranges
+
+CONTENT = os.urandom(200_000)
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    # هل يدعم الخادم Range، وعدد البايتات المرسلة قبل قطع النطاقات في server.drop_starts
+    supports_ranges = True
+    drop_after = 10 * 1024
+
+    def do_GET(self):
+        self.server.requests.append(self.headers.get("Range"))
+        header = self.headers.get("Range")
+        if not header or not self.supports_ranges:
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(CONTENT)))
+            self.end_headers()
+            self.wfile.write(CONTENT)
+            return
+        start, _, end = header.removeprefix("bytes=").partition("-")
+        start, end = int(start), min(int(end), len(CONTENT) - 1)
+        body = CONTENT[start:end + 1]
+        self.send_response(206)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Content-Range", f"bytes {start}-{end}/{len(CONTENT)}")
+        self.end_headers()
+        with self.server.lock:
+            drop = start in self.server.drop_starts
+            self.server.drop_starts.discard(start)
+        if drop:
+            # انقطاع الاتصال في منتصف النطاق
+            self.wfile.write(body[:self.drop_after])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    httpd.requests = []
+    httpd.drop_starts = set()
+    httpd.lock = threading.Lock()
+    thread = threading.Thread(target=httpd.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def ydl(tmp_path):
+    with yt_dlp.YoutubeDL({"quiet": True, "no_warnings": True,
+                           "outtmpl": str(tmp_path / "%(id)s.%(ext)s")}) as ydl:
+        yield ydl
+
+
+def _url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}/video.mp4"
+
+
+def test_probe_ranges_returns_size(server, ydl):
+    assert probe_ranges(ydl, _url(server), {}) == len(CONTENT)
+    assert server.requests == ["bytes=0-0"]
+
+
+def test_probe_ranges_without_range_support(server, ydl, monkeypatch):
+    monkeypatch.setattr(RangeHandler, "supports_ranges", False)
+    assert probe_ranges(ydl, _url(server), {}) is None
+
+
+def test_ranged_download_resumes_dropped_range_from_last_byte(server, ydl, tmp_path, monkeypatch):
+    monkeypatch.setattr(parallel_download, "PARALLEL_READ_SIZE", 1024)
+    chunk_size = 64 * 1024
+    server.drop_starts.add(chunk_size)
+    path = str(tmp_path / "out.part")
+
+    RangedDownload(ydl, _url(server), {}, path, len(CONTENT), connections=2, chunk_size=chunk_size).run()
+
+    with open(path, "rb") as f:
+        assert f.read() == CONTENT
+    dropped = [r for r in server.requests if r.startswith(f"bytes={chunk_size}")]
+    # المحاولة الثانية تطلب ما بعد آخر بايت مكتوب فقط، لا النطاق كاملاً
+    resumed = [r for r in server.requests if r.startswith(f"bytes={chunk_size + RangeHandler.drop_after}-")]
+    assert dropped == [f"bytes={chunk_size}-{2 * chunk_size - 1}"]
+    assert resumed == [f"bytes={chunk_size + RangeHandler.drop_after}-{2 * chunk_size - 1}"]
+
+
+def test_download_ranged_writes_final_file_and_reports_progress(server, ydl, tmp_path, monkeypatch):
+    monkeypatch.setattr(parallel_download, "PARALLEL_MIN_SIZE", 1)
+    statuses = []
+    info = {"id": "v", "title": "v", "ext": "mp4"}
+    resolved = {**info, "url": _url(server), "protocol": "http", "format_id": "18"}
+
+    filename = download_ranged(ydl, info, resolved, connections=3, hooks=[statuses.append])
+
+    assert filename == str(tmp_path / "v.mp4")
+    with open(filename, "rb") as f:
+        assert f.read() == CONTENT
+    assert not os.path.exists(f"{filename}.ranged.part")
+    assert statuses[-1]["status"] == "finished"
+    assert statuses[-1]["downloaded_bytes"] == len(CONTENT)
+
+
+def test_download_ranged_falls_back_below_min_size(server, ydl, monkeypatch):
+    monkeypatch.setattr(parallel_download, "PARALLEL_MIN_SIZE", len(CONTENT) + 1)
+    info = {"id": "v", "title": "v", "ext": "mp4"}
+    resolved = {**info, "url": _url(server), "protocol": "http", "format_id": "18"}
+
+    assert download_ranged(ydl, info, resolved, connections=3, hooks=[]) is None
+
+
+def test_connection_budget_grants_partial_and_waits_when_exhausted():
+    budget = ConnectionBudget(total=4)
+    assert budget.acquire(3) == 3
+    # ما يتوفر فقط، واتصال واحد على الأقل
+    assert budget.acquire(3) == 1
+    assert budget.stats() == {"total": 4, "in_use": 4, "peak_in_use": 4}
+
+    granted = []
+    waiter = threading.Thread(target=lambda: granted.append(budget.acquire(2)))
+    waiter.start()
+    time.sleep(0.1)
+    assert granted == []
+    budget.release(3)
+    waiter.join(timeout=5)
+
+    assert granted == [2]
+    budget.release(1)
+    budget.release(2)
+    assert budget.stats() == {"total": 4, "in_use": 0, "peak_in_use": 4}
+
+
+def test_connection_budget_reserve_releases_on_error():
+    budget = ConnectionBudget(total=2)
+    with pytest.raises(RuntimeError):
+        with budget.reserve(2) as granted:
+            assert granted == 2
+            raise RuntimeError
+    assert budget.in_use == 0
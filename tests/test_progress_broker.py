@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+
+from progress_broker import ProgressBroker, RedisProgressBroker
+
+try:
+    # اعتمادية اختيارية للاختبار فقط: خادم Redis في الذاكرة
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+requires_fakeredis = pytest.mark.skipif(fakeredis is None, reason="fakeredis is not installed")
+
+
+def _in_memory():
+    return ProgressBroker(queue_size=2)
+
+
+def _redis_pair():
+    # ناشر ومشترك بعميلين منفصلين على نفس الخادم، كعاملين مختلفين
+    server = fakeredis.FakeServer()
+    return (RedisProgressBroker(client=fakeredis.aioredis.FakeRedis(server=server)),
+            RedisProgressBroker(client=fakeredis.aioredis.FakeRedis(server=server)))
+
+
+def test_subscribe_starts_with_merged_snapshot():
+    async def scenario():
+        broker = _in_memory()
+        await broker.publish("job", {"status": "downloading", "progress": 10, "total": 100})
+        await broker.publish("job", {"status": "downloading", "progress": 20, "speed": 5})
+        updates = broker.subscribe("job")
+
+        first = await anext(updates)
+        await broker.publish("job", {"status": "finished", "download_url": "/f"})
+        rest = [message async for message in updates]
+        return broker, first, rest
+
+    broker, first, rest = asyncio.run(scenario())
+
+    assert first == {"status": "downloading", "progress": 20, "total": 100, "speed": 5}
+    assert rest == [{"status": "finished", "download_url": "/f"}]
+    assert broker.subscriber_count() == 0
+
+
+def test_subscribe_after_finish_returns_only_the_snapshot():
+    async def scenario():
+        broker = _in_memory()
+        await broker.publish("job", {"status": "downloading", "progress": 50})
+        await broker.publish("job", {"status": "finished"})
+        return [message async for message in broker.subscribe("job")]
+
+    assert asyncio.run(scenario()) == [{"status": "finished", "progress": 50}]
+
+
+def test_slow_subscriber_drops_oldest_messages():
+    async def scenario():
+        broker = _in_memory()
+        await broker.publish("job", {"status": "queued"})
+        updates = broker.subscribe("job")
+        await anext(updates)
+        # الناشر لا ينتظر المشترك البطيء: الطابور يحتفظ بأحدث رسالتين فقط
+        for progress in (10, 20, 30, 40):
+            await broker.publish("job", {"status": "downloading", "progress": progress})
+        received = [await anext(updates), await anext(updates)]
+        await broker.publish("job", {"status": "error", "error": "x"})
+        received += [message async for message in updates]
+        return received
+
+    assert [message.get("progress") for message in asyncio.run(scenario())] == [30, 40, None]
+
+
+def test_forget_drops_the_snapshot():
+    async def scenario():
+        broker = _in_memory()
+        await broker.publish("job", {"status": "finished"})
+        await broker.forget("job")
+        return await broker.snapshot("job")
+
+    assert asyncio.run(scenario()) is None
+
+
+@requires_fakeredis
+def test_redis_broker_delivers_snapshot_then_live_messages_across_workers():
+    async def scenario():
+        publisher, subscriber = _redis_pair()
+        await publisher.publish("job", {"status": "downloading", "progress": 10, "total": 100})
+        await publisher.publish("job", {"status": "downloading", "progress": 20})
+        updates = subscriber.subscribe("job")
+
+        first = await anext(updates)
+        count = subscriber.subscriber_count()
+        await publisher.publish("job", {"status": "downloading", "progress": 90})
+        await publisher.publish("job", {"status": "finished"})
+        rest = [message async for message in updates]
+        snapshot = await subscriber.snapshot("job")
+        after = subscriber.subscriber_count()
+        await publisher.close()
+        await subscriber.close()
+        return first, count, rest, snapshot, after
+
+    first, count, rest, snapshot, after = asyncio.run(scenario())
+
+    assert first == {"status": "downloading", "progress": 20, "total": 100}
+    assert count == 1
+    assert rest == [{"status": "downloading", "progress": 90}, {"status": "finished"}]
+    assert snapshot == {"status": "finished", "progress": 90, "total": 100}
+    assert after == 0
+
+
+@requires_fakeredis
+def test_redis_snapshot_expires_with_ttl():
+    async def scenario():
+        client = fakeredis.aioredis.FakeRedis()
+        broker = RedisProgressBroker(client=client, ttl=60)
+        await broker.publish("job", {"status": "finished"})
+        ttl = await client.ttl(broker._snapshot_key("job"))
+        await broker.close()
+        return ttl
+
+    assert 0 < asyncio.run(scenario()) <= 60
@@ -0,0 +1,80 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from jobs import Job, JobManager
+from rate_limit import RateLimiter, RateLimitedError
+
+
+def test_hit_raises_with_retry_after_when_burst_is_spent():
+    limiter = RateLimiter(per_minute=60, burst=2)
+    limiter.hit("ip:1")
+    limiter.hit("ip:1")
+    with pytest.raises(RateLimitedError) as e:
+        limiter.hit("ip:1")
+    assert 0 < e.value.retry_after <= 1
+    assert limiter.stats()["allowed"] == 2
+    assert limiter.stats()["limited"] == 1
+
+
+def test_rejected_client_id_does_not_spend_ip_token():
+    limiter = RateLimiter(per_minute=60, burst=2)
+    limiter.hit("client:a")
+    limiter.hit("client:a")
+    # عدة client_id خلف نفس العنوان: رفض أحدها لا يستهلك رصيد العنوان المشترك
+    for _ in range(5):
+        with pytest.raises(RateLimitedError):
+            limiter.hit("ip:1", "client:a")
+    limiter.hit("ip:1", "client:b")
+    limiter.hit("ip:1", "client:c")
+    with pytest.raises(RateLimitedError):
+        limiter.hit("ip:1", "client:d")
+
+
+def test_info_endpoint_returns_429_with_retry_after(main_module, monkeypatch):
+    limiter = RateLimiter(per_minute=6, burst=1)
+    monkeypatch.setattr(main_module, "client_limiter", limiter)
+    limiter.hit("ip:testclient")
+
+    response = TestClient(main_module.app).post("/api/info", json={"url": "https://example.com/v"})
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "10"
+
+
+def _job(owner: str, url: str = "https://example.com/v") -> Job:
+    return Job(url, "best", owner)
+
+
+def test_next_runnable_prefers_owner_with_fewer_active_jobs():
+    manager = JobManager(handler=None, workers=4, per_host_limit=10)
+    manager._pending = [_job("a"), _job("a"), _job("a"), _job("b")]
+
+    owners = [manager._next_runnable().owner for _ in range(4)]
+
+    # b ينتظر خلف ثلاث مهام لـ a، لكنه يبدأ ثانيًا لأن a لديه مهمة جارية
+    assert owners == ["a", "b", "a", "a"]
+
+
+def test_next_runnable_alternates_between_equal_owners():
+    manager = JobManager(handler=None, workers=1, per_host_limit=10)
+    manager._pending = [_job("a"), _job("a"), _job("b"), _job("b")]
+
+    owners = []
+    while manager._pending:
+        job = manager._next_runnable()
+        owners.append(job.owner)
+        # انتهاء المهمة قبل بدء التالية (عامل واحد)
+        manager._owner_active[job.owner] -= 1
+        manager._host_active[job.host] -= 1
+
+    assert owners == ["a", "b", "a", "b"]
+
+
+def test_next_runnable_respects_per_host_limit():
+    manager = JobManager(handler=None, workers=4, per_host_limit=1)
+    manager._pending = [_job("a", "https://one.example/v"), _job("a", "https://one.example/w"),
+                        _job("b", "https://two.example/v")]
+
+    assert manager._next_runnable().host == "one.example"
+    assert manager._next_runnable().host == "two.example"
+    assert manager._next_runnable() is None
@@ -0,0 +1,149 @@
+import asyncio
+import io
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import thumbnails
+from format_tokens import encode_format_token
+from thumbnails import ThumbnailCache, ThumbnailError, snap_width
+
+SOURCE_URL = "https://i.example.com/vi/abc/maxresdefault.jpg"
+
+
+def _png(width: int = 1, height: int = 1) -> bytes:
+    if thumbnails.Image is None:
+        return b"\x89PNG\r\n\x1a\n" + b"\0" * 64
+    out = io.BytesIO()
+    thumbnails.Image.new("RGB", (width, height), "red").save(out, "PNG")
+    return out.getvalue()
+
+
+class FakeFetch:
+    def __init__(self, data: bytes = None, delay: float = 0):
+        self.data = _png(1280, 720) if data is None else data
+        self.delay = delay
+        self.calls = []
+
+    def __call__(self, url: str, max_bytes: int) -> bytes:
+        self.calls.append(url)
+        time.sleep(self.delay)
+        if isinstance(self.data, Exception):
+            raise self.data
+        return self.data
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ThumbnailCache(str(tmp_path / "thumbnails"), FakeFetch())
+
+
+@pytest.fixture
+def client(main_module, cache, monkeypatch):
+    monkeypatch.setattr(main_module, "thumbnail_cache", cache)
+    return TestClient(main_module.app)
+
+
+def _path(url: str = SOURCE_URL) -> str:
+    return f"/api/thumbnail/{encode_format_token({'i': url})}"
+
+
+def test_snap_width_rounds_up_to_allowed_widths():
+    assert snap_width(None) == 320
+    assert snap_width(1) == 160
+    assert snap_width(160) == 160
+    assert snap_width(161) == 320
+    assert snap_width(5000) == 640
+
+
+def test_thumbnail_endpoint_returns_etag_and_304(client, cache):
+    response = client.get(_path(), params={"w": 200})
+
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert response.headers["Vary"] == "Accept"
+    assert response.content == cache._memory[next(iter(cache._memory))].data
+
+    for if_none_match in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+        cached = client.get(_path(), params={"w": 200}, headers={"If-None-Match": if_none_match})
+        assert cached.status_code == 304
+        assert cached.headers["ETag"] == etag
+        assert cached.content == b""
+    assert client.get(_path(), params={"w": 200}, headers={"If-None-Match": '"other"'}).status_code == 200
+    assert cache.fetch.calls == [SOURCE_URL]
+
+
+def test_thumbnail_endpoint_head_has_no_body(client):
+    response = client.head(_path())
+
+    assert response.status_code == 200
+    assert response.content == b""
+    assert int(response.headers["Content-Length"]) > 0
+
+
+@pytest.mark.parametrize("token", [
+    "not-a-token",
+    encode_format_token({"i": SOURCE_URL}, secret=b"another-secret"),
+    encode_format_token({"f": "18"}),
+    "غير.صالح",
+])
+def test_thumbnail_endpoint_rejects_invalid_tokens(client, cache, token):
+    assert client.get(f"/api/thumbnail/{token}").status_code == 400
+    assert cache.fetch.calls == []
+
+
+def test_thumbnail_endpoint_rejects_unknown_format(client):
+    assert client.get(_path(), params={"format": "gif"}).status_code == 400
+
+
+def test_thumbnail_endpoint_reports_fetch_errors(client, cache):
+    cache.fetch.data = OSError("connection refused")
+    assert client.get(_path()).status_code == 502
+    assert cache.stats()["fetch_errors"] == 1
+
+
+def test_concurrent_requests_fetch_the_source_once(cache):
+    cache.fetch.delay = 0.1
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get(SOURCE_URL, width) for width in (100, 150, 160, 300, 320)))
+
+    results = asyncio.run(scenario())
+
+    assert cache.fetch.calls == [SOURCE_URL]
+    # العروض المتقاربة تُقرب إلى نفس النسخة
+    assert results[0] is results[1] is results[2]
+    assert results[3] is results[4]
+
+
+def test_cached_files_survive_restart(cache):
+    first = asyncio.run(cache.get(SOURCE_URL, 320))
+    restarted = ThumbnailCache(cache.directory, FakeFetch(ThumbnailError("should not fetch")))
+
+    second = asyncio.run(restarted.get(SOURCE_URL, 320))
+
+    assert second.data == first.data
+    assert second.etag == first.etag
+    assert restarted.fetch.calls == []
+
+
+def test_missing_pillow_serves_original_and_logs_once(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(thumbnails, "Image", None)
+    source = b"\xff\xd8\xff" + b"\0" * 32
+    cache = ThumbnailCache(str(tmp_path), FakeFetch(source))
+
+    assert "Pillow is not installed" in capsys.readouterr().out
+    thumbnail = asyncio.run(cache.get(SOURCE_URL, 160, "webp"))
+    assert thumbnail.data == source
+    assert thumbnail.media_type == "image/jpeg"
+    assert "Pillow" not in capsys.readouterr().out
+
+
+@pytest.mark.skipif(thumbnails.Image is None, reason="Pillow is not installed")
+def test_resize_to_snapped_width(cache):
+    thumbnail = asyncio.run(cache.get(SOURCE_URL, 300, "jpeg"))
+
+    assert thumbnail.media_type == "image/jpeg"
+    with thumbnails.Image.open(io.BytesIO(thumbnail.data)) as image:
+        assert image.size == (320, 180)
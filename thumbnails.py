@@ -0,0 +1,308 @@
+import io
+import os
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+
+from singleflight import SingleFlight
+
+try:
+    # اعتمادية اختيارية: بدونها تُخدم الصورة الأصلية كما هي (مع نفس التخزين المؤقت)
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# الحد الأقصى لحجم الصور المصغرة على القرص (الأصلية والمصغرة معًا، بالبايت)
+THUMBNAIL_CACHE_MAX_BYTES = int(os.environ.get("THUMBNAIL_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# الحد الأقصى للصور المصغرة المحفوظة في الذاكرة (بالبايت)
+THUMBNAIL_MEMORY_MAX_BYTES = int(os.environ.get("THUMBNAIL_MEMORY_MAX_BYTES", str(16 * 1024 * 1024)))
+# العروض المسموح بها بالبكسل؛ أي عرض آخر يُقرب إلى أقرب عرض أكبر منه حتى لا تتضاعف النسخ
+THUMBNAIL_WIDTHS = tuple(sorted(int(w) for w in os.environ.get("THUMBNAIL_WIDTHS", "160,320,480,640").split(",")))
+# العرض المستخدم إذا لم يحدده الطلب
+THUMBNAIL_DEFAULT_WIDTH = int(os.environ.get("THUMBNAIL_DEFAULT_WIDTH", "320"))
+# جودة ضغط WebP و JPEG (1-100)
+THUMBNAIL_QUALITY = int(os.environ.get("THUMBNAIL_QUALITY", "80"))
+# أكبر صورة أصلية تُقبل من المصدر (بالبايت)
+THUMBNAIL_MAX_SOURCE_BYTES = int(os.environ.get("THUMBNAIL_MAX_SOURCE_BYTES", str(10 * 1024 * 1024)))
+
+THUMBNAIL_FORMATS = {"webp": "image/webp", "jpeg": "image/jpeg"}
+
+SOURCE_SUFFIX = ".src"
+
+
+class ThumbnailError(Exception):
+    pass
+
+
+class Thumbnail:
+    __slots__ = ("data", "media_type", "etag")
+
+    def __init__(self, data: bytes, media_type: str):
+        self.data = data
+        self.media_type = media_type
+        # المحتوى لا يتغير لنفس المفتاح، فالبصمة تكفي وسمًا ثابتًا عبر إعادة التشغيل والخوادم
+        self.etag = f'"{hashlib.sha256(data).hexdigest()[:32]}"'
+
+
+def sniff_media_type(data: bytes) -> str:
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return "application/octet-stream"
+
+
+def snap_width(width: int = None) -> int:
+    if not width:
+        width = THUMBNAIL_DEFAULT_WIDTH
+    for allowed in THUMBNAIL_WIDTHS:
+        if width <= allowed:
+            return allowed
+    return THUMBNAIL_WIDTHS[-1]
+
+
+def read_limited(response, max_bytes: int = THUMBNAIL_MAX_SOURCE_BYTES, chunk_size: int = 64 * 1024) -> bytes:
+    """قراءة جسم الاستجابة كاملاً، أو رفع ThumbnailError إذا تجاوز الحد."""
+    chunks = []
+    total = 0
+    while True:
+        chunk = response.read(chunk_size)
+        if not chunk:
+            return b"".join(chunks)
+        total += len(chunk)
+        if total > max_bytes:
+            raise ThumbnailError(f"Thumbnail is larger than {max_bytes} bytes")
+        chunks.append(chunk)
+
+
+def resize(source: bytes, width: int, image_format: str, quality: int = THUMBNAIL_QUALITY) -> bytes:
+    with Image.open(io.BytesIO(source)) as image:
+        # JPEG: فك الترميز بدقة مخفضة مباشرة بدلاً من فك الصورة كاملة ثم تصغيرها
+        image.draft("RGB", (width, width))
+        image = image.convert("RGBA" if image_format == "webp" and image.mode in ("RGBA", "LA", "P") else "RGB")
+        # لا تكبير: الصور الأصغر من العرض المطلوب تُعاد ترميزًا فقط
+        image.thumbnail((width, width * 4))
+        out = io.BytesIO()
+        if image_format == "webp":
+            image.save(out, "WEBP", quality=quality, method=4)
+        else:
+            image.save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+        return out.getvalue()
+
+
+class ThumbnailCache:
+    """الصور المصغرة للفيديوهات: تُجلب من المصدر مرة واحدة وتُخدم نسخًا مصغرة (WebP/JPEG).
+
+    الصورة الأصلية وكل نسخة (عرض، صيغة) تُحفظ على القرص بحد أقصى للحجم (إزالة الأقدم
+    استخدامًا)، والنسخ الأكثر طلبًا تبقى في الذاكرة. الطلبات المتزامنة لنفس النسخة أو لنفس
+    الصورة الأصلية تنتظر عملية جلب أو تصغير واحدة.
+
+    fetch(url, max_bytes) دالة متزامنة تعيد محتوى الصورة من المصدر وتُنفذ في executor.
+    """
+
+    def __init__(self, directory: str, fetch, executor=None, max_bytes: int = THUMBNAIL_CACHE_MAX_BYTES,
+                 memory_max_bytes: int = THUMBNAIL_MEMORY_MAX_BYTES):
+        self.directory = directory
+        self.fetch = fetch
+        self.executor = executor
+        self.max_bytes = max_bytes
+        self.memory_max_bytes = memory_max_bytes
+        self.resize_enabled = Image is not None
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self.fetch_errors = 0
+        self.evictions = 0
+        self.memory_bytes = 0
+        # name -> Thumbnail
+        self._memory: OrderedDict[str, Thumbnail] = OrderedDict()
+        # name -> [size, last_access] لكل ملف على القرص
+        self._files: dict[str, list] = {}
+        self._lock = threading.Lock()
+        self._variant_flight = SingleFlight()
+        self._source_flight = SingleFlight()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+        if not self.resize_enabled:
+            print("Pillow is not installed: thumbnails are served at their original size without resizing")
+
+    def _load(self):
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".tmp"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                stat_result = os.stat(path)
+            except OSError:
+                continue
+            self._files[name] = [stat_result.st_size, stat_result.st_mtime]
+        print(f"Thumbnail cache loaded: {len(self._files)} files, {self.disk_bytes} bytes")
+
+    @property
+    def disk_bytes(self) -> int:
+        with self._lock:
+            return sum(size for size, _ in self._files.values())
+
+    @staticmethod
+    def source_key(url: str) -> str:
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def variant_name(self, url: str, width: int, image_format: str) -> str:
+        if not self.resize_enabled:
+            # بدون Pillow النسخة الوحيدة هي الأصلية
+            return f"{self.source_key(url)}{SOURCE_SUFFIX}"
+        return f"{self.source_key(url)}-{width}.{image_format}"
+
+    async def get(self, url: str, width: int = None, image_format: str = "webp") -> Thumbnail:
+        width = snap_width(width)
+        if image_format not in THUMBNAIL_FORMATS:
+            image_format = "webp"
+        name = self.variant_name(url, width, image_format)
+        with self._lock:
+            thumbnail = self._memory.get(name)
+            if thumbnail is not None:
+                self._memory.move_to_end(name)
+                self.hits += 1
+                return thumbnail
+        return await self._variant_flight.do(name, lambda: self._produce(name, url, width, image_format))
+
+    async def _produce(self, name: str, url: str, width: int, image_format: str) -> Thumbnail:
+        data = await asyncio.to_thread(self._read, name)
+        if data is not None:
+            with self._lock:
+                self.hits += 1
+        else:
+            with self._lock:
+                self.misses += 1
+            source = await self._source_flight.do(self.source_key(url), lambda: self._source(url))
+            if not self.resize_enabled:
+                data = source
+            else:
+                try:
+                    data = await asyncio.to_thread(resize, source, width, image_format)
+                except (OSError, ValueError, Image.DecompressionBombError) as e:
+                    raise ThumbnailError(f"Thumbnail could not be decoded: {e}")
+                await asyncio.to_thread(self._write, name, data)
+        media_type = THUMBNAIL_FORMATS[image_format] if self.resize_enabled else sniff_media_type(data)
+        thumbnail = Thumbnail(data, media_type)
+        self._remember(name, thumbnail)
+        return thumbnail
+
+    async def _source(self, url: str) -> bytes:
+        name = f"{self.source_key(url)}{SOURCE_SUFFIX}"
+        data = await asyncio.to_thread(self._read, name)
+        if data is not None:
+            return data
+        with self._lock:
+            self.fetches += 1
+        try:
+            data = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.fetch, url, THUMBNAIL_MAX_SOURCE_BYTES)
+        except Exception as e:
+            with self._lock:
+                self.fetch_errors += 1
+            raise ThumbnailError(f"Thumbnail fetch failed: {e}")
+        if not data:
+            with self._lock:
+                self.fetch_errors += 1
+            raise ThumbnailError("Thumbnail is empty")
+        await asyncio.to_thread(self._write, name, data)
+        return data
+
+    def _read(self, name: str):
+        try:
+            with open(os.path.join(self.directory, name), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self._files.pop(name, None)
+            return None
+        with self._lock:
+            if name in self._files:
+                self._files[name][1] = time.time()
+        return data
+
+    def _write(self, name: str, data: bytes):
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            # قد يُحذف المجلد أثناء التشغيل، فيُعاد إنشاؤه بدلاً من فشل كل طلب حتى إعادة التشغيل
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise ThumbnailError(f"Thumbnail could not be cached: {e}")
+        with self._lock:
+            self._files[name] = [len(data), time.time()]
+            self._evict(keep=name)
+
+    def _evict(self, keep: str):
+        total = sum(size for size, _ in self._files.values())
+        for name, (size, _) in sorted(self._files.items(), key=lambda item: item[1][1]):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Error evicting cached thumbnail {name}: {e}")
+                continue
+            del self._files[name]
+            self._memory_forget(name)
+            total -= size
+            self.evictions += 1
+
+    def _remember(self, name: str, thumbnail: Thumbnail):
+        size = len(thumbnail.data)
+        if size > self.memory_max_bytes:
+            return
+        with self._lock:
+            self._memory_forget(name)
+            self._memory[name] = thumbnail
+            self.memory_bytes += size
+            while self.memory_bytes > self.memory_max_bytes:
+                self._memory_forget(next(iter(self._memory)))
+
+    def _memory_forget(self, name: str):
+        thumbnail = self._memory.pop(name, None)
+        if thumbnail is not None:
+            self.memory_bytes -= len(thumbnail.data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "resize_enabled": self.resize_enabled,
+                "widths": list(THUMBNAIL_WIDTHS),
+                "memory_entries": len(self._memory),
+                "memory_bytes": self.memory_bytes,
+                "memory_max_bytes": self.memory_max_bytes,
+                "disk_files": len(self._files),
+                "disk_bytes": sum(size for size, _ in self._files.values()),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "fetches": self.fetches,
+                "fetch_errors": self.fetch_errors,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+                "in_flight": self._variant_flight.in_flight(),
+            }
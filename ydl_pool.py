@@ -0,0 +1,168 @@
+import os
+import json
+import threading
+from contextlib import contextmanager
+
+from lazy_import import lazy_import
+
+# يُستورد عند إنشاء أول كائن YoutubeDL وليس عند بدء التشغيل
+yt_dlp = lazy_import("yt_dlp")
+
+# الحد الأقصى لعدد كائنات YoutubeDL الخاملة المحفوظة لكل مجموعة خيارات
+YDL_POOL_SIZE = int(os.environ.get("YDL_POOL_SIZE", "4"))
+# عدد مرات استخدام الكائن قبل استبداله بكائن جديد (لتجنب تراكم الحالة الداخلية)
+YDL_POOL_MAX_USES = int(os.environ.get("YDL_POOL_MAX_USES", "50"))
+
+# قيمة خيار لم يكن موجودًا في الخيارات الأصلية: يُحذف عند إرجاع الكائن بدلاً من ضبطه على None
+_MISSING = object()
+
+
+def profile_key(opts: dict) -> str:
+    return json.dumps(opts, sort_keys=True, default=repr, ensure_ascii=False)
+
+
+class YoutubeDLPool:
+    """مجمع كائنات yt_dlp.YoutubeDL جاهزة، مجمعة حسب الخيارات الثابتة (profile).
+
+    إنشاء YoutubeDL جديد لكل طلب يعني تهيئة المستخرجات وملف الكوكيز وفتح اتصالات
+    TLS جديدة في كل مرة. هنا يُعاد استخدام نفس الكائن، فتبقى اتصالات keep-alive
+    (عبر معالج requests في yt-dlp) مفتوحة لنفس خوادم CDN بين الطلبات.
+
+    كل كائن يستخدمه خيط واحد فقط في كل مرة (checkout ثم إعادة). الخيارات التي
+    تختلف بين الطلبات (format و outtmpl و progress_hooks وغيرها) تُمرر كـ overrides
+    وتُعاد إلى قيمها الأصلية عند إرجاع الكائن.
+    """
+
+    def __init__(self, max_idle: int = YDL_POOL_SIZE, max_uses: int = YDL_POOL_MAX_USES):
+        self.max_idle = max_idle
+        self.max_uses = max_uses
+        self.checkouts = 0
+        self.created = 0
+        self.reused = 0
+        self.recycled = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self._idle: dict[str, list] = {}
+        self._uses: dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def _create(self, opts: dict):
+        ydl = yt_dlp.YoutubeDL(dict(opts))
+        with self._lock:
+            self.created += 1
+        return ydl
+
+    def prewarm(self, opts: dict, count: int = 1):
+        """إنشاء كائنات مسبقًا لمجموعة خيارات معينة (مثل خيارات جلب المعلومات)."""
+        key = profile_key(opts)
+        with self._lock:
+            missing = min(count, self.max_idle) - len(self._idle.get(key, []))
+        for _ in range(missing):
+            ydl = self._create(opts)
+            with self._lock:
+                self._idle.setdefault(key, []).append(ydl)
+
+    @staticmethod
+    def _apply(ydl, overrides: dict):
+        for name, value in overrides.items():
+            if value is _MISSING:
+                ydl.params.pop(name, None)
+                if name == 'format':
+                    ydl.format_selector = None
+                elif name == 'outtmpl':
+                    ydl._parse_outtmpl()
+            elif name == 'progress_hooks':
+                # لا توجد واجهة عامة لإزالة الخطافات، لذا نستبدل القائمة نفسها
+                ydl._progress_hooks.clear()
+                for hook in value:
+                    ydl.add_progress_hook(hook)
+            elif name in ('postprocessor_hooks', 'post_hooks'):
+                # المعالجات اللاحقة (الدمج ونقل الملفات) تُنشأ لكل تنزيل وتنسخ الخطافات عند إنشائها
+                hooks = ydl._postprocessor_hooks if name == 'postprocessor_hooks' else ydl._post_hooks
+                hooks[:] = value
+            elif name == 'outtmpl':
+                ydl.params['outtmpl'] = value if isinstance(value, dict) else {'default': value}
+                ydl._parse_outtmpl()
+            elif name == 'format':
+                ydl.params['format'] = value
+                ydl.format_selector = ydl.build_format_selector(value) if value else None
+            else:
+                ydl.params[name] = value
+
+    @contextmanager
+    def checkout(self, opts: dict, **overrides):
+        key = profile_key(opts)
+        with self._lock:
+            idle = self._idle.get(key)
+            ydl = idle.pop() if idle else None
+            if ydl is not None:
+                self.reused += 1
+        if ydl is None:
+            ydl = self._create(opts)
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+        originals = {name: opts.get(name, _MISSING) for name in overrides}
+        for name in ('progress_hooks', 'postprocessor_hooks', 'post_hooks'):
+            if name in overrides:
+                originals[name] = opts.get(name, [])
+        healthy = True
+        try:
+            self._apply(ydl, overrides)
+            yield ydl
+        except yt_dlp.utils.YoutubeDLError:
+            # أخطاء التنزيل والاستخراج العادية لا تفسد الكائن
+            raise
+        except BaseException:
+            healthy = False
+            raise
+        finally:
+            with self._lock:
+                self.in_use -= 1
+            self._release(key, ydl, originals, healthy)
+
+    def _release(self, key: str, ydl, originals: dict, healthy: bool):
+        if healthy:
+            try:
+                self._apply(ydl, originals)
+            except Exception as e:
+                print(f"Error resetting pooled YoutubeDL: {e}")
+                healthy = False
+        with self._lock:
+            uses = self._uses.pop(id(ydl), 0) + 1
+            idle = self._idle.setdefault(key, [])
+            keep = healthy and uses < self.max_uses and len(idle) < self.max_idle
+            if keep:
+                idle.append(ydl)
+                self._uses[id(ydl)] = uses
+            elif healthy and uses >= self.max_uses:
+                self.recycled += 1
+        if not keep:
+            ydl.close()
+
+    def close(self):
+        with self._lock:
+            instances = [ydl for idle in self._idle.values() for ydl in idle]
+            self._idle.clear()
+            self._uses.clear()
+        for ydl in instances:
+            try:
+                ydl.close()
+            except Exception as e:
+                print(f"Error closing pooled YoutubeDL: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "profiles": len(self._idle),
+                "idle": sum(len(idle) for idle in self._idle.values()),
+                "in_use": self.in_use,
+                "peak_in_use": self.peak_in_use,
+                "checkouts": self.checkouts,
+                "created": self.created,
+                "reused": self.reused,
+                "recycled": self.recycled,
+                "reuse_ratio": round(self.reused / self.checkouts, 3) if self.checkouts else None,
+            }